@@ -1,12 +1,36 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, get_flashed_messages
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for, flash, get_flashed_messages, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
-import random
+import json
+import click
 import requests
 import os
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait as wait_futures
 from dotenv import load_dotenv
+import numpy as np
+from sqlalchemy import Integer, String, and_, inspect, select, func, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased, load_only
+from ingestion import IngestionPipeline
+from tmdb_client import TMDbClient, CircuitBreaker
+from tmdb_cache import ResponseCache
+import search_index
+from catalog import CatalogMovie, MovieCatalog
+import recommender
+import db_setup
+import snapshot
+import similarity
+import collaborative
+from jobs import JobQueue, job_to_dict
+from lru_cache import LRUCache
+import http_cache
+from metrics import Metrics
 
 load_dotenv()
 
@@ -14,6 +38,8 @@ def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated or not current_user.is_admin:
+            if request.path.startswith('/api/'):
+                return jsonify({"error": "Forbidden: administrative access required"}), 403
             flash('Forbidden: You do not have administrative access.', 'danger')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
@@ -42,12 +68,156 @@ if not TMDB_API_KEY:
     raise RuntimeError("TMDB_API_KEY could not be found in Docker Secrets or environment variables.")
 # ---------------------------------------------------------
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db?timeout=20'
+# DATABASE_URL selects the database (SQLite file by default, PostgreSQL in production)
+app.config['SQLALCHEMY_DATABASE_URI'] = db_setup.database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_setup.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Route the SELECTs of GET requests to a read-only connection pool (SQLite file or DATABASE_READ_URL)
+app.config['SQLALCHEMY_READONLY_POOL'] = os.environ.get('SQLALCHEMY_READONLY_POOL', '1') == '1'
+# Concurrency and request ceiling used when loading movies from TMDb
+app.config['TMDB_MAX_WORKERS'] = int(os.environ.get('TMDB_MAX_WORKERS', 8))
+app.config['TMDB_REQUESTS_PER_SECOND'] = float(os.environ.get('TMDB_REQUESTS_PER_SECOND', 20))
+TMDB_MAX_PAGE = 500 # TMDb serves no list page beyond this
+# /search-movie answers from the local catalog and only asks TMDb when it finds fewer than this many
+app.config['SEARCH_MIN_LOCAL_RESULTS'] = int(os.environ.get('SEARCH_MIN_LOCAL_RESULTS', 5))
+app.config['SEARCH_RESULTS_LIMIT'] = 20
+# Longest /search-movie waits on TMDb; slower lookups finish in the background and enrich the catalog
+app.config['SEARCH_REMOTE_TIMEOUT'] = float(os.environ.get('SEARCH_REMOTE_TIMEOUT', 2.5))
+# TMDb searches queued or running at once; beyond that /search-movie answers from the local catalog only
+app.config['SEARCH_REMOTE_MAX_PENDING'] = int(os.environ.get('SEARCH_REMOTE_MAX_PENDING', 16))
+app.config['SEARCH_ENRICH_CATALOG'] = True
+# Default /random-movie strategy: 'genre' (random pick among liked genres) or 'recommend' (affinity-weighted)
+app.config['RANDOM_MOVIE_MODE'] = os.environ.get('RANDOM_MOVIE_MODE', 'genre')
+app.config['API_MOVIES_MAX_PER_PAGE'] = 100
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000)) # Rows fetched and written per NDJSON chunk
+app.config['FRIENDS_PER_PAGE'] = 50 # Users offered on the "Add New Friend" list per page
+app.config['SHARED_MOVIES_PER_PAGE'] = 24
+app.config['PREFERENCES_BATCH_LIMIT'] = 500
+# Per-user queue of upcoming recommendations: its length, and the size below which it is refilled
+app.config['RECOMMENDATION_QUEUE_SIZE'] = int(os.environ.get('RECOMMENDATION_QUEUE_SIZE', 50))
+app.config['RECOMMENDATION_QUEUE_LOW_WATER'] = int(os.environ.get('RECOMMENDATION_QUEUE_LOW_WATER', 10))
+app.config['RECOMMENDATION_SERVED_HISTORY'] = 500 # Served movies remembered per user so refills skip them
+# "More like this" index: memory-mapped files shared by all workers on the host
+app.config['SIMILARITY_INDEX_PATH'] = os.environ.get('SIMILARITY_INDEX_PATH', os.path.join(app.instance_path, 'similarity'))
+app.config['SIMILARITY_DIM'] = int(os.environ.get('SIMILARITY_DIM', 256))
+app.config['SIMILARITY_K'] = int(os.environ.get('SIMILARITY_K', 20))
+# Item-item collaborative filtering: neighbours kept per movie, users two movies need in common,
+# and the weight of its score next to genre affinity in 'recommend' mode (0 turns it off)
+app.config['COLLABORATIVE_K'] = int(os.environ.get('COLLABORATIVE_K', 20))
+app.config['COLLABORATIVE_MIN_COMMON'] = int(os.environ.get('COLLABORATIVE_MIN_COMMON', 2))
+app.config['COLLABORATIVE_WEIGHT'] = float(os.environ.get('COLLABORATIVE_WEIGHT', 0.5))
+# Preference writes queue a neighbour rebuild at most this often (0 leaves rebuilds to `flask build-neighbours`)
+app.config['COLLABORATIVE_REBUILD_SECONDS'] = float(os.environ.get('COLLABORATIVE_REBUILD_SECONDS', 3600))
+# Group movie night: largest group, weight of the least happy member in the group score, and cached rankings per group
+app.config['GROUP_MAX_MEMBERS'] = int(os.environ.get('GROUP_MAX_MEMBERS', 20))
+app.config['GROUP_MISERY_WEIGHT'] = float(os.environ.get('GROUP_MISERY_WEIGHT', 0.5))
+app.config['GROUP_CACHE_SIZE'] = int(os.environ.get('GROUP_CACHE_SIZE', 256))
+app.config['GROUP_CACHE_SECONDS'] = float(os.environ.get('GROUP_CACHE_SECONDS', 300)) # Bounds staleness from neighbour rebuilds
+# Cached JSON responses per worker (keyed on data version counters), and compression of large responses
+app.config['RESPONSE_CACHE_SIZE'] = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+app.config['RESPONSE_CACHE_SECONDS'] = float(os.environ.get('RESPONSE_CACHE_SECONDS', 300))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+# Prometheus metrics: per-worker files that /metrics sums, an optional bearer token for scrapes,
+# and the duration above which a request is logged as slow
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
+# How often a worker checks the genre table's version stamp, and how old the genres may get before a background refresh
+app.config['GENRES_CHECK_SECONDS'] = float(os.environ.get('GENRES_CHECK_SECONDS', 60))
+app.config['GENRES_REFRESH_SECONDS'] = float(os.environ.get('GENRES_REFRESH_SECONDS', 3 * 24 * 3600))
+# Background job threads per gunicorn worker (0 disables them; jobs then wait for a worker that has some)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 1))
+# A running job whose heartbeat is older than this is assumed dead and queued again
+app.config['JOB_STALE_SECONDS'] = float(os.environ.get('JOB_STALE_SECONDS', 300))
+# A job found stale this many times (it keeps killing or hanging its worker) is marked failed instead
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# Finished and failed jobs are deleted this long after they end
+app.config['JOB_RETENTION_SECONDS'] = float(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+db = SQLAlchemy(app, session_options={'class_': db_setup.RoutingSession})
+db_setup.init_app(app, db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# TMDb response cache shared by all workers through a SQLite file next to site.db.
+# Set TMDB_CACHE_PATH to an empty string to keep only the in-memory tier.
+tmdb_cache_path = os.environ.get('TMDB_CACHE_PATH', os.path.join(app.instance_path, 'tmdb_cache.db'))
+if tmdb_cache_path:
+    os.makedirs(os.path.dirname(os.path.abspath(tmdb_cache_path)), exist_ok=True)
+
+metrics = Metrics(app.config['METRICS_DIR'])
+metrics.counter('http_requests_total', 'HTTP requests by endpoint, method and status.')
+metrics.histogram('http_request_duration_seconds', 'Time to build a response, by endpoint.')
+metrics.histogram('http_request_db_queries', 'SQL statements run by one request, by endpoint.', buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+metrics.histogram('http_request_db_seconds', 'Time one request spent in SQL, by endpoint.')
+metrics.counter('tmdb_requests_total', 'TMDb HTTP attempts (retries included) by endpoint and status.')
+metrics.histogram('tmdb_request_duration_seconds', 'Latency of TMDb HTTP attempts, by endpoint.')
+
+def _record_tmdb_call(endpoint, seconds, status):
+    metrics.inc('tmdb_requests_total', {'endpoint': endpoint, 'status': status})
+    metrics.observe('tmdb_request_duration_seconds', seconds, {'endpoint': endpoint})
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.query_stats = db_setup.start_tracking()
+
+# Registered before the other after_request hooks, so it runs last and its timing includes them
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    queries = g.query_stats
+    endpoint = request.endpoint or 'unmatched' # Unrouted paths share one label
+    metrics.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': response.status_code})
+    metrics.observe('http_request_duration_seconds', elapsed, {'endpoint': endpoint})
+    metrics.observe('http_request_db_queries', queries['queries'], {'endpoint': endpoint})
+    metrics.observe('http_request_db_seconds', queries['seconds'], {'endpoint': endpoint})
+    if elapsed >= app.config['SLOW_REQUEST_SECONDS']:
+        # The fields also go on the record as attributes, for JSON formatters and log collectors
+        fields = {
+            'event': 'slow_request',
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode('utf-8', 'replace'),
+            'status': response.status_code,
+            'seconds': round(elapsed, 4),
+            'db_queries': queries['queries'],
+            'db_seconds': round(queries['seconds'], 4),
+            'user_id': current_user.get_id(),
+        }
+        app.logger.warning("Slow request: %s %s took %.3fs (%d DB queries)",
+                           request.method, request.full_path.rstrip('?'), elapsed, queries['queries'], extra=fields)
+    return response
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    if 'query_stats' in g:
+        db_setup.stop_tracking(g.query_stats)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Shared TMDb client: pooled keep-alive connections, timeouts, retries and a circuit breaker
+tmdb = TMDbClient(
+    TMDB_API_KEY,
+    timeout=(float(os.environ.get('TMDB_CONNECT_TIMEOUT', 3.05)), float(os.environ.get('TMDB_READ_TIMEOUT', 10))),
+    max_retries=int(os.environ.get('TMDB_MAX_RETRIES', 3)),
+    pool_maxsize=max(app.config['TMDB_MAX_WORKERS'], 10),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('TMDB_BREAKER_THRESHOLD', 5)),
+        reset_timeout=float(os.environ.get('TMDB_BREAKER_RESET_SECONDS', 30)),
+    ),
+    cache=ResponseCache(tmdb_cache_path, max_entries=int(os.environ.get('TMDB_CACHE_MAX_ENTRIES', 2048))),
+    on_request=_record_tmdb_call,
+)
+
 TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500/"
 TMDB_YOUTUBE_BASE_URL = "https://www.youtube.com/embed/"
 
@@ -67,18 +237,13 @@ class User(UserMixin, db.Model):
     friends_a = db.relationship('Friendship', foreign_keys='Friendship.user_id', backref='user_a', lazy='dynamic')
     friends_b = db.relationship('Friendship', foreign_keys='Friendship.friend_id', backref='user_b', lazy='dynamic')
 
+    def friend_ids_query(self):
+        # Friendships are stored once, in either direction; each side of the UNION has its own index
+        return (select(Friendship.friend_id).where(Friendship.user_id == self.id)
+                .union(select(Friendship.user_id).where(Friendship.friend_id == self.id)))
+
     def get_friends(self):
-        # Get friends where current user is user_id
-        as_user_a = Friendship.query.filter_by(user_id=self.id).all()
-        # Get friends where current user is friend_id
-        as_user_b = Friendship.query.filter_by(friend_id=self.id).all()
-
-        friends = []
-        for friendship in as_user_a:
-            friends.append(db.session.get(User, friendship.friend_id))
-        for friendship in as_user_b:
-            friends.append(db.session.get(User, friendship.user_id))
-        return friends
+        return User.query.filter(User.id.in_(self.friend_ids_query())).order_by(User.username).all()
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -91,7 +256,10 @@ class Friendship(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     friend_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'friend_id', name='_user_friend_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'friend_id', name='_user_friend_uc'), # Also serves lookups by user_id
+        db.Index('ix_friendship_friend_id', 'friend_id'),
+    )
 
 # User Movie Preference Model
 class UserMoviePreference(db.Model):
@@ -102,6 +270,13 @@ class UserMoviePreference(db.Model):
     genres = db.Column(db.String(255), nullable=True) # New: Store genres as string
     preference = db.Column(db.Boolean, nullable=False) # True for liked, False for disliked
 
+    __table_args__ = (
+        # One row per user and movie; also the conflict target of upsert_preferences
+        db.Index('uq_user_movie_preference_user_tmdb', 'user_id', 'tmdb_id', unique=True),
+        # Covers "movies this user liked" and the shared-likes self-join on tmdb_id
+        db.Index('ix_user_movie_preference_user_pref_tmdb', 'user_id', 'preference', 'tmdb_id'),
+    )
+
 class Movie(db.Model):
     id = db.Column(db.Integer, primary_key=True) # Our internal ID
     tmdb_id = db.Column(db.Integer, unique=True, nullable=False) # TMDb ID
@@ -114,27 +289,343 @@ class Movie(db.Model):
     genres = db.Column(db.String(255), nullable=True) # Comma-separated genre names
     genre_ids = db.Column(db.String(255), nullable=True) # Comma-separated genre IDs
     cast = db.Column(db.String(500), nullable=True) # Comma-separated cast names
+    updated_seq = db.Column(db.Integer, nullable=True, index=True) # Catalog update sequence of the last in-place change
+
+class Genre(db.Model):
+    id = db.Column(db.Integer, primary_key=True) # TMDb genre ID
+    name = db.Column(db.String(100), nullable=False)
+
+class MovieGenre(db.Model):
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id', ondelete='CASCADE'), primary_key=True)
+    # TMDb genre ID; not a foreign key because movies can arrive before the genre list does
+    genre_id = db.Column(db.Integer, primary_key=True)
+
+    __table_args__ = (db.Index('ix_movie_genre_genre_movie', 'genre_id', 'movie_id'),)
+
+class CastMember(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), unique=True, nullable=False)
+
+class MovieCast(db.Model):
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id', ondelete='CASCADE'), primary_key=True)
+    cast_member_id = db.Column(db.Integer, db.ForeignKey('cast_member.id'), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0) # Billing order
+
+    __table_args__ = (db.Index('ix_movie_cast_member_movie', 'cast_member_id', 'movie_id'),)
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, done, failed
+    params = db.Column(db.JSON, nullable=True)
+    progress = db.Column(db.JSON, nullable=True) # Saved by the handler; lets a re-queued job resume
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.Float, nullable=True) # Unix timestamps
+    started_at = db.Column(db.Float, nullable=True)
+    heartbeat_at = db.Column(db.Float, nullable=True)
+    finished_at = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (db.Index('ix_job_status_id', 'status', 'id'),)
+
+class RecommendationQueue(db.Model):
+    # Upcoming /random-movie recommendations per user, best first by priority
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    tmdb_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False) # Predicted affinity
+    noise = db.Column(db.Float, nullable=False) # Sampling noise, kept so re-ranks only change the score part
+    priority = db.Column(db.Float, nullable=False) # score + noise
+    served = db.Column(db.Boolean, nullable=False, default=False)
+    served_at = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (db.Index('ix_recommendation_queue_next', 'user_id', 'served', 'priority'),)
+
+class AppSetting(db.Model):
+    # Small key/value state shared by all workers, e.g. version stamps of cached data
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.String(255), nullable=True)
+
+class SyncState(db.Model):
+    # Where the last sync of a TMDb source stopped
+    source = db.Column(db.String(50), primary_key=True) # 'top_rated' or 'changes'
+    last_page = db.Column(db.Integer, nullable=False, default=0) # Highest list page loaded so far
+    last_synced_at = db.Column(db.Float, nullable=True) # Unix timestamp
+
+class PreferenceVersion(db.Model):
+    # Bumped on every preference write, so caches keyed on it notice another worker's writes
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ItemNeighbour(db.Model):
+    # Top-k collaborative filtering neighbours of each rated movie, rebuilt by build_item_neighbours()
+    tmdb_id = db.Column(db.Integer, primary_key=True)
+    neighbour_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False) # Shrunk cosine similarity of the two movies' ratings
+    common = db.Column(db.Integer, nullable=False) # Users who rated both
+
+search_index.register(Movie.__table__)
+
+def _split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+def sync_movie_links(movies, replace=True):
+    """Rewrites the MovieGenre and MovieCast rows of ``movies`` from their string columns.
+
+    Pass ``replace=False`` for freshly inserted movies, which have no links to delete.
+    Returns the number of link rows written.
+    """
+    if not movies:
+        return 0
+    db.session.flush() # Assign ids to new movies
+    if replace:
+        movie_ids = [movie.id for movie in movies]
+        MovieGenre.query.filter(MovieGenre.movie_id.in_(movie_ids)).delete(synchronize_session=False)
+        MovieCast.query.filter(MovieCast.movie_id.in_(movie_ids)).delete(synchronize_session=False)
+
+    names = {name for movie in movies for name in _split_list(movie.cast)}
+    cast_ids = {}
+    if names:
+        cast_ids = dict(db.session.query(CastMember.name, CastMember.id).filter(CastMember.name.in_(names)))
+        missing = [CastMember(name=name) for name in names if name not in cast_ids]
+        if missing:
+            db.session.add_all(missing)
+            db.session.flush()
+            cast_ids.update((member.name, member.id) for member in missing)
+
+    genre_rows = []
+    cast_rows = []
+    for movie in movies:
+        for gid in {int(gid) for gid in _split_list(movie.genre_ids)}:
+            genre_rows.append({'movie_id': movie.id, 'genre_id': gid})
+        seen = set()
+        for position, name in enumerate(_split_list(movie.cast)):
+            if name not in seen:
+                seen.add(name)
+                cast_rows.append({'movie_id': movie.id, 'cast_member_id': cast_ids[name], 'position': position})
+    if genre_rows:
+        db.session.execute(MovieGenre.__table__.insert(), genre_rows)
+    if cast_rows:
+        db.session.execute(MovieCast.__table__.insert(), cast_rows)
+    return len(genre_rows) + len(cast_rows)
+
+BACKFILL_ROW_ID_KEY = 'normalized_backfill_row_id'
+
+def backfill_normalized_tables(batch_size=500):
+    """Migration: fills Genre, MovieGenre and CastMember from the comma-joined string columns."""
+    for gid, name in get_genres_map().items():
+        db.session.merge(Genre(id=gid, name=name))
+    # A movie with neither genres nor cast never gets links, so remember how far earlier runs got instead
+    # of selecting it again on every start; movies inserted since then were linked on insert
+    marker = db.session.get(AppSetting, BACKFILL_ROW_ID_KEY)
+    start_id = last_id = int(marker.value) if marker else 0
+    max_id = db.session.query(func.max(Movie.id)).scalar() or 0
+    linked = db.session.query(MovieGenre.movie_id).union(db.session.query(MovieCast.movie_id))
+    backfilled = 0
+    while True:
+        batch = (Movie.query
+                 .filter(Movie.id > last_id, Movie.id <= max_id, Movie.id.not_in(linked))
+                 .order_by(Movie.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        if sync_movie_links(batch):
+            bump_catalog_version() # Genre filters of /api/movies read these links
+        db.session.commit()
+        last_id = batch[-1].id
+        backfilled += len(batch)
+    if max_id > start_id:
+        db.session.merge(AppSetting(key=BACKFILL_ROW_ID_KEY, value=str(max_id)))
+    db.session.commit()
+    print(f"DEBUG: Back-filled genre and cast links for {backfilled} movies.")
+    return backfilled
+
+def _movies_with_genres(genre_ids):
+    # Served by the (genre_id, movie_id) index
+    return db.session.query(MovieGenre.movie_id).filter(MovieGenre.genre_id.in_(genre_ids))
+
+@app.cli.command('backfill-normalized')
+def backfill_normalized_command():
+    """Fill the normalized genre and cast tables from existing movies."""
+    backfill_normalized_tables()
+
+# Per-process genre-indexed copy of the Movie table used by /random-movie
+movie_catalog = MovieCatalog(refresh_interval=float(os.environ.get('CATALOG_REFRESH_SECONDS', 30)))
+
+def _catalog_record(movie):
+    return CatalogMovie(
+        id=movie.tmdb_id,
+        title=movie.title,
+        score=movie.score,
+        poster_url=movie.poster_url,
+        trailer_url=movie.trailer_url,
+        overview=movie.overview,
+        release_date=movie.release_date,
+        genres=movie.genres or "",
+        genre_ids=tuple(int(gid) for gid in movie.genre_ids.split(',')) if movie.genre_ids else (),
+        cast=movie.cast
+    )
+
+def get_movie_catalog():
+    # Once per refresh interval: picks up rows inserted since the last load by id, and rows another
+    # worker refreshed in place by their update sequence
+    if movie_catalog.needs_refresh():
+        try:
+            # Read before the rows, so an update committed in between is fetched again next time
+            update_seq = catalog_update_seq()
+            columns = [Movie.id] + [getattr(Movie, column) for column in MOVIE_FIELDS.values()]
+            query = select(*columns).order_by(Movie.id)
+            rows = db.session.execute(query.where(Movie.id > movie_catalog.max_row_id)).all()
+            if movie_catalog.loaded:
+                rows += db.session.execute(query.where(Movie.id <= movie_catalog.max_row_id,
+                                                       Movie.updated_seq > (movie_catalog.source_version or 0))).all()
+            movie_catalog.add([_catalog_record(row) for row in rows], [row.id for row in rows])
+            movie_catalog.source_version = update_seq
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"ERROR: Failed to refresh the movie catalog. Error: {e}")
+        movie_catalog.mark_refreshed()
+    return movie_catalog
+
+# JSON field name -> Movie column, in the order fields are returned
+MOVIE_FIELDS = {
+    "id": "tmdb_id",
+    "title": "title",
+    "score": "score",
+    "poster_url": "poster_url",
+    "trailer_url": "trailer_url",
+    "overview": "overview",
+    "release_date": "release_date",
+    "genres": "genres",
+    "genre_ids": "genre_ids",
+    "cast": "cast",
+}
+
+def _movie_card(tmdb_id, title, movie=None):
+    # Full movie data when the movie is in the catalog, otherwise just what the preference row knows
+    if movie is not None:
+        return _movie_to_dict(movie)
+    return dict({field: None for field in MOVIE_FIELDS}, id=tmdb_id, title=title, genre_ids=[])
+
+def _movie_to_dict(movie, fields=None):
+    movie_data = {}
+    for field, column in MOVIE_FIELDS.items():
+        if fields is not None and field not in fields:
+            continue
+        value = getattr(movie, column)
+        if field == "genre_ids":
+            value = [int(gid) for gid in value.split(',')] if value else []
+        movie_data[field] = value
+    return movie_data
 
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
+response_cache = LRUCache(app.config['RESPONSE_CACHE_SIZE'], ttl=app.config['RESPONSE_CACHE_SECONDS'])
+
+def cached_response(key_func, cache_control='public, no-cache'):
+    return http_cache.cached(response_cache, key_func, cache_control,
+                             min_size=app.config['COMPRESS_MIN_SIZE'], level=app.config['COMPRESS_LEVEL'])
+
+@app.after_request
+def compress_response(response):
+    return http_cache.compress_response(response, app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_LEVEL'])
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+def catalog_version():
+    stamp = db.session.get(AppSetting, CATALOG_VERSION_KEY)
+    return stamp.value if stamp else None
+
+def bump_catalog_version():
+    # Committed by the caller together with the movie rows; cached catalog responses then miss
+    db.session.merge(AppSetting(key=CATALOG_VERSION_KEY, value=str(time.time_ns())))
+
+CATALOG_UPDATE_SEQ_KEY = 'catalog_update_seq'
+
+def catalog_update_seq():
+    value = db.session.execute(select(AppSetting.value).where(AppSetting.key == CATALOG_UPDATE_SEQ_KEY)).scalar()
+    return int(value) if value else 0
+
+def stamp_movie_updates(movies):
+    """Tags movies changed in place with the next catalog update sequence and returns it.
+
+    The increment holds the row's write lock until the caller commits, so
+    concurrent writers get distinct sequences in commit order and other
+    workers' catalogs fetch just these rows instead of reloading.
+    """
+    if not movies:
+        return None
+    table = AppSetting.__table__
+    increment = (table.update()
+                 .where(table.c.key == CATALOG_UPDATE_SEQ_KEY)
+                 .values(value=(table.c.value.cast(Integer) + 1).cast(String))
+                 .returning(table.c.value))
+    value = db.session.execute(increment).scalar()
+    if value is None:
+        db.session.merge(AppSetting(key=CATALOG_UPDATE_SEQ_KEY, value='0'))
+        db.session.flush()
+        value = db.session.execute(increment).scalar()
+    for movie in movies:
+        movie.updated_seq = int(value)
+    return int(value)
+
+def _genres_version():
+    genres_map = get_genres_map()
+    return genres_cache['version'] if genres_map is genres_cache['map'] else tuple(sorted(genres_map.items()))
+
 @app.route('/genres')
+@cached_response(_genres_version)
 def get_genres():
     genres_list = []
-    genres_map = app.config.get('GENRES_MAP', {})
+    genres_map = get_genres_map()
     for gid, gname in genres_map.items():
         genres_list.append({'id': gid, 'name': gname})
     return jsonify(genres_list)
 
-def fetch_genres():
-    genres_url = f"https://api.themoviedb.org/3/genre/movie/list?api_key={TMDB_API_KEY}&language=en-US"
+GENRES_VERSION_KEY = 'genres_version'
+
+# Per-process copy of the genre table. Workers compare its version stamp with the one in
+# app_setting, so a refresh by any process reaches all of them without a TMDb call.
+genres_cache = {'map': {}, 'version': None, 'loaded': False, 'checked_at': 0.0}
+_genres_lock = threading.Lock()
+
+def get_genres_map():
+    """TMDb genre id -> name, loaded lazily from the database and cached per process."""
+    if app.config.get('GENRES_MAP'):
+        return app.config['GENRES_MAP'] # Explicit override, e.g. in tests
+    if genres_cache['loaded'] and time.monotonic() - genres_cache['checked_at'] < app.config['GENRES_CHECK_SECONDS']:
+        return genres_cache['map']
+    with _genres_lock:
+        try:
+            stamp = db.session.get(AppSetting, GENRES_VERSION_KEY)
+            version = stamp.value if stamp else None
+            if not genres_cache['loaded'] or version != genres_cache['version']:
+                genres_cache['map'] = {genre.id: genre.name for genre in Genre.query.order_by(Genre.id)}
+                genres_cache['version'] = version
+                genres_cache['loaded'] = True
+            genres_cache['checked_at'] = time.monotonic()
+            if version is None or time.time() - float(version) > app.config['GENRES_REFRESH_SECONDS']:
+                _enqueue_genre_refresh()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"ERROR: Failed to load genres from the database. Error: {e}")
+    return genres_cache['map']
+
+def _enqueue_genre_refresh():
+    pending = Job.query.filter(Job.kind == 'refresh_genres', Job.status.in_(['queued', 'running'])).first()
+    if pending is None:
+        job_queue.enqueue('refresh_genres')
+
+def fetch_genres(use_cache=True):
     try:
-        response = requests.get(genres_url)
-        response.raise_for_status() # Raise an exception for HTTP errors
-        data = response.json()
+        data = tmdb.get('/genre/movie/list', params={'language': 'en-US'}, use_cache=use_cache)
         if data and 'genres' in data:
-            app.config['GENRES_MAP'] = {genre['id']: genre['name'] for genre in data['genres']}
+            for genre in data['genres']:
+                db.session.merge(Genre(id=genre['id'], name=genre['name']))
+            bump_genres_version()
+            db.session.commit()
         else:
             print(f"DEBUG: TMDb genres API response missing 'genres' key or is empty. Response: {data}")
     except requests.exceptions.RequestException as e:
@@ -144,96 +635,459 @@ def fetch_genres():
     except ValueError as e: # Handles JSON decoding errors
         print(f"ERROR: Failed to decode JSON from TMDb genres API. Error: {e}")
 
-def get_movie_trailer(movie_id):
-    videos_url = f"https://api.themoviedb.org/3/movie/{movie_id}/videos?api_key={TMDB_API_KEY}&language=en-US"
+def bump_genres_version():
+    # Committed by the caller together with the genre rows
+    db.session.merge(AppSetting(key=GENRES_VERSION_KEY, value=f'{time.time():.6f}'))
+    genres_cache['checked_at'] = 0.0 # This process reloads on its next lookup
+
+def _extract_trailer(movie_id, videos):
+    if videos and 'results' in videos:
+        for video in videos['results']:
+            if video['site'] == 'YouTube' and video['type'] == 'Trailer':
+                return TMDB_YOUTUBE_BASE_URL + video['key']
+        print(f"DEBUG: No trailer found for movie {movie_id} in TMDb response.")
+    else:
+        print(f"DEBUG: TMDb videos for movie {movie_id} missing 'results' key or is empty. Response: {videos}")
+    return None
+
+def _extract_cast(movie_id, credits):
+    cast = []
+    if credits and 'cast' in credits:
+        for member in credits['cast'][:5]: # Get top 5 cast members
+            cast.append(member['name'])
+    else:
+        print(f"DEBUG: TMDb credits for movie {movie_id} missing 'cast' key or is empty. Response: {credits}")
+    return ", ".join(cast)
+
+def fetch_movie_details(movie_id, use_cache=True):
+    # One request for the movie record plus its videos and credits
     try:
-        response = requests.get(videos_url)
-        response.raise_for_status()
-        data = response.json()
-        if data and 'results' in data:
-            for video in data['results']:
-                if video['site'] == 'YouTube' and video['type'] == 'Trailer':
-                    return TMDB_YOUTUBE_BASE_URL + video['key']
-            print(f"DEBUG: No trailer found for movie {movie_id} in TMDb response.")
-        else:
-            print(f"DEBUG: TMDb videos API response for movie {movie_id} missing 'results' key or is empty. Response: {data}")
+        data = tmdb.get(f'/movie/{movie_id}', params={'language': 'en-US', 'append_to_response': 'videos,credits'},
+                        use_cache=use_cache)
+        return {
+            'movie': data,
+            'trailer_url': _extract_trailer(movie_id, data.get('videos')),
+            'cast': _extract_cast(movie_id, data.get('credits')),
+        }
     except requests.exceptions.RequestException as e:
-        print(f"ERROR: Failed to fetch trailer for movie {movie_id}. Error: {e}")
+        print(f"ERROR: Failed to fetch details for movie {movie_id}. Error: {e}")
         if hasattr(e, 'response') and e.response is not None:
-            print(f"ERROR: TMDb videos API response status: {e.response.status_code}, content: {e.response.text}")
+            print(f"ERROR: TMDb movie details API response status: {e.response.status_code}, content: {e.response.text}")
     except ValueError as e:
-        print(f"ERROR: Failed to decode JSON from TMDb videos API for movie {movie_id}. Error: {e}")
-    return None
+        print(f"ERROR: Failed to decode JSON from TMDb movie details API for movie {movie_id}. Error: {e}")
+    return {'movie': None, 'trailer_url': None, 'cast': ""}
 
-def get_movie_cast(movie_id):
-    credits_url = f"https://api.themoviedb.org/3/movie/{movie_id}/credits?api_key={TMDB_API_KEY}&language=en-US"
+def _fetch_top_rated_page(page):
     try:
-        response = requests.get(credits_url)
-        response.raise_for_status()
-        data = response.json()
-        cast = []
-        if data and 'cast' in data:
-            for member in data['cast'][:5]: # Get top 5 cast members
-                cast.append(member['name'])
-        else:
-            print(f"DEBUG: TMDb credits API response for movie {movie_id} missing 'cast' key or is empty. Response: {data}")
+        data = tmdb.get('/movie/top_rated', params={'language': 'en-US', 'page': page})
     except requests.exceptions.RequestException as e:
-        print(f"ERROR: Failed to fetch cast for movie {movie_id}. Error: {e}")
+        print(f"ERROR: Failed to fetch top rated movies from TMDb (page {page}). Error: {e}")
         if hasattr(e, 'response') and e.response is not None:
-            print(f"ERROR: TMDb credits API response status: {e.response.status_code}, content: {e.response.text}")
+            print(f"ERROR: TMDb top rated movies API response status: {e.response.status_code}, content: {e.response.text}")
+        raise
     except ValueError as e:
-        print(f"ERROR: Failed to decode JSON from TMDb credits API for movie {movie_id}. Error: {e}")
-    return ", ".join(cast)
+        print(f"ERROR: Failed to decode JSON from TMDb top rated movies API (page {page}). Error: {e}")
+        raise
+    if data and 'results' in data:
+        return data['results']
+    print(f"DEBUG: TMDb top rated movies API response for page {page} missing 'results' key or is empty. Response: {data}")
+    return []
+
+def _is_catalog_eligible(movie_data):
+    return bool(movie_data.get('vote_average')) and movie_data.get('vote_count', 0) > 50
+
+def _movie_fields(movie_data, genres_map, details=None):
+    """Movie column values from a TMDb list entry or detail record (plus trailer and cast when given)."""
+    genre_ids = movie_data.get('genre_ids')
+    if genre_ids is None: # Detail records carry genre objects instead of ids
+        genre_ids = [genre['id'] for genre in movie_data.get('genres', [])]
+    genres_names = [genres_map.get(gid) for gid in genre_ids if gid in genres_map]
+    fields = {
+        'title': movie_data['title'],
+        'score': movie_data['vote_average'],
+        'poster_url': TMDB_IMAGE_BASE_URL + movie_data['poster_path'] if movie_data.get('poster_path') else None,
+        'overview': movie_data.get('overview', 'No overview available.'),
+        'release_date': movie_data.get('release_date', 'N/A'),
+        'genres': ", ".join(genres_names),
+        'genre_ids': ", ".join(map(str, genre_ids)),
+    }
+    if details is not None:
+        fields['trailer_url'] = details['trailer_url']
+        fields['cast'] = details['cast']
+    return fields
+
+def _movie_from_tmdb(movie_data, details, genres_map):
+    return Movie(tmdb_id=movie_data['id'], **_movie_fields(movie_data, genres_map, details))
+
+def insert_new_movies(movies):
+    """Bulk-inserts unsaved ``Movie`` objects with INSERT ... ON CONFLICT (tmdb_id) DO NOTHING.
+
+    Returns the movies actually inserted, with their ids set; a movie another
+    worker inserted in the meantime is skipped instead of failing the batch.
+    """
+    if not movies:
+        return []
+    table = Movie.__table__
+    columns = [column.name for column in table.columns if column.name != 'id']
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        db.session.add_all(movies)
+        db.session.flush()
+        bump_catalog_version()
+        return movies
+    insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+    statement = (insert(table)
+                 .on_conflict_do_nothing(index_elements=['tmdb_id'])
+                 .returning(table.c.id, table.c.tmdb_id))
+    # One executemany; RETURNING only reports the rows that were inserted
+    rows = [{column: getattr(movie, column) for column in columns} for movie in movies]
+    ids = {tmdb_id: row_id for row_id, tmdb_id in db.session.execute(statement, rows)}
+    inserted = []
+    for movie in movies:
+        if movie.tmdb_id in ids:
+            movie.id = ids[movie.tmdb_id]
+            inserted.append(movie)
+    if inserted:
+        bump_catalog_version()
+    return inserted
+
+def _apply_changes(movie, fields):
+    # Only touch columns whose value differs, so unchanged rows cause no UPDATE
+    changed = [name for name, value in fields.items() if getattr(movie, name) != value]
+    for name in changed:
+        setattr(movie, name, fields[name])
+    return changed
+
+def _save_refreshed(movies):
+    # Rebuild links only for movies whose genres or cast changed; the FTS index follows via triggers
+    relinked = [movie for movie, changed in movies if {'genre_ids', 'cast'} & set(changed)]
+    sync_movie_links(relinked)
+    update_seq = stamp_movie_updates([movie for movie, _ in movies])
+    if movies:
+        bump_catalog_version()
+    db.session.commit()
+    if movie_catalog.loaded and movies:
+        movie_catalog.add_written([_catalog_record(movie) for movie, _ in movies], update_seq=update_seq)
+
+def _select_new_movies(movies, seen_ids, genres_map, refreshed, stats):
+    eligible = [movie_data for movie_data in movies if _is_catalog_eligible(movie_data)]
+    known = {movie.tmdb_id: movie for movie in Movie.query.filter(Movie.tmdb_id.in_([m['id'] for m in eligible]))} if eligible else {}
+    new_movies = []
+    stats['updated'] = stats['unchanged'] = 0
+    for movie_data in eligible:
+        # Pages are fetched concurrently, so a movie that shifted between pages may show up twice
+        if movie_data['id'] in seen_ids:
+            continue
+        seen_ids.add(movie_data['id'])
+        movie = known.get(movie_data['id'])
+        if movie is None:
+            new_movies.append(movie_data)
+            continue
+        # Refresh the list-level fields (score, poster, ...) of movies we already have
+        changed = _apply_changes(movie, _movie_fields(movie_data, genres_map))
+        if changed:
+            refreshed.append((movie, changed))
+            stats['updated'] += 1
+        else:
+            stats['unchanged'] += 1
+    return new_movies
+
+def ingest_top_rated_movies(start_page=1, end_page=1, max_workers=None, requests_per_second=None, on_page=None):
+    """Loads TMDb top rated pages concurrently and returns per-page stats.
+
+    New movies are inserted and the list fields of known ones refreshed.
+    ``on_page(stats)`` is called after each page is committed, in page order.
+    """
+    pipeline = IngestionPipeline(
+        _fetch_top_rated_page,
+        lambda movie_data: fetch_movie_details(movie_data['id']),
+        max_workers=max_workers or app.config['TMDB_MAX_WORKERS'],
+        requests_per_second=requests_per_second if requests_per_second is not None else app.config['TMDB_REQUESTS_PER_SECOND'],
+    )
+    genres_map = get_genres_map()
+    report = {'new_movies_count': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'pages': []}
+    seen_ids = set()
+    refreshed = []
+    with db_setup.track_queries() as queries:
+        started = time.monotonic()
+        pages = pipeline.run(range(start_page, end_page + 1),
+                             lambda movies, stats: _select_new_movies(movies, seen_ids, genres_map, refreshed, stats))
+        for stats, details in pages:
+            _save_page(stats, details, genres_map, refreshed, report)
+            if on_page is not None:
+                on_page(stats)
+        elapsed = time.monotonic() - started
+    report['inserted'] = report['new_movies_count']
+    if report['inserted']:
+        _enqueue_similarity_update()
+    # Cost per 1,000 movies looked at, to compare ingestion changes
+    seen = sum(stats['fetched'] for stats in report['pages'])
+    report['db'] = {
+        'queries': queries['queries'],
+        'seconds': round(queries['seconds'], 4),
+        'queries_per_1000_movies': round(queries['queries'] * 1000 / seen, 1) if seen else 0.0,
+        'db_seconds_per_1000_movies': round(queries['seconds'] * 1000 / seen, 4) if seen else 0.0,
+        'seconds_per_1000_movies': round(elapsed * 1000 / seen, 3) if seen else 0.0,
+    }
+    print(f"DEBUG: Fetched and added {report['new_movies_count']} new movies to the database "
+          f"({report['updated']} updated, {report['unchanged']} unchanged, {queries['queries']} DB queries).")
+    return report
+
+def _save_page(stats, details, genres_map, refreshed, report):
+    added = insert_new_movies([_movie_from_tmdb(movie_data, extras, genres_map) for movie_data, extras in details])
+    sync_movie_links(added, replace=False)
+    stats['added'] = len(added)
+    if not stats['error']:
+        _mark_synced('top_rated', page=stats['page'])
+    # Refreshes of pages still in the lookahead window are committed here too
+    _save_refreshed(refreshed)
+    refreshed.clear()
+    if movie_catalog.loaded:
+        movie_catalog.add_written([_catalog_record(movie) for movie in added], [movie.id for movie in added])
+    report['new_movies_count'] += stats['added']
+    report['updated'] += stats.get('updated', 0)
+    report['unchanged'] += stats.get('unchanged', 0)
+    report['pages'].append(stats)
+
+def _sync_state(source):
+    return db.session.get(SyncState, source) or SyncState(source=source, last_page=0)
+
+def _mark_synced(source, page=None, synced_at=None):
+    state = _sync_state(source)
+    if page is not None:
+        state.last_page = max(state.last_page or 0, page)
+    state.last_synced_at = synced_at or time.time()
+    db.session.add(state)
+
+def next_top_rated_page():
+    # First page an incremental load should fetch
+    return _sync_state('top_rated').last_page + 1
+
+def _fetch_changes_page(page, start_date, end_date):
+    data = tmdb.get('/movie/changes', params={'start_date': start_date, 'end_date': end_date, 'page': page}, use_cache=False)
+    return data or {}
+
+def sync_changed_movies(max_workers=None, requests_per_second=None, on_page=None):
+    """Refreshes known movies that TMDb's /movie/changes feed lists since the last sync.
+
+    Only movies already in the catalog are fetched; their fields are diffed
+    and rows are written only when something changed.
+    """
+    started = time.time()
+    state = _sync_state('changes')
+    # TMDb serves at most 14 days of changes; the first sync looks back one day
+    since = max(state.last_synced_at or started - 24 * 3600, started - 14 * 24 * 3600)
+    start_date = datetime.fromtimestamp(since, timezone.utc).strftime('%Y-%m-%d')
+    end_date = datetime.fromtimestamp(started, timezone.utc).strftime('%Y-%m-%d')
+
+    first = _fetch_changes_page(1, start_date, end_date)
+    total_pages = max(1, min(int(first.get('total_pages') or 1), 500))
+    pipeline = IngestionPipeline(
+        lambda page: first.get('results', []) if page == 1 else _fetch_changes_page(page, start_date, end_date).get('results', []),
+        lambda change: fetch_movie_details(change['id'], use_cache=False),
+        max_workers=max_workers or app.config['TMDB_MAX_WORKERS'],
+        requests_per_second=requests_per_second if requests_per_second is not None else app.config['TMDB_REQUESTS_PER_SECOND'],
+    )
+    genres_map = get_genres_map()
+    known = {}
+
+    def select_known(changes, stats):
+        ids = [change['id'] for change in changes if not change.get('adult')]
+        rows = Movie.query.filter(Movie.tmdb_id.in_(ids)).all() if ids else []
+        known.update((movie.tmdb_id, movie) for movie in rows)
+        return [{'id': movie.tmdb_id} for movie in rows]
+
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'pages': []}
+    for stats, details in pipeline.run(range(1, total_pages + 1), select_known):
+        refreshed = []
+        stats['updated'] = stats['unchanged'] = 0
+        for change, extras in details:
+            if extras['movie'] is None:
+                stats['detail_errors'] += 1
+                continue
+            movie = known[change['id']]
+            changed = _apply_changes(movie, _movie_fields(extras['movie'], genres_map, extras))
+            if changed:
+                refreshed.append((movie, changed))
+                stats['updated'] += 1
+            else:
+                stats['unchanged'] += 1
+        _save_refreshed(refreshed)
+        report['updated'] += stats['updated']
+        report['unchanged'] += stats['unchanged']
+        report['pages'].append(stats)
+        if on_page is not None:
+            on_page(stats)
+    if not any(stats['error'] for stats in report['pages']):
+        # Next sync starts where this one did, so edits made while it ran are not missed
+        _mark_synced('changes', synced_at=started)
+        db.session.commit()
+    print(f"DEBUG: Synced TMDb changes since {start_date}: {report['updated']} updated, {report['unchanged']} unchanged.")
+    return report
 
 def fetch_top_rated_movies(start_page=1, end_page=1):
-    new_movies_count = 0
-    for page in range(start_page, end_page + 1):
-        url = f"https://api.themoviedb.org/3/movie/top_rated?api_key={TMDB_API_KEY}&language=en-US&page={page}"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            if data and 'results' in data:
-                for movie_data in data['results']:
-                    if movie_data.get('vote_average') and movie_data.get('vote_count', 0) > 50:
-                        # Check if movie already exists in DB
-                        existing_movie = Movie.query.filter_by(tmdb_id=movie_data['id']).first()
-                        if not existing_movie:
-                            trailer_url = get_movie_trailer(movie_data['id'])
-                            cast = get_movie_cast(movie_data['id'])
-                            genres_map = app.config.get('GENRES_MAP', {})
-                            genres_names = [genres_map.get(gid) for gid in movie_data.get('genre_ids', []) if gid in genres_map]
-                            
-                            new_movie = Movie(
-                                tmdb_id=movie_data['id'],
-                                title=movie_data['title'],
-                                score=movie_data['vote_average'],
-                                poster_url=TMDB_IMAGE_BASE_URL + movie_data['poster_path'] if movie_data.get('poster_path') else None,
-                                trailer_url=trailer_url,
-                                overview=movie_data.get('overview', 'No overview available.'),
-                                release_date=movie_data.get('release_date', 'N/A'),
-                                genres=", ".join(genres_names),
-                                genre_ids=", ".join(map(str, movie_data.get('genre_ids', []))),
-                                cast=cast
-                            )
-                            db.session.add(new_movie)
-                            new_movies_count += 1
-                db.session.commit()
-            else:
-                print(f"DEBUG: TMDb top rated movies API response for page {page} missing 'results' key or is empty. Response: {data}")
-        except requests.exceptions.RequestException as e:
-            print(f"ERROR: Failed to fetch top rated movies from TMDb (page {page}). Error: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"ERROR: TMDb top rated movies API response status: {e.response.status_code}, content: {e.response.text}")
-        except ValueError as e:
-            print(f"ERROR: Failed to decode JSON from TMDb top rated movies API (page {page}). Error: {e}")
-    print(f"DEBUG: Fetched and added {new_movies_count} new movies to the database.")
-    return new_movies_count
+    return ingest_top_rated_movies(start_page, end_page)['new_movies_count']
+
+job_queue = JobQueue(app, db, Job, workers=app.config['JOB_WORKERS'], stale_after=app.config['JOB_STALE_SECONDS'],
+                     max_attempts=app.config['JOB_MAX_ATTEMPTS'], retention=app.config['JOB_RETENTION_SECONDS'])
+
+def _job_totals(progress):
+    return {
+        'pages_done': progress.get('pages_done', 0),
+        'movies_added': progress.get('movies_added', 0),
+        'movies_updated': progress.get('movies_updated', 0),
+        'movies_unchanged': progress.get('movies_unchanged', 0),
+        'errors': list(progress.get('errors', [])),
+    }
+
+def _count_page(totals, stats):
+    totals['pages_done'] += 1
+    totals['movies_added'] += stats['added']
+    totals['movies_updated'] += stats.get('updated', 0)
+    totals['movies_unchanged'] += stats.get('unchanged', 0)
+    if stats['error']:
+        totals['errors'].append(f"Page {stats['page']}: {stats['error']}")
+    if stats['detail_errors']:
+        totals['errors'].append(f"Page {stats['page']}: {stats['detail_errors']} movie detail lookups failed")
+
+@job_queue.handler('load_top_rated')
+def load_top_rated_job(job, report_progress):
+    end_page = job.params['end_page']
+    progress = job.progress or {}
+    # Resume after the last committed page if this job was interrupted
+    start_page = progress.get('next_page', job.params['start_page'])
+    totals = _job_totals(progress)
+
+    def on_page(stats):
+        _count_page(totals, stats)
+        report_progress(next_page=stats['page'] + 1, pages_total=end_page - job.params['start_page'] + 1, **totals)
+
+    if start_page <= end_page:
+        report = ingest_top_rated_movies(start_page, end_page, on_page=on_page)
+        report_progress(db=report['db'])
+
+@job_queue.handler('sync_changes')
+def sync_changes_job(job, report_progress):
+    # Restarts from scratch if interrupted: the sync point only moves once a run completes
+    totals = _job_totals({})
+
+    def on_page(stats):
+        _count_page(totals, stats)
+        report_progress(**totals)
+
+    sync_changed_movies(on_page=on_page)
+
+@job_queue.handler('refresh_genres')
+def refresh_genres_job(job, report_progress):
+    fetch_genres(use_cache=False)
+
+@job_queue.handler('update_similarity')
+def update_similarity_job(job, report_progress):
+    report_progress(added=update_similarity_index())
+
+def enqueue_movie_load(start_page, end_page):
+    return job_queue.enqueue('load_top_rated', {'start_page': start_page, 'end_page': end_page})
+
+@app.before_request
+def start_job_workers():
+    # Threads do not survive gunicorn's fork, so each worker starts its own on its first request
+    job_queue.start()
+
+def ensure_columns():
+    # create_all() skips tables that already exist, so add (nullable) columns introduced after a table was created
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                with db.engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN "
+                                            f"{preparer.quote(column.name)} {column.type.compile(db.engine.dialect)}"))
+                print(f"DEBUG: Added column {table.name}.{column.name}.")
+
+def ensure_indexes():
+    # create_all() skips tables that already exist, so add indexes introduced after a table was created
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+def dedupe_preferences():
+    # Migration for the unique (user_id, tmdb_id) index: keep the latest row of each pair
+    latest = (select(func.max(UserMoviePreference.id))
+              .where(UserMoviePreference.tmdb_id.isnot(None))
+              .group_by(UserMoviePreference.user_id, UserMoviePreference.tmdb_id))
+    removed = (UserMoviePreference.query
+               .filter(UserMoviePreference.tmdb_id.isnot(None), UserMoviePreference.id.not_in(latest))
+               .delete(synchronize_session=False))
+    db.session.commit()
+    if removed:
+        print(f"DEBUG: Removed {removed} duplicate movie preferences.")
+
+def export_catalog_snapshot(path, batch_size=5000):
+    columns = [getattr(Movie, name) for name, _ in snapshot.COLUMNS]
+    # yield_per streams the rows instead of loading the whole table
+    result = db.session.execute(select(*columns).order_by(Movie.id).execution_options(yield_per=batch_size))
+    genres_map = get_genres_map()
+    count = snapshot.write_snapshot(path, (dict(row._mapping) for row in result), genres_map, batch_size)
+    print(f"DEBUG: Exported {count} movies and {len(genres_map)} genres to {path}.")
+    return count
+
+def import_catalog_snapshot(path, batch_size=5000):
+    """Bulk-loads a snapshot; movies already in the catalog are skipped."""
+    genres_map, batches = snapshot.read_snapshot(path, batch_size)
+    for gid, name in genres_map.items():
+        db.session.merge(Genre(id=gid, name=name))
+    bump_genres_version()
+    db.session.commit()
+    imported = 0
+    for rows in batches:
+        inserted = insert_new_movies([Movie(**row) for row in rows])
+        sync_movie_links(inserted, replace=False)
+        db.session.commit()
+        db.session.expunge_all() # Keep memory flat across batches
+        imported += len(inserted)
+    print(f"DEBUG: Imported {imported} movies and {len(genres_map)} genres from {path}.")
+    return imported
+
+@app.cli.command('export-snapshot')
+@click.argument('path')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per Parquet record batch.')
+def export_snapshot_command(path, batch_size):
+    """Export the movie catalog and genre map to a Parquet snapshot."""
+    export_catalog_snapshot(path, batch_size)
+
+@app.cli.command('import-snapshot')
+@click.argument('path')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows inserted per transaction.')
+def import_snapshot_command(path, batch_size):
+    """Load a Parquet catalog snapshot into the database."""
+    db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    search_index.ensure(db.engine)
+    import_catalog_snapshot(path, batch_size)
 
 def init_db():
+    metrics.clear_directory() # Runs before gunicorn starts its workers
     with app.app_context():
         db.create_all()
+        dedupe_preferences()
+        ensure_columns()
+        ensure_indexes()
+        search_index.ensure(db.engine)
+        # New containers can start from a snapshot instead of re-crawling TMDb
+        snapshot_path = os.environ.get('CATALOG_SNAPSHOT')
+        if snapshot_path and os.path.exists(snapshot_path) and Movie.query.first() is None:
+            try:
+                import_catalog_snapshot(snapshot_path)
+            except (RuntimeError, ValueError, KeyError, OSError) as e: # pyarrow missing, unreadable or foreign file
+                db.session.rollback()
+                print(f"ERROR: Failed to import catalog snapshot {snapshot_path}; starting without it. Error: {e}")
         fetch_genres()
+        backfill_normalized_tables()
 
         # Create admin user if not exists
         admin_user_name = os.environ.get('ADMIN_USER')
@@ -248,48 +1102,310 @@ if __name__ == '__main__':
     init_db()
     app.run(debug=True, port=5001)
 
+def _requested_fields():
+    # ?fields=id,title,... as a list of MOVIE_FIELDS keys, or None for all of them
+    if not request.args.get('fields'):
+        return None
+    fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+    unknown = [field for field in fields if field not in MOVIE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def movies_ndjson(fields=None, batch_size=1000):
+    """Yields the catalog as NDJSON, one text chunk per ``batch_size`` rows."""
+    fields = fields or list(MOVIE_FIELDS)
+    # Plain column tuples instead of ORM objects; yield_per also asks for a server-side cursor (stream_results)
+    result = db.session.execute(
+        select(*(getattr(Movie, MOVIE_FIELDS[field]) for field in fields))
+        .order_by(Movie.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for rows in result.partitions():
+        lines = []
+        for row in rows:
+            movie_data = dict(zip(fields, row))
+            if 'genre_ids' in movie_data:
+                movie_data['genre_ids'] = [int(gid) for gid in _split_list(movie_data['genre_ids'])]
+            lines.append(json.dumps(movie_data) + '\n')
+        yield ''.join(lines)
+
+def preferences_ndjson(user_id=None, batch_size=1000):
+    """Yields one user's preferences (or everyone's, with a user_id key) as NDJSON chunks."""
+    preference = UserMoviePreference
+    columns = [preference.user_id, preference.tmdb_id, preference.movie_title, preference.genres, preference.preference]
+    statement = select(*columns).order_by(preference.user_id, preference.tmdb_id).execution_options(yield_per=batch_size)
+    if user_id is not None:
+        statement = statement.where(preference.user_id == user_id)
+    for rows in db.session.execute(statement).partitions():
+        lines = []
+        for row_user_id, tmdb_id, title, genres, liked in rows:
+            row = {'id': tmdb_id, 'title': title, 'genres': genres, 'preference': liked}
+            if user_id is None:
+                row = dict(user_id=row_user_id, **row)
+            lines.append(json.dumps(row) + '\n')
+        yield ''.join(lines)
+
+def _ndjson_response(chunks):
+    response = Response(stream_with_context(chunks), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no' # Let a reverse proxy pass chunks through as they come
+    return response
+
+@app.route('/api/export/movies')
+def export_movies():
+    # The whole catalog as NDJSON; large or repeated pulls should use `flask export-ndjson` instead of a web worker
+    try:
+        fields = _requested_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _ndjson_response(movies_ndjson(fields, app.config['EXPORT_BATCH_SIZE']))
+
+@app.route('/api/export/preferences')
+@login_required
+def export_preferences():
+    return _ndjson_response(preferences_ndjson(current_user.id, app.config['EXPORT_BATCH_SIZE']))
+
+@app.cli.command('export-ndjson')
+@click.argument('kind', type=click.Choice(['movies', 'preferences']))
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--user', 'username', help='Only this user\'s preferences (default: every user, with user_id).')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched per round trip.')
+def export_ndjson_command(kind, output, username, batch_size):
+    """Stream the movie catalog or user preferences as NDJSON to OUTPUT (stdout by default)."""
+    if kind == 'movies':
+        chunks = movies_ndjson(batch_size=batch_size)
+    else:
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise click.BadParameter(f"No user named {username}", param_hint='--user')
+            user_id = user.id
+        chunks = preferences_ndjson(user_id, batch_size)
+    for chunk in chunks:
+        output.write(chunk)
+
 @app.route('/api/movies')
+@cached_response(catalog_version)
 def api_movies():
+    # Keyset pagination on the primary key: pass the X-Next-Cursor header of one page as ?cursor= for the next.
+    # ?page= still works for old clients but gets slower the deeper it goes.
+    cursor = request.args.get('cursor', type=int)
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
-    offset = (page - 1) * per_page
-
-    movies_query = Movie.query.offset(offset).limit(per_page)
-    movies_from_db = movies_query.all()
-
-    movies_data = []
-    for movie in movies_from_db:
-        movies_data.append({
-            "id": movie.tmdb_id,
-            "title": movie.title,
-            "score": movie.score,
-            "poster_url": movie.poster_url,
-            "trailer_url": movie.trailer_url,
-            "overview": movie.overview,
-            "release_date": movie.release_date,
-            "genres": movie.genres,
-            "genre_ids": [int(gid) for gid in movie.genre_ids.split(',')] if movie.genre_ids else [],
-            "cast": movie.cast
-        })
-    return jsonify(movies_data)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), app.config['API_MOVIES_MAX_PER_PAGE'])
+
+    try:
+        fields = _requested_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    movies_query = Movie.query
+    if fields is not None:
+        movies_query = movies_query.options(load_only(*(getattr(Movie, MOVIE_FIELDS[field]) for field in fields)))
+
+    selected_genres_str = request.args.get('genres')
+    if selected_genres_str:
+        selected_genre_ids = [int(x) for x in selected_genres_str.split(',')]
+        movies_query = movies_query.filter(Movie.id.in_(_movies_with_genres(selected_genre_ids)))
+    min_score = request.args.get('min_score', type=float)
+    if min_score is not None:
+        movies_query = movies_query.filter(Movie.score >= min_score)
+
+    movies_query = movies_query.order_by(Movie.id)
+    if cursor is not None:
+        movies_query = movies_query.filter(Movie.id > cursor)
+    elif page > 1:
+        movies_query = movies_query.offset((page - 1) * per_page)
+    movies_from_db = movies_query.limit(per_page).all()
+
+    movies_data = [_movie_to_dict(movie, fields) for movie in movies_from_db]
+    response = jsonify(movies_data)
+    if len(movies_from_db) == per_page:
+        next_cursor = movies_from_db[-1].id
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        next_args = {key: value for key, value in request.args.items() if key != 'page'}
+        next_args['cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("api_movies", **next_args)}>; rel="next"'
+    return response
+
+similarity_index = similarity.IndexHandle(app.config['SIMILARITY_INDEX_PATH'])
+
+def _similarity_documents(movies_query):
+    rows = movies_query.with_entities(Movie.tmdb_id, Movie.overview, Movie.genre_ids, Movie.cast).execution_options(yield_per=2000)
+    for tmdb_id, overview, genre_ids, cast in rows:
+        yield tmdb_id, overview, [int(gid) for gid in _split_list(genre_ids)], cast
+
+def build_similarity_index():
+    version = similarity.build(app.config['SIMILARITY_INDEX_PATH'], _similarity_documents(Movie.query),
+                               dim=app.config['SIMILARITY_DIM'], k=app.config['SIMILARITY_K'])
+    similarity_index.invalidate()
+    print(f"DEBUG: Built similarity index {version} with {len(similarity_index.get())} movies.")
+    return version
+
+def update_similarity_index():
+    """Adds movies missing from the similarity index; returns how many were added."""
+    index = similarity_index.get()
+    if index is None:
+        return 0 # Nothing to update until `flask build-similarity` has run
+    all_ids = np.fromiter((row[0] for row in db.session.query(Movie.tmdb_id)), dtype=np.int64)
+    missing = all_ids[~np.isin(all_ids, index.ids)].tolist()
+    if not missing:
+        return 0
+    documents = []
+    for start in range(0, len(missing), 500):
+        documents.extend(_similarity_documents(Movie.query.filter(Movie.tmdb_id.in_(missing[start:start + 500]))))
+    similarity.update(index, documents)
+    similarity_index.invalidate()
+    return len(documents)
+
+def _enqueue_similarity_update():
+    if similarity_index.current_version() is None:
+        return
+    # One update at a time: two running at once would each write a version from the same base
+    pending = Job.query.filter(Job.kind == 'update_similarity', Job.status.in_(['queued', 'running'])).first()
+    if pending is None:
+        job_queue.enqueue('update_similarity')
+
+@app.cli.command('build-similarity')
+def build_similarity_command():
+    """Build the content-based similarity index from the movie table."""
+    build_similarity_index()
+
+def build_item_neighbours(batch_size=50000):
+    """Recomputes ItemNeighbour from every like and dislike; returns the number of neighbour rows."""
+    ratings = db.session.execute(
+        select(UserMoviePreference.user_id, UserMoviePreference.tmdb_id, UserMoviePreference.preference)
+        .where(UserMoviePreference.tmdb_id.isnot(None))
+        .execution_options(yield_per=batch_size)
+    )
+    matrix = collaborative.RatingMatrix.from_rows((user_id, tmdb_id, int(liked)) for user_id, tmdb_id, liked in ratings)
+    db.session.commit() # End the read transaction before the long computation
+    # Compute every block before writing: on SQLite the write lock is held from the DELETE to the commit,
+    # and preference saves, job claims and heartbeats in every worker wait on it
+    columns = {'tmdb_id': [], 'neighbour_id': [], 'score': [], 'common': []}
+    blocks = collaborative.neighbours(matrix, k=app.config['COLLABORATIVE_K'], min_common=app.config['COLLABORATIVE_MIN_COMMON'])
+    for tmdb_ids, neighbour_ids, scores, common in blocks:
+        rows, cols = np.nonzero(neighbour_ids >= 0)
+        columns['tmdb_id'].append(tmdb_ids[rows])
+        columns['neighbour_id'].append(neighbour_ids[rows, cols])
+        columns['score'].append(scores[rows, cols])
+        columns['common'].append(common[rows, cols])
+    # Kept as numpy arrays (a few bytes per row); only one insert batch at a time becomes Python objects
+    columns = {name: np.concatenate(parts) if parts else np.zeros(0) for name, parts in columns.items()}
+    count = len(columns['tmdb_id'])
+    # One short transaction swaps the old neighbours for the new ones
+    ItemNeighbour.query.delete(synchronize_session=False)
+    for start in range(0, count, batch_size):
+        batch = {name: values[start:start + batch_size].tolist() for name, values in columns.items()}
+        db.session.execute(ItemNeighbour.__table__.insert(), [
+            {'tmdb_id': tmdb_id, 'neighbour_id': neighbour_id, 'score': score, 'common': common}
+            for tmdb_id, neighbour_id, score, common in zip(batch['tmdb_id'], batch['neighbour_id'], batch['score'], batch['common'])
+        ])
+    db.session.commit()
+    print(f"DEBUG: Built {count} item neighbours from {matrix.ratings_count()} ratings of {matrix.shape[1]} movies.")
+    return count
+
+def _collaborative_scores(user_id, genre_matrix):
+    # Weighted collaborative filtering score per catalog row, or None when it is off or has nothing to say
+    weight = app.config['COLLABORATIVE_WEIGHT']
+    if weight <= 0:
+        return None
+    rows = (db.session.query(ItemNeighbour.neighbour_id, ItemNeighbour.score, UserMoviePreference.preference)
+            .join(UserMoviePreference, UserMoviePreference.tmdb_id == ItemNeighbour.tmdb_id)
+            .filter(UserMoviePreference.user_id == user_id)
+            .all())
+    if not rows:
+        return None
+    return weight * collaborative.predict(genre_matrix, rows)
+
+@job_queue.handler('build_item_neighbours')
+def build_item_neighbours_job(job, report_progress):
+    report_progress(neighbours=build_item_neighbours())
+
+_neighbours_checked_at = {'value': None}
+
+def _schedule_item_neighbours_build():
+    # Debounced: a rebuild is queued when none is pending and the last one ended COLLABORATIVE_REBUILD_SECONDS ago;
+    # each process looks at the job table at most once a minute
+    interval = app.config['COLLABORATIVE_REBUILD_SECONDS']
+    if interval <= 0 or app.config['COLLABORATIVE_WEIGHT'] <= 0:
+        return
+    checked_at = _neighbours_checked_at['value']
+    if checked_at is not None and time.monotonic() - checked_at < min(interval, 60):
+        return
+    _neighbours_checked_at['value'] = time.monotonic()
+    latest = Job.query.filter(Job.kind == 'build_item_neighbours').order_by(Job.id.desc()).first()
+    if latest is not None and (latest.status in ('queued', 'running')
+                               or time.time() - (latest.finished_at or 0) < interval):
+        return
+    job_queue.enqueue('build_item_neighbours')
+
+@app.cli.command('build-neighbours')
+def build_neighbours_command():
+    """Rebuild the collaborative filtering neighbours from user preferences."""
+    db.create_all()
+    build_item_neighbours()
+
+@app.route('/api/movies/<int:tmdb_id>/similar')
+def similar_movies(tmdb_id):
+    index = similarity_index.get()
+    if index is None:
+        return jsonify({"error": "The similarity index has not been built yet or is unavailable"}), 503
+    limit = min(max(request.args.get('limit', 10, type=int), 1), index.k)
+    neighbours = index.similar(tmdb_id, limit)
+    if neighbours is None:
+        return jsonify({"error": "Movie not found in the similarity index"}), 404
+    movies = {movie.tmdb_id: movie for movie in Movie.query.filter(Movie.tmdb_id.in_([movie_id for movie_id, _ in neighbours]))}
+    results = []
+    for movie_id, score in neighbours:
+        if movie_id in movies:
+            movie_data = _movie_to_dict(movies[movie_id])
+            movie_data['similarity'] = round(score, 4)
+            results.append(movie_data)
+    return jsonify(results)
 
 @app.route('/api/fetch_new_movies', methods=['POST'])
+@login_required
+@admin_required
 def api_fetch_new_movies():
-    num_pages = int(request.json.get('num_pages', 1))
-    start_page = int(request.json.get('start_page', 1))
-    
-    # Fetch movies from TMDb and save to DB
-    new_movies_count = fetch_top_rated_movies(start_page=start_page, end_page=start_page + num_pages - 1)
-    
-    return jsonify({"message": f"Fetched and added {new_movies_count} new movies to the database.", "new_movies_count": new_movies_count})
+    try:
+        num_pages = int(request.json.get('num_pages', 1))
+        if request.json.get('mode') == 'incremental':
+            start_page = next_top_rated_page() # Continue after the last page loaded
+        else:
+            start_page = int(request.json.get('start_page', 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "num_pages and start_page must be integers"}), 400
+    if num_pages < 1 or start_page < 1:
+        return jsonify({"error": "num_pages and start_page must be positive"}), 400
+    if start_page > TMDB_MAX_PAGE:
+        return jsonify({"error": f"TMDb serves at most {TMDB_MAX_PAGE} pages"}), 400
+    num_pages = min(num_pages, TMDB_MAX_PAGE - start_page + 1)
+
+    # Loading runs in a background job; poll the status URL for progress
+    job = enqueue_movie_load(start_page, start_page + num_pages - 1)
+    return jsonify({
+        "message": f"Started loading {num_pages} page(s) of movies.",
+        "job_id": job.id,
+        "status_url": url_for('job_status', job_id=job.id),
+    }), 202
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+@admin_required
+def job_status(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_to_dict(job))
 
 @app.route('/')
 def index():
     # Pass flash messages to the template
     flashed_messages = get_flashed_messages(with_categories=True)
     
-    # Get genres from app.config
-    genres_map = app.config.get('GENRES_MAP', {})
+    # Genres come from the database (cached per worker), so no TMDb call is needed here
+    genres_map = get_genres_map()
     
     # Convert genres_map to a list of dictionaries for easier iteration in Jinja2
     genres = [{'id': gid, 'name': gname} for gid, gname in genres_map.items()]
@@ -310,6 +1426,147 @@ def status():
     else:
         return jsonify({'isLoggedIn': False, 'username': None})
 
+def _ratings_by_user(user_ids, catalog):
+    # {user_id: [(tmdb_id, genre_ids, liked), ...]} for several users in one query
+    genre_ids_by_name = {name: gid for gid, name in get_genres_map().items()}
+    ratings = {user_id: [] for user_id in user_ids}
+    rows = (db.session.query(UserMoviePreference.user_id, UserMoviePreference.tmdb_id, UserMoviePreference.genres, UserMoviePreference.preference)
+            .filter(UserMoviePreference.user_id.in_(user_ids)))
+    for user_id, tmdb_id, genres, liked in rows:
+        record = catalog.movies.get(tmdb_id)
+        if record is not None:
+            genre_ids = record.genre_ids
+        else:
+            genre_ids = [genre_ids_by_name[name] for name in (genres or '').split(', ') if name in genre_ids_by_name]
+        ratings[user_id].append((tmdb_id, genre_ids, liked))
+    return ratings
+
+def _user_ratings(user_id, catalog):
+    # (genre_ids, liked) per rated movie plus the rated TMDb ids
+    rows = _ratings_by_user([user_id], catalog)[user_id]
+    return [(genre_ids, liked) for _, genre_ids, liked in rows], {tmdb_id for tmdb_id, _, _ in rows}
+
+def _recommend_movie(catalog, selected_genre_ids):
+    if current_user.is_authenticated:
+        # Precomputed queue first; the live computation covers an empty queue until the refill job runs
+        tmdb_id = pop_recommendation(current_user.id, selected_genre_ids)
+        if tmdb_id is not None and tmdb_id in catalog.movies:
+            return catalog.movies[tmdb_id]
+    genre_matrix = catalog.genre_matrix()
+    if current_user.is_authenticated:
+        ratings, rated_ids = _user_ratings(current_user.id, catalog)
+        extra_scores = _collaborative_scores(current_user.id, genre_matrix)
+    else:
+        ratings, rated_ids, extra_scores = [], set(), None
+    tmdb_id = recommender.recommend(genre_matrix, ratings, rated_ids, selected_genre_ids, extra_scores=extra_scores)
+    return catalog.movies.get(tmdb_id) if tmdb_id is not None else None
+
+def pop_recommendation(user_id, genre_ids=None):
+    """Takes the user's next queued movie (optionally within ``genre_ids``); None if none is queued."""
+    queued = RecommendationQueue.__table__.c
+    candidates = select(queued.tmdb_id).where(queued.user_id == user_id, queued.served == False)
+    if genre_ids:
+        candidates = candidates.where(queued.tmdb_id.in_(
+            select(Movie.tmdb_id).where(Movie.id.in_(_movies_with_genres(genre_ids)))))
+    next_id = candidates.order_by(queued.priority.desc()).limit(1).scalar_subquery()
+    # One indexed UPDATE ... RETURNING; served = 0 in the WHERE keeps two concurrent pops from sharing a movie
+    for _ in range(2):
+        tmdb_id = db.session.execute(
+            RecommendationQueue.__table__.update()
+            .where(queued.user_id == user_id, queued.tmdb_id == next_id, queued.served == False)
+            .values(served=True, served_at=time.time())
+            .returning(queued.tmdb_id)
+        ).scalar()
+        db.session.commit()
+        if tmdb_id is not None:
+            break
+    if tmdb_id is not None:
+        _refill_if_low(user_id)
+    elif not genre_ids:
+        _refill_if_low(user_id, empty=True) # Nothing left to pop: no need to look at the queue
+    return tmdb_id
+
+def _queue_is_low(user_id):
+    # Reads at most LOW_WATER entries of the (user_id, served, priority) index instead of counting the queue
+    low_water = app.config['RECOMMENDATION_QUEUE_LOW_WATER']
+    if low_water <= 0:
+        return False
+    return (db.session.query(RecommendationQueue.tmdb_id)
+            .filter_by(user_id=user_id, served=False)
+            .order_by(RecommendationQueue.priority.desc())
+            .offset(low_water - 1)
+            .limit(1)
+            .scalar()) is None
+
+def _refill_if_low(user_id, empty=False):
+    if not empty and not _queue_is_low(user_id):
+        return
+    pending = (db.session.query(Job.id)
+               .filter(Job.kind == 'refill_recommendations', Job.status.in_(['queued', 'running']),
+                       Job.params['user_id'].as_integer() == user_id)
+               .first())
+    if pending is None:
+        job_queue.enqueue('refill_recommendations', {'user_id': user_id})
+
+def refill_recommendation_queue(user_id):
+    """Tops the user's queue up to RECOMMENDATION_QUEUE_SIZE unseen movies; returns how many were added."""
+    served_ids = _queue_ids(user_id, served=True)
+    queued_ids = _queue_ids(user_id, served=False)
+    missing = app.config['RECOMMENDATION_QUEUE_SIZE'] - len(queued_ids)
+    if missing <= 0:
+        return 0
+    catalog = get_movie_catalog()
+    genre_matrix = catalog.genre_matrix()
+    ratings, rated_ids = _user_ratings(user_id, catalog)
+    extra_scores = _collaborative_scores(user_id, genre_matrix)
+    ids, scores, noise = recommender.rank(genre_matrix, ratings, rated_ids | served_ids | queued_ids, k=missing, extra_scores=extra_scores)
+    if len(ids) < missing and served_ids:
+        # Every unrated movie has been served: forget the served history and start over
+        RecommendationQueue.query.filter_by(user_id=user_id, served=True).delete(synchronize_session=False)
+        ids, scores, noise = recommender.rank(genre_matrix, ratings, rated_ids | queued_ids, k=missing, extra_scores=extra_scores)
+    rows = [{'user_id': user_id, 'tmdb_id': int(tmdb_id), 'score': float(score), 'noise': float(n), 'priority': float(score + n)}
+            for tmdb_id, score, n in zip(ids, scores, noise)]
+    if rows:
+        db.session.execute(RecommendationQueue.__table__.insert(), rows)
+    _trim_served_history(user_id)
+    db.session.commit()
+    return len(rows)
+
+def _queue_ids(user_id, served):
+    return {row[0] for row in db.session.query(RecommendationQueue.tmdb_id).filter_by(user_id=user_id, served=served)}
+
+def _trim_served_history(user_id):
+    keep = (select(RecommendationQueue.tmdb_id)
+            .where(RecommendationQueue.user_id == user_id, RecommendationQueue.served == True)
+            .order_by(RecommendationQueue.served_at.desc())
+            .limit(app.config['RECOMMENDATION_SERVED_HISTORY']))
+    (RecommendationQueue.query
+     .filter(RecommendationQueue.user_id == user_id, RecommendationQueue.served == True, RecommendationQueue.tmdb_id.not_in(keep))
+     .delete(synchronize_session=False))
+
+def rerank_recommendation_queue(user_id, rated_ids):
+    """Re-scores the user's queued movies after new ratings, instead of rebuilding the queue."""
+    RecommendationQueue.query.filter(
+        RecommendationQueue.user_id == user_id, RecommendationQueue.served == False, RecommendationQueue.tmdb_id.in_(rated_ids)
+    ).delete(synchronize_session=False)
+    queued = RecommendationQueue.query.filter_by(user_id=user_id, served=False).all()
+    if queued:
+        catalog = get_movie_catalog()
+        genre_matrix = catalog.genre_matrix()
+        ratings, _ = _user_ratings(user_id, catalog)
+        scores = recommender.rescore(genre_matrix, ratings, [row.tmdb_id for row in queued],
+                                     extra_scores=_collaborative_scores(user_id, genre_matrix))
+        for row, score in zip(queued, scores):
+            row.score = float(score)
+            row.priority = row.score + row.noise
+    db.session.commit()
+    if queued:
+        _refill_if_low(user_id)
+
+@job_queue.handler('refill_recommendations')
+def refill_recommendations_job(job, report_progress):
+    report_progress(added=refill_recommendation_queue(job.params['user_id']))
+
 @app.route('/random-movie')
 def random_movie():
     selected_genres_str = request.args.get('genres')
@@ -317,49 +1574,27 @@ def random_movie():
     if selected_genres_str:
         selected_genre_ids = [int(x) for x in selected_genres_str.split(',')]
 
-    selected_movies = []
-    movie_db = app.config.get('MOVIE_DB', [])
-
-    if current_user.is_authenticated:
-        liked_preferences = UserMoviePreference.query.filter_by(user_id=current_user.id, preference=True).all()
-        if liked_preferences:
-            liked_genres_names = set()
-            for pref in liked_preferences:
-                if pref.genres:
-                    liked_genres_names.update(pref.genres.split(', '))
-            
-            if liked_genres_names:
-                # Prioritize movies with liked genres
-                for movie in movie_db:
-                    movie_genres_names = set(movie['genres'].split(', '))
-                    if any(g in liked_genres_names for g in movie_genres_names):
-                        # Apply additional genre filter if selected
-                        if not selected_genre_ids or any(gid in selected_genre_ids for gid in movie.get('genre_ids', [])):
-                            selected_movies.append(movie)
-    
-    if not selected_movies:
-        # Fallback to all movies if no liked genres or no matches, applying selected genre filter
-        if selected_genre_ids:
-            for movie in movie_db:
-                if any(gid in selected_genre_ids for gid in movie.get('genre_ids', [])):
-                    selected_movies.append(movie)
-        else:
-            selected_movies = movie_db
-
-    if selected_movies:
-        random_movie_data = random.choice(selected_movies)
-        movie_data = {
-            "id": random_movie_data['id'],
-            "title": random_movie_data['title'],
-            "score": round(random_movie_data['score'], 2),
-            "poster_url": random_movie_data['poster_url'],
-            "trailer_url": random_movie_data['trailer_url'],
-            "overview": random_movie_data['overview'],
-            "release_date": random_movie_data['release_date'],
-            "genres": random_movie_data['genres'],
-            "genre_ids": random_movie_data.get('genre_ids', []), # Include genre IDs
-            "cast": random_movie_data['cast']
-        }
+    catalog = get_movie_catalog()
+    if request.args.get('mode', app.config['RANDOM_MOVIE_MODE']) == 'recommend':
+        random_movie_data = _recommend_movie(catalog, selected_genre_ids)
+    else:
+        liked_genre_ids = None
+        if current_user.is_authenticated:
+            liked_genre_ids = {row[0] for row in (
+                db.session.query(MovieGenre.genre_id)
+                .join(Movie, Movie.id == MovieGenre.movie_id)
+                .join(UserMoviePreference, UserMoviePreference.tmdb_id == Movie.tmdb_id)
+                .filter(UserMoviePreference.user_id == current_user.id, UserMoviePreference.preference == True)
+                .distinct()
+            )}
+
+        # Prioritize movies with liked genres, falling back to the genre filter alone
+        random_movie_data = catalog.pick(selected_genre_ids, liked_genre_ids)
+
+    if random_movie_data:
+        movie_data = random_movie_data._asdict()
+        movie_data['score'] = round(movie_data['score'] or 0, 2)
+        movie_data['genre_ids'] = list(movie_data['genre_ids']) # Include genre IDs
     else:
         movie_data = {
             "id": None,
@@ -375,6 +1610,93 @@ def random_movie():
         }
     return jsonify(movie_data)
 
+# TMDb fallbacks for /search-movie run here so a slow TMDb cannot hold the request
+search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='search-fallback')
+# The detail lookups of a search's hits run in parallel here
+search_details_executor = ThreadPoolExecutor(max_workers=app.config['TMDB_MAX_WORKERS'], thread_name_prefix='search-details')
+# Bounds the fallbacks waiting on search_executor, whose own queue is unbounded
+search_slots = threading.BoundedSemaphore(app.config['SEARCH_REMOTE_MAX_PENDING'])
+
+def _search_tmdb(query, selected_genre_ids):
+    # The TMDb search hits that pass the genre filter
+    data = tmdb.get('/search/movie', params={'query': query, 'language': 'en-US'})
+    if not data or 'results' not in data:
+        return []
+    return [movie for movie in data['results']
+            if not selected_genre_ids or any(gid in selected_genre_ids for gid in movie.get('genre_ids', []))]
+
+def _search_result(movie, details, genres_map):
+    genres_names = [genres_map.get(gid) for gid in movie.get('genre_ids', []) if gid in genres_map]
+    return {
+        "id": movie['id'],
+        "title": movie['title'],
+        "score": movie.get('vote_average', 0),
+        "poster_url": TMDB_IMAGE_BASE_URL + movie['poster_path'] if movie.get('poster_path') else None,
+        "trailer_url": details['trailer_url'],
+        "overview": movie.get('overview', 'No overview available.'),
+        "release_date": movie.get('release_date', 'N/A'),
+        "genres": ", ".join(genres_names),
+        "genre_ids": movie.get('genre_ids', []), # Include genre IDs
+        "cast": details['cast']
+    }
+
+def _finished_details(future):
+    # Details still loading (or failed) leave the trailer and cast empty
+    if future.done() and future.exception() is None:
+        return future.result()
+    return {'movie': None, 'trailer_url': None, 'cast': ""}
+
+def _enrich_catalog(fetched):
+    # Adds TMDb search hits that qualify for the catalog, so the next search is answered locally
+    with app.app_context():
+        try:
+            candidates = {movie['id']: (movie, details) for movie, details in fetched if _is_catalog_eligible(movie)}
+            if not candidates:
+                return
+            known = {row[0] for row in db.session.query(Movie.tmdb_id).filter(Movie.tmdb_id.in_(list(candidates)))}
+            genres_map = get_genres_map()
+            # Another request (or an ingestion job) may insert the same hits first; those are skipped
+            added = insert_new_movies([_movie_from_tmdb(movie, details, genres_map)
+                                       for tmdb_id, (movie, details) in candidates.items() if tmdb_id not in known])
+            sync_movie_links(added, replace=False)
+            db.session.commit()
+            if added:
+                if movie_catalog.loaded:
+                    movie_catalog.add_written([_catalog_record(movie) for movie in added], [movie.id for movie in added])
+                _enqueue_similarity_update()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"ERROR: Failed to add TMDb search results to the catalog. Error: {e}")
+
+def _remote_search(query, selected_genre_ids, results_future, details_deadline):
+    try:
+        try:
+            with app.app_context():
+                hits = _search_tmdb(query, selected_genre_ids)
+                genres_map = get_genres_map()
+        except Exception as e:
+            results_future.set_exception(e)
+            return
+        details = [search_details_executor.submit(fetch_movie_details, movie['id']) for movie in hits]
+        # Answer with whatever details arrived in time; the rest only feed the catalog
+        wait_futures(details, timeout=max(0, details_deadline - time.monotonic()))
+        results_future.set_result([_search_result(movie, _finished_details(future), genres_map) for movie, future in zip(hits, details)])
+        if app.config['SEARCH_ENRICH_CATALOG']:
+            wait_futures(details)
+            _enrich_catalog([(movie, _finished_details(future)) for movie, future in zip(hits, details)])
+    finally:
+        search_slots.release()
+
+def _search_local(query, selected_genre_ids, limit):
+    try:
+        movies = search_index.search(db.session, Movie, query, limit=limit,
+                                     movie_ids=_movies_with_genres(selected_genre_ids) if selected_genre_ids else None)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"ERROR: Local movie search failed for '{query}'. Error: {e}")
+        return []
+    return [_movie_to_dict(movie) for movie in movies]
+
 @app.route('/search-movie')
 def search_movie():
     query = request.args.get('query')
@@ -386,33 +1708,33 @@ def search_movie():
     if not query:
         return jsonify({"error": "Query parameter is missing"}), 400
 
-    search_url = f"https://api.themoviedb.org/3/search/movie?api_key={TMDB_API_KEY}&query={query}&language=en-US"
-    response = requests.get(search_url)
-    data = response.json()
-
-    results = []
-    if data and 'results' in data:
-        for movie in data['results']:
-            genres_map = app.config.get('GENRES_MAP', {})
-            genres_names = [genres_map.get(gid) for gid in movie.get('genre_ids', []) if gid in genres_map]
-            
-            # Apply genre filter to search results
-            if not selected_genre_ids or any(gid in selected_genre_ids for gid in movie.get('genre_ids', [])):
-                trailer_url = get_movie_trailer(movie['id'])
-                cast = get_movie_cast(movie['id'])
-                results.append({
-                    "id": movie['id'],
-                    "title": movie['title'],
-                    "score": movie.get('vote_average', 0),
-                    "poster_url": TMDB_IMAGE_BASE_URL + movie['poster_path'] if movie.get('poster_path') else None,
-                    "trailer_url": trailer_url,
-                    "overview": movie.get('overview', 'No overview available.'),
-                    "release_date": movie.get('release_date', 'N/A'),
-                    "genres": ", ".join(genres_names),
-                    "genre_ids": movie.get('genre_ids', []), # Include genre IDs
-                    "cast": cast
-                })
-    return jsonify(results)
+    limit = app.config['SEARCH_RESULTS_LIMIT']
+    results = _search_local(query, selected_genre_ids, limit)
+    if len(results) >= app.config['SEARCH_MIN_LOCAL_RESULTS']:
+        return jsonify(results)
+
+    # Too few local hits: ask TMDb, but never wait on it longer than SEARCH_REMOTE_TIMEOUT
+    if not search_slots.acquire(blocking=False):
+        print(f"DEBUG: Too many TMDb searches pending; answering '{query}' from the local catalog.")
+        return jsonify(results)
+    timeout = app.config['SEARCH_REMOTE_TIMEOUT']
+    remote_future = Future()
+    # Stop waiting on details a little early so the hits themselves make it back in time
+    search_executor.submit(_remote_search, query, selected_genre_ids, remote_future, time.monotonic() + timeout * 0.8)
+    try:
+        remote_results = remote_future.result(timeout=timeout)
+    except FutureTimeoutError:
+        print(f"DEBUG: TMDb search for '{query}' is still running; answering from the local catalog.")
+        remote_results = []
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"ERROR: Failed to search TMDb for '{query}'. Error: {e}")
+        if not results:
+            return jsonify({"error": "Movie search is temporarily unavailable"}), 502
+        remote_results = []
+
+    local_ids = {movie['id'] for movie in results}
+    results.extend(movie for movie in remote_results if movie['id'] not in local_ids)
+    return jsonify(results[:limit])
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -454,6 +1776,62 @@ def logout():
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
+def _preference_row(item):
+    preference = item.get('preference')
+    if not isinstance(preference, bool):
+        raise ValueError('preference must be true or false')
+    return {
+        'movie_title': item['title'],
+        'tmdb_id': int(item['id']),
+        'genres': item.get('genres'),
+        'preference': preference,
+    }
+
+def upsert_preferences(user_id, rows):
+    """Inserts or updates preferences in a single INSERT ... ON CONFLICT statement."""
+    # A statement may touch each (user_id, tmdb_id) only once; the last swipe wins
+    rows = list({row['tmdb_id']: dict(row, user_id=user_id) for row in rows}.values())
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(UserMoviePreference).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'tmdb_id'],
+            set_={column: statement.excluded[column] for column in ('movie_title', 'genres', 'preference')},
+        )
+        db.session.execute(statement)
+    else:
+        for row in rows:
+            existing = UserMoviePreference.query.filter_by(user_id=user_id, tmdb_id=row['tmdb_id']).first()
+            if existing:
+                existing.movie_title, existing.genres, existing.preference = row['movie_title'], row['genres'], row['preference']
+            else:
+                db.session.add(UserMoviePreference(**row))
+    bump_preferences_version(user_id)
+    db.session.commit()
+    rerank_recommendation_queue(user_id, [row['tmdb_id'] for row in rows])
+    _schedule_item_neighbours_build()
+    return len(rows)
+
+def bump_preferences_version(user_id):
+    # Part of the caller's transaction; the counter moves together with the preferences it describes
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(PreferenceVersion).values(user_id=user_id, version=1)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id'], set_={'version': PreferenceVersion.version + 1}))
+    else:
+        row = db.session.get(PreferenceVersion, user_id)
+        if row is None:
+            db.session.add(PreferenceVersion(user_id=user_id, version=1))
+        else:
+            row.version += 1
+
+def preferences_versions(user_ids):
+    versions = dict(db.session.query(PreferenceVersion.user_id, PreferenceVersion.version).filter(PreferenceVersion.user_id.in_(user_ids)))
+    return {user_id: versions.get(user_id, 0) for user_id in user_ids}
+
 @app.route('/movie-preference', methods=['POST'])
 @login_required
 def movie_preference():
@@ -466,31 +1844,38 @@ def movie_preference():
     if not movie_title or preference is None or tmdb_id is None or genres is None:
         return jsonify({"error": "Missing movie title, ID, genres or preference"}), 400
 
-    # Check if preference already exists for this user and movie
-    existing_preference = UserMoviePreference.query.filter_by(
-        user_id=current_user.id,
-        movie_title=movie_title
-    ).first()
-
-    if existing_preference:
-        existing_preference.preference = preference
-        existing_preference.tmdb_id = tmdb_id
-        existing_preference.genres = genres
-    else:
-        new_preference = UserMoviePreference(
-            user_id=current_user.id,
-            movie_title=movie_title,
-            tmdb_id=tmdb_id,
-            genres=genres,
-            preference=preference
-        )
-        db.session.add(new_preference)
-    
-    db.session.commit()
+    try:
+        row = _preference_row(data)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid movie ID or preference"}), 400
+    upsert_preferences(current_user.id, [row])
     return jsonify({"message": "Preference saved successfully"}), 200
 
+@app.route('/movie-preferences', methods=['POST'])
+@login_required
+def movie_preferences_batch():
+    # Many swipes in one request: {"preferences": [{"title", "id", "genres", "preference"}, ...]}
+    data = request.get_json(silent=True) or {}
+    items = data.get('preferences') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty 'preferences' list"}), 400
+    if len(items) > app.config['PREFERENCES_BATCH_LIMIT']:
+        return jsonify({"error": f"At most {app.config['PREFERENCES_BATCH_LIMIT']} preferences per request"}), 400
+
+    rows = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict) or not item.get('title') or item.get('genres') is None:
+                raise ValueError
+            rows.append(_preference_row(item))
+        except (TypeError, ValueError):
+            return jsonify({"error": f"Invalid preference at index {index}"}), 400
+    saved = upsert_preferences(current_user.id, rows)
+    return jsonify({"message": f"Saved {saved} preferences", "saved": saved}), 200
+
 @app.route('/liked-movies')
 @login_required
+@cached_response(lambda: (current_user.id, preferences_versions([current_user.id])[current_user.id]), 'private, no-cache')
 def liked_movies():
     liked_movie_titles = [p.movie_title for p in current_user.preferences if p.preference == True]
     # For now, we'll just return the titles. We could fetch more details from TMDb if needed.
@@ -499,10 +1884,17 @@ def liked_movies():
 @app.route('/friends')
 @login_required
 def friends():
-    all_users = User.query.filter(User.id != current_user.id).all()
+    search = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
     friends = current_user.get_friends()
-    non_friends = [user for user in all_users if user not in friends]
-    return render_template('friends.html', friends=friends, non_friends=non_friends)
+
+    non_friends_query = User.query.filter(User.id != current_user.id, User.id.not_in(current_user.friend_ids_query()))
+    if search:
+        non_friends_query = non_friends_query.filter(User.username.icontains(search, autoescape=True))
+    non_friends = non_friends_query.order_by(User.username).paginate(
+        page=page, per_page=app.config['FRIENDS_PER_PAGE'], error_out=False)
+    return render_template('friends.html', friends=friends, non_friends=non_friends.items,
+                           non_friends_pagination=non_friends, search=search)
 
 @app.route('/add_friend', methods=['POST'])
 @login_required
@@ -577,14 +1969,111 @@ def shared_movies(friend_id):
         flash('You are not friends with this user.', 'danger')
         return redirect(url_for('friends'))
 
-    current_user_liked_movies = {p.movie_title for p in current_user.preferences if p.preference == True}
-    friend_liked_movies = {p.movie_title for p in friend.preferences if p.preference == True}
+    mine = aliased(UserMoviePreference)
+    theirs = aliased(UserMoviePreference)
+    shared = (db.session.query(mine.tmdb_id, mine.movie_title, Movie)
+              .join(theirs, and_(theirs.user_id == friend.id, theirs.preference == True, theirs.tmdb_id == mine.tmdb_id))
+              .outerjoin(Movie, Movie.tmdb_id == mine.tmdb_id)
+              .filter(mine.user_id == current_user.id, mine.preference == True)
+              .order_by(Movie.score.desc(), mine.tmdb_id)
+              .paginate(page=request.args.get('page', 1, type=int), per_page=app.config['SHARED_MOVIES_PER_PAGE'], error_out=False))
 
-    shared_liked_movie_titles = list(current_user_liked_movies.intersection(friend_liked_movies))
+    shared_movies = [_movie_card(tmdb_id, movie_title, movie) for tmdb_id, movie_title, movie in shared.items]
+    return render_template('shared_movies.html', friend=friend, shared_movies=shared_movies, pagination=shared)
+
+@app.route('/api/friends/group_overlap')
+@login_required
+def group_overlap():
+    # Movies liked by the most friends of the current user
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), app.config['API_MOVIES_MAX_PER_PAGE'])
+    friends_liked = func.count(UserMoviePreference.user_id.distinct())
+    ranked = (db.session.query(UserMoviePreference.tmdb_id, func.max(UserMoviePreference.movie_title), friends_liked)
+              .filter(UserMoviePreference.user_id.in_(current_user.friend_ids_query()),
+                      UserMoviePreference.preference == True,
+                      UserMoviePreference.tmdb_id.isnot(None))
+              .group_by(UserMoviePreference.tmdb_id)
+              .order_by(friends_liked.desc(), UserMoviePreference.tmdb_id)
+              .offset((page - 1) * per_page)
+              .limit(per_page)
+              .all())
+    movies = {movie.tmdb_id: movie for movie in Movie.query.filter(Movie.tmdb_id.in_([row[0] for row in ranked]))} if ranked else {}
+    results = []
+    for tmdb_id, movie_title, count in ranked:
+        movie_data = _movie_card(tmdb_id, movie_title, movies.get(tmdb_id))
+        movie_data['friends_liked'] = count
+        results.append(movie_data)
+    return jsonify(results)
 
-    # Optionally, fetch more details for these movies from TMDb if needed
-    # For now, just returning titles
-    return render_template('shared_movies.html', friend=friend, shared_liked_movie_titles=shared_liked_movie_titles)
+group_cache = LRUCache(app.config['GROUP_CACHE_SIZE'], ttl=app.config['GROUP_CACHE_SECONDS'])
+
+def rank_group_movies(member_ids, genre_ids=None, limit=None):
+    """``[(tmdb_id, group_score, liked_by), ...]`` best first for a group, cached per group and preference versions."""
+    limit = limit or app.config['API_MOVIES_MAX_PER_PAGE']
+    catalog = get_movie_catalog()
+    genre_matrix = catalog.genre_matrix()
+    versions = preferences_versions(member_ids)
+    # Any member's preference write or a catalog change produces a new key
+    key = (tuple(sorted(versions.items())), tuple(sorted(genre_ids or ())), genre_matrix.version, limit)
+    ranked = group_cache.get(key)
+    if ranked is not None:
+        return ranked
+    ratings = _ratings_by_user(member_ids, catalog)
+    members = sorted(member_ids)
+    extra_scores = None
+    for col, user_id in enumerate(members):
+        member_scores = _collaborative_scores(user_id, genre_matrix)
+        if member_scores is not None:
+            if extra_scores is None:
+                extra_scores = np.zeros((len(genre_matrix.ids), len(members)), dtype=np.float32)
+            extra_scores[:, col] = member_scores
+    liked = [{tmdb_id for tmdb_id, _, is_liked in ratings[user_id] if is_liked} for user_id in members]
+    ids, scores, member_scores = recommender.rank_group(
+        genre_matrix,
+        [[(gids, is_liked) for _, gids, is_liked in ratings[user_id]] for user_id in members],
+        liked,
+        [{tmdb_id for tmdb_id, _, is_liked in ratings[user_id] if not is_liked} for user_id in members],
+        k=limit,
+        genre_ids=genre_ids,
+        misery_weight=app.config['GROUP_MISERY_WEIGHT'],
+        extra_scores=extra_scores,
+    )
+    ranked = [(int(tmdb_id), float(score), sum(int(tmdb_id) in member_liked for member_liked in liked)) for tmdb_id, score in zip(ids, scores)]
+    group_cache.set(key, ranked)
+    return ranked
+
+@app.route('/api/friends/movie_night')
+@login_required
+def movie_night():
+    # Movies for the current user and ?friends=<id>,<id>,... to watch together; anything a member disliked is left out
+    try:
+        friend_ids = {int(x) for x in request.args.get('friends', '').split(',') if x.strip()}
+        genre_ids = [int(x) for x in request.args.get('genres', '').split(',') if x.strip()]
+    except ValueError:
+        return jsonify({"error": "friends and genres must be comma-separated ids"}), 400
+    friend_ids.discard(current_user.id)
+    if not friend_ids:
+        return jsonify({"error": "Choose at least one friend"}), 400
+    if len(friend_ids) + 1 > app.config['GROUP_MAX_MEMBERS']:
+        return jsonify({"error": f"A group can have at most {app.config['GROUP_MAX_MEMBERS']} members"}), 400
+    not_friends = friend_ids - {row[0] for row in db.session.execute(current_user.friend_ids_query())}
+    if not_friends:
+        return jsonify({"error": "Not your friends", "user_ids": sorted(not_friends)}), 400
+
+    limit = min(max(request.args.get('limit', 20, type=int), 1), app.config['API_MOVIES_MAX_PER_PAGE'])
+    member_ids = sorted(friend_ids | {current_user.id})
+    catalog = get_movie_catalog()
+    results = []
+    for tmdb_id, score, liked_by in rank_group_movies(member_ids, genre_ids)[:limit]:
+        record = catalog.movies.get(tmdb_id)
+        if record is None:
+            continue
+        movie_data = record._asdict()
+        movie_data['genre_ids'] = list(movie_data['genre_ids'])
+        movie_data['group_score'] = round(score, 4)
+        movie_data['liked_by'] = liked_by
+        results.append(movie_data)
+    return jsonify({'members': member_ids, 'movies': results})
 
 @app.route('/load_movies', methods=['GET', 'POST'])
 @login_required
@@ -592,11 +2081,31 @@ def shared_movies(friend_id):
 def load_movies():
     total_movies = Movie.query.count()
     if request.method == 'POST':
+        mode = request.form.get('mode', 'full')
         num_pages = request.form.get('num_pages', type=int)
-        if num_pages and num_pages > 0:
-            new_movies_count = fetch_top_rated_movies(start_page=1, end_page=num_pages) # Start from page 1 for simplicity
-            flash(f'Successfully fetched and added {new_movies_count} new movies.', 'success')
+        if mode == 'changes':
+            job = job_queue.enqueue('sync_changes')
+            flash(f'Started refreshing movies changed on TMDb (job #{job.id}).', 'success')
+        elif num_pages and num_pages > 0 and (mode != 'incremental' or next_top_rated_page() <= TMDB_MAX_PAGE):
+            # 'full' re-walks the list from page 1; 'incremental' continues after the last page loaded
+            start_page = next_top_rated_page() if mode == 'incremental' else 1
+            num_pages = min(num_pages, TMDB_MAX_PAGE - start_page + 1)
+            job = enqueue_movie_load(start_page, start_page + num_pages - 1)
+            flash(f'Started loading {num_pages} page(s) of movies in the background (job #{job.id}).', 'success')
         else:
             flash('Please enter a valid number of pages.', 'danger')
         return redirect(url_for('load_movies'))
-    return render_template('load_movies.html', total_movies=total_movies)
+    recent_jobs = [job_to_dict(job) for job in (Job.query.filter(Job.kind.in_(['load_top_rated', 'sync_changes']))
+                                                .order_by(Job.id.desc()).limit(5))]
+    sync_states = {state.source: state for state in SyncState.query.all()}
+    changes_synced_at = None
+    if 'changes' in sync_states and sync_states['changes'].last_synced_at:
+        changes_synced_at = datetime.fromtimestamp(sync_states['changes'].last_synced_at, timezone.utc).strftime('%Y-%m-%d %H:%M UTC')
+    return render_template('load_movies.html', total_movies=total_movies, jobs=recent_jobs,
+                           sync_states=sync_states, changes_synced_at=changes_synced_at)
+
+@app.route('/api/tmdb-stats')
+@login_required
+@admin_required
+def tmdb_stats():
+    return jsonify(tmdb.stats())
@@ -0,0 +1,143 @@
+"""In-memory movie catalog indexed by genre.
+
+Holds one compact record per movie plus per-genre sets of TMDb ids, so a
+random pick with genre filters is a few set operations and one
+``random.choice`` instead of a scan that re-parses genre strings.
+"""
+import random
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+CatalogMovie = namedtuple('CatalogMovie', [
+    'id', 'title', 'score', 'poster_url', 'trailer_url', 'overview', 'release_date', 'genres', 'genre_ids', 'cast',
+])
+
+
+class MovieCatalog:
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.movies = {}
+            self.by_genre_id = defaultdict(set)
+            self._ids = []
+            self.max_row_id = 0 # Highest Movie.id seen, for incremental refreshes
+            self.source_version = None # Catalog update sequence the last refresh read up to
+            self.loaded = False
+            self.last_refresh = 0.0
+            self._version = 0
+            self._matrix = None
+
+    def __len__(self):
+        return len(self.movies)
+
+    def add(self, records, row_ids=()):
+        """Adds or replaces movies given as ``CatalogMovie`` records."""
+        with self._lock:
+            changed = False
+            for record in records:
+                previous = self.movies.get(record.id)
+                if previous == record:
+                    continue
+                if previous is not None:
+                    self._unindex(previous)
+                else:
+                    self._ids.append(record.id)
+                self.movies[record.id] = record
+                for gid in record.genre_ids:
+                    self.by_genre_id[gid].add(record.id)
+                changed = True
+            self.max_row_id = max([self.max_row_id, *row_ids])
+            self.loaded = True
+            # Derived snapshots (genre matrix, group cache keys) only go stale when a movie changed
+            if changed:
+                self._version += 1
+
+    def add_written(self, records, row_ids=(), update_seq=None):
+        """Adds movies this process just committed.
+
+        The refresh cursors only move past them when no other worker's rows
+        can sit in between; otherwise the next refresh reads them once more.
+        """
+        with self._lock:
+            row_ids = sorted(row_ids)
+            contiguous = row_ids == list(range(self.max_row_id + 1, self.max_row_id + 1 + len(row_ids)))
+            self.add(records, row_ids if contiguous else ())
+            if update_seq is not None and self.source_version is not None and update_seq == self.source_version + 1:
+                self.source_version = update_seq
+
+    def _unindex(self, record):
+        for gid in record.genre_ids:
+            self.by_genre_id[gid].discard(record.id)
+
+    def needs_refresh(self):
+        return not self.loaded or time.monotonic() - self.last_refresh >= self.refresh_interval
+
+    def mark_refreshed(self):
+        self.last_refresh = time.monotonic()
+
+    def ids_with_genres(self, genre_ids=None, liked_genre_ids=None):
+        """Ids in any of ``genre_ids`` and any of ``liked_genre_ids`` (None means no constraint)."""
+        with self._lock:
+            candidates = None
+            for group in (liked_genre_ids, genre_ids):
+                if group is not None:
+                    matching = set().union(*(self.by_genre_id.get(gid, ()) for gid in group))
+                    candidates = matching if candidates is None else candidates & matching
+            return candidates
+
+    def pick(self, genre_ids=None, liked_genre_ids=None, rng=random):
+        """Random movie, preferring liked genres and honouring the genre filter."""
+        genre_ids = list(genre_ids) if genre_ids else None
+        with self._lock:
+            if liked_genre_ids:
+                candidates = self.ids_with_genres(genre_ids, liked_genre_ids)
+                if candidates:
+                    return self.movies[rng.choice(tuple(candidates))]
+            if genre_ids:
+                candidates = self.ids_with_genres(genre_ids)
+                return self.movies[rng.choice(tuple(candidates))] if candidates else None
+            return self.movies[rng.choice(self._ids)] if self._ids else None
+
+    def genre_matrix(self):
+        """Returns a ``GenreMatrix`` snapshot, rebuilt only after the catalog changes."""
+        with self._lock:
+            if self._matrix is None or self._matrix.version != self._version:
+                self._matrix = GenreMatrix.build([self.movies[i] for i in self._ids], self._version)
+            return self._matrix
+
+
+class GenreMatrix:
+    """Movie x genre matrix for vectorized scoring.
+
+    Row ``i`` describes movie ``ids[i]``. Rows are scaled to sum to 1 so a
+    movie tagged with many genres does not outscore a focused one.
+    """
+
+    def __init__(self, ids, columns, matrix, membership, version):
+        self.ids = ids
+        self.columns = columns
+        self.column_of = {gid: col for col, gid in enumerate(columns)}
+        self.row_of = {int(movie_id): row for row, movie_id in enumerate(ids)}
+        self.matrix = matrix
+        self.membership = membership # Boolean, unscaled: which genres each movie has
+        self.version = version
+
+    @classmethod
+    def build(cls, records, version=0):
+        columns = sorted({gid for record in records for gid in record.genre_ids})
+        column_of = {gid: col for col, gid in enumerate(columns)}
+        ids = np.fromiter((record.id for record in records), dtype=np.int64, count=len(records))
+        rows = [row for row, record in enumerate(records) for _ in record.genre_ids]
+        cols = [column_of[gid] for record in records for gid in record.genre_ids]
+        membership = np.zeros((len(records), len(columns)), dtype=bool)
+        membership[rows, cols] = True
+        counts = membership.sum(axis=1, keepdims=True)
+        matrix = np.divide(membership, counts, out=np.zeros(membership.shape, dtype=np.float32), where=counts > 0)
+        return cls(ids, columns, matrix.astype(np.float32), membership, version)
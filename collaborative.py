@@ -0,0 +1,148 @@
+"""Item-item collaborative filtering over the like/dislike matrix.
+
+Ratings form a sparse user x movie matrix (+1 like, -1 dislike) kept as
+CSR/CSC index arrays in numpy. Two movies are similar when the same users
+rated them the same way: the cosine of their rating columns, shrunk towards
+0 while few users rated both. Similarities are computed a block of movies at
+a time; each block expands only the (movie, co-rated movie) pairs of its
+raters and sums them with ``np.bincount``. Memory therefore follows
+``max_pairs`` and ``max_cells``, not the square of the catalog.
+"""
+import numpy as np
+
+
+class RatingMatrix:
+    """Sparse user x movie ratings with both row (user) and column (movie) access."""
+
+    def __init__(self, users, movies, values):
+        self.movie_ids, cols = np.unique(np.asarray(movies, dtype=np.int64), return_inverse=True)
+        _, rows = np.unique(np.asarray(users, dtype=np.int64), return_inverse=True)
+        cols, rows = cols.astype(np.int32), rows.astype(np.int32) # Halves the index arrays for large rating tables
+        values = np.asarray(values, dtype=np.float32)
+        self.shape = (int(rows.max()) + 1 if len(rows) else 0, len(self.movie_ids))
+        # CSR: the movies each user rated
+        order = np.lexsort((cols, rows))
+        self.user_ptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=self.shape[0]))])
+        self.user_cols = cols[order]
+        self.user_values = values[order]
+        # CSC: the users who rated each movie
+        order = np.lexsort((rows, cols))
+        self.movie_ptr = np.concatenate([[0], np.cumsum(np.bincount(cols, minlength=self.shape[1]))])
+        self.movie_rows = rows[order]
+        self.movie_values = values[order]
+        self.norms = np.sqrt(np.bincount(cols, weights=values * values, minlength=self.shape[1])).astype(np.float32)
+
+    @classmethod
+    def from_rows(cls, rows, chunk_size=100000):
+        """Builds the matrix from an iterable of ``(user_id, tmdb_id, liked)``, reading it in chunks."""
+        users, movies, values = [], [], []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                cls._append(chunk, users, movies, values)
+                chunk = []
+        cls._append(chunk, users, movies, values)
+        return cls(np.concatenate(users), np.concatenate(movies), np.concatenate(values))
+
+    @staticmethod
+    def _append(chunk, users, movies, values):
+        array = np.array(chunk, dtype=np.int64).reshape(-1, 3)
+        users.append(array[:, 0])
+        movies.append(array[:, 1])
+        values.append(np.where(array[:, 2] > 0, 1.0, -1.0).astype(np.float32))
+
+    def ratings_count(self):
+        return len(self.user_cols)
+
+
+def _blocks(matrix, max_pairs, max_cells):
+    # Consecutive movie ranges of about max_pairs expanded pairs whose dense score block stays under max_cells
+    max_block = max(1, max_cells // max(matrix.shape[1], 1))
+    user_lengths = np.diff(matrix.user_ptr)
+    pairs_per_movie = np.bincount(
+        np.repeat(np.arange(matrix.shape[1]), np.diff(matrix.movie_ptr)),
+        weights=user_lengths[matrix.movie_rows],
+        minlength=matrix.shape[1],
+    )
+    start = 0
+    while start < matrix.shape[1]:
+        end = start + 1
+        total = pairs_per_movie[start]
+        while end < matrix.shape[1] and end - start < max_block and total + pairs_per_movie[end] <= max_pairs:
+            total += pairs_per_movie[end]
+            end += 1
+        yield start, end
+        start = end
+
+
+def neighbours(matrix, k=20, min_common=2, shrinkage=10.0, max_pairs=2000000, max_cells=4000000):
+    """Yields ``(tmdb_ids, neighbour_ids, scores, common)`` per block of movies.
+
+    Every array has one row per movie of the block and ``k`` columns, best
+    first; empty slots have neighbour id -1. Only positive similarities
+    count, and pairs rated by fewer than ``min_common`` users are skipped.
+    """
+    n_movies = matrix.shape[1]
+    k = min(k, max(n_movies - 1, 0))
+    if k == 0:
+        return
+    for start, end in _blocks(matrix, max_pairs, max_cells):
+        size = end - start
+        # (movie in block, user, value) for every rating of the block's movies
+        local = np.repeat(np.arange(size), np.diff(matrix.movie_ptr[start:end + 1]))
+        users = matrix.movie_rows[matrix.movie_ptr[start]:matrix.movie_ptr[end]]
+        values = matrix.movie_values[matrix.movie_ptr[start]:matrix.movie_ptr[end]]
+        user_lengths = matrix.user_ptr[users + 1] - matrix.user_ptr[users]
+        dots = np.zeros(size * n_movies)
+        common = np.zeros(size * n_movies, dtype=np.int64)
+        # Popular movies have many raters: expand them a slice of at most max_pairs pairs at a time
+        ends = np.cumsum(user_lengths)
+        splits = np.searchsorted(ends, np.arange(max_pairs, ends[-1] if len(ends) else 0, max_pairs), side='right')
+        for lo, hi in zip(np.concatenate([[0], splits]), np.concatenate([splits, [len(users)]])):
+            if lo == hi:
+                continue
+            lengths = user_lengths[lo:hi]
+            # Expand each rating to every movie the same user rated
+            offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            positions = np.repeat(matrix.user_ptr[users[lo:hi]], lengths) + offsets
+            keys = np.repeat(local[lo:hi], lengths) * n_movies + matrix.user_cols[positions]
+            dots += np.bincount(keys, weights=np.repeat(values[lo:hi], lengths) * matrix.user_values[positions], minlength=size * n_movies)
+            common += np.bincount(keys, minlength=size * n_movies)
+        dots = dots.reshape(size, n_movies)
+        common = common.reshape(size, n_movies)
+
+        norms = matrix.norms[start:end, None] * matrix.norms[None, :]
+        scores = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0) * (common / (common + shrinkage))
+        scores[np.arange(size), np.arange(start, end)] = -np.inf # Not its own neighbour
+        scores[(common < min_common) | (scores <= 0)] = -np.inf
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        found = np.isfinite(best_scores)
+        yield (
+            matrix.movie_ids[start:end],
+            np.where(found, matrix.movie_ids[best], -1),
+            np.where(found, best_scores, 0).astype(np.float32),
+            np.where(found, np.take_along_axis(common, best, axis=1), 0),
+        )
+
+
+def predict(genre_matrix, rows, damping=1.0):
+    """Scores the catalog from ``rows`` of ``(neighbour_id, similarity, liked)``.
+
+    Each row says the user rated a movie whose neighbour is ``neighbour_id``.
+    A movie's score is the similarity-weighted mean of those ratings, damped
+    by ``damping`` so one weak neighbour cannot produce a confident score.
+    Returns one score per row of ``genre_matrix``, 0 where nothing applies.
+    """
+    totals = np.zeros(len(genre_matrix.ids), dtype=np.float32)
+    weights = np.zeros(len(genre_matrix.ids), dtype=np.float32)
+    for neighbour_id, score, liked in rows:
+        row = genre_matrix.row_of.get(neighbour_id)
+        if row is not None:
+            totals[row] += score * (1.0 if liked else -1.0)
+            weights[row] += abs(score)
+    return totals / (weights + damping)
@@ -0,0 +1,160 @@
+"""Database engine setup.
+
+- The URI comes from ``DATABASE_URL`` (SQLite file by default, PostgreSQL in
+  production) so the same models run everywhere.
+- SQLite connections get WAL journaling and tuned pragmas on connect, so the
+  gunicorn workers' readers no longer block behind a writer.
+- GET/HEAD requests run their SELECTs on a separate read-only pool: the same
+  SQLite file opened with ``mode=ro``, or ``DATABASE_READ_URL`` (e.g. a
+  replica) on other databases.
+- ``track_queries()`` counts the statements and DB time of a block of code.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+
+DEFAULT_DATABASE_URI = 'sqlite:///site.db'
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL', # Safe with WAL; only the last commits can be lost on power failure
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000, # In KiB, i.e. 64 MB per connection
+    'temp_store': 'MEMORY',
+}
+
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL') or DEFAULT_DATABASE_URI
+    # Hosted PostgreSQL often hands out the scheme SQLAlchemy no longer accepts
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+        return {}
+    return {'pool_pre_ping': True, 'pool_size': 5, 'max_overflow': 10, 'pool_recycle': 1800}
+
+
+def _set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    return on_connect
+
+
+def _is_memory(url):
+    return url.database in (None, '', ':memory:') or 'mode=memory' in str(url)
+
+
+def init_app(app, db):
+    """Installs the pragmas and the read-only engine; call after ``SQLAlchemy(app)``."""
+    with app.app_context():
+        engine = db.engine
+    read_engine = None
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas(SQLITE_PRAGMAS))
+        if not _is_memory(engine.url) and app.config.get('SQLALCHEMY_READONLY_POOL', True):
+            read_engine = create_engine(f'sqlite:///file:{engine.url.database}?mode=ro&uri=true')
+            read_pragmas = {k: v for k, v in SQLITE_PRAGMAS.items() if k != 'journal_mode'}
+            read_pragmas['query_only'] = 'ON'
+            event.listen(read_engine, 'connect', _set_sqlite_pragmas(read_pragmas))
+    elif os.environ.get('DATABASE_READ_URL'):
+        read_engine = create_engine(os.environ['DATABASE_READ_URL'], **engine_options(os.environ['DATABASE_READ_URL']))
+    app.extensions['readonly_engine'] = read_engine
+
+
+class RoutingSession(Session):
+    """Sends the SELECTs of GET/HEAD requests to the read-only engine.
+
+    Anything else goes to the primary, and once a request has written,
+    its later reads do too, so it always sees its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            return current_app.extensions['readonly_engine']
+        if clause is not None and not isinstance(clause, Select):
+            self.info['wrote'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        return (
+            current_app.extensions.get('readonly_engine') is not None
+            and isinstance(clause, Select)
+            and not self._flushing
+            and not self.info.get('wrote')
+            and not (self.new or self.dirty or self.deleted)
+            and has_request_context()
+            and request.method in ('GET', 'HEAD')
+        )
+
+
+def _reset_write_flag(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
+
+
+event.listen(RoutingSession, 'after_transaction_end', _reset_write_flag)
+
+
+_tracking = threading.local()
+
+
+@contextmanager
+def track_queries():
+    """Counts the statements this thread runs (on any engine) inside the block.
+
+    Yields a dict whose ``queries`` and ``seconds`` keep growing until the
+    block exits. Blocks can be nested; each sees its own totals.
+    """
+    stats = start_tracking()
+    try:
+        yield stats
+    finally:
+        stop_tracking(stats)
+
+
+def start_tracking():
+    """Like ``track_queries`` for code that cannot use a ``with`` block (e.g. request hooks)."""
+    stats = {'queries': 0, 'seconds': 0.0}
+    _tracking.__dict__.setdefault('stack', []).append(stats)
+    return stats
+
+
+def stop_tracking(stats):
+    stack = getattr(_tracking, 'stack', [])
+    # By identity: nested blocks with equal totals compare equal as dicts
+    for i, item in enumerate(stack):
+        if item is stats:
+            del stack[i]
+            break
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_tracking, 'stack', None):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    for stats in getattr(_tracking, 'stack', ()):
+        stats['queries'] += 1
+        stats['seconds'] += elapsed
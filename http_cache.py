@@ -0,0 +1,139 @@
+"""Cached, compressed and conditional responses for read-heavy endpoints.
+
+``cached`` memoizes a view's 200 response under a key the app derives from
+the route, the query string and the version counters of the data behind it,
+so a write elsewhere simply produces a new key. Each cached body carries a
+strong ETag (a hash of the body) and keeps its gzip/brotli encodings once
+made, so a hit costs neither serialization nor compression, and a client
+that already has the body gets ``304 Not Modified``. brotli is optional and
+only used when the package is installed.
+"""
+import gzip
+import hashlib
+import threading
+from functools import wraps
+
+from flask import current_app, request
+
+_brotli = None
+_brotli_checked = False
+
+
+def brotli_module():
+    global _brotli, _brotli_checked
+    if not _brotli_checked:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+        _brotli_checked = True
+    return _brotli
+
+
+def accepted_encoding(accept_encoding):
+    """``'br'``, ``'gzip'`` or None: the best encoding the client accepts."""
+    accepted = set()
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if name and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name)
+    if 'br' in accepted and brotli_module() is not None:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level=6):
+    if encoding == 'br':
+        return brotli_module().compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _vary(response):
+    if 'accept-encoding' not in response.headers.get('Vary', '').lower():
+        response.vary.add('Accept-Encoding')
+
+
+def compress_response(response, min_size=1024, level=6):
+    """Compresses a finished JSON or text response in place when it is large enough and the client accepts it."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype == 'application/json' or response.mimetype.startswith('text/'))):
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    _vary(response)
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class CachedResponse:
+    """One cached body with its ETag and lazily built compressed variants."""
+
+    def __init__(self, response):
+        self.body = response.get_data()
+        self.mimetype = response.mimetype
+        self.headers = [(name, value) for name, value in response.headers.items()
+                        if name.lower() not in ('content-length', 'content-type', 'etag', 'cache-control', 'vary')]
+        self.tag = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def etag(self, encoding):
+        # Strong validators differ per representation, so the encoded bodies get their own tag
+        return self.tag if encoding is None else f'{self.tag}-{encoding}'
+
+    def matches(self, if_none_match):
+        return if_none_match.star_tag or any(if_none_match.contains(self.etag(encoding)) for encoding in (None, 'gzip', 'br'))
+
+    def encoded(self, encoding, level):
+        with self._lock:
+            data = self._variants.get(encoding)
+            if data is None:
+                data = self._variants[encoding] = compress(self.body, encoding, level)
+            return data
+
+    def to_response(self, cache_control, min_size=1024, level=6):
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding')) if len(self.body) >= min_size else None
+        if self.matches(request.if_none_match):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(self.encoded(encoding, level) if encoding else self.body, mimetype=self.mimetype)
+            for name, value in self.headers:
+                response.headers[name] = value
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etag(encoding))
+        response.headers['Cache-Control'] = cache_control
+        if len(self.body) >= min_size:
+            _vary(response)
+        return response
+
+
+def cached(cache, key_func, cache_control='no-cache', min_size=1024, level=6):
+    """Decorator serving a view from ``cache`` under ``key_func()``; only 200 responses are stored.
+
+    ``cache_control`` defaults to ``no-cache``: browsers keep the body but
+    revalidate it with ``If-None-Match`` on every use.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.endpoint, request.query_string, key_func())
+            entry = cache.get(key)
+            if entry is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = CachedResponse(response)
+                cache.set(key, entry)
+            return entry.to_response(cache_control, min_size, level)
+        return wrapper
+    return decorator
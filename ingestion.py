@@ -0,0 +1,109 @@
+"""Concurrent fetching of TMDb list pages and per-movie details.
+
+The pipeline only does HTTP work in its worker threads. Everything that
+touches the database (deciding which movies are new, writing rows) stays
+in the calling thread, which owns the Flask app context and DB session.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """Token bucket shared by every worker thread of a pipeline run."""
+
+    def __init__(self, requests_per_second, burst=None):
+        self.rate = float(requests_per_second or 0)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return  # No ceiling configured
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class IngestionPipeline:
+    """Fetches pages in parallel and fans out detail lookups over a bounded pool.
+
+    ``fetch_page(page)`` returns the list of movie dicts on a page and
+    ``fetch_details(movie)`` returns whatever extra data the caller needs for
+    one movie. ``select_new(movies, stats)`` runs in the calling thread, picks
+    the movies that need details and may add its own counters to ``stats``.
+    ``run`` yields one ``(stats, details)`` pair per page, in page order,
+    where ``details`` is a list of ``(movie, result)``. At most
+    ``page_window`` pages are submitted ahead of the consumer, and closing
+    the generator cancels whatever has not started yet.
+    """
+
+    def __init__(self, fetch_page, fetch_details, max_workers=8, requests_per_second=None, lookahead=2, page_window=None):
+        self.fetch_page = fetch_page
+        self.fetch_details = fetch_details
+        self.max_workers = max(1, int(max_workers or 1))
+        self.limiter = RateLimiter(requests_per_second)
+        self.lookahead = max(1, lookahead)
+        self.page_window = max(1, page_window or self.max_workers)
+
+    def _limited(self, func, *args):
+        self.limiter.acquire()
+        return func(*args)
+
+    def run(self, pages, select_new):
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tmdb-ingest')
+        pages = iter(pages)
+        page_futures = deque()
+
+        def submit_next_page():
+            for page in pages:
+                page_futures.append((page, time.monotonic(), executor.submit(self._limited, self.fetch_page, page)))
+                return
+
+        try:
+            for _ in range(self.page_window):
+                submit_next_page()
+            pending = deque()
+            while page_futures:
+                page, started, future = page_futures.popleft()
+                submit_next_page()
+                stats = {'page': page, 'fetched': 0, 'new': 0, 'added': 0, 'detail_errors': 0, 'error': None}
+                detail_futures = []
+                try:
+                    movies = future.result() or []
+                    stats['fetched'] = len(movies)
+                    for movie in select_new(movies, stats):
+                        detail_futures.append((movie, executor.submit(self._limited, self.fetch_details, movie)))
+                    stats['new'] = len(detail_futures)
+                except Exception as e:
+                    stats['error'] = str(e)
+                pending.append((stats, started, detail_futures))
+                # Keep a few pages of detail lookups in flight before handing results back
+                if len(pending) > self.lookahead:
+                    yield self._collect(*pending.popleft())
+            while pending:
+                yield self._collect(*pending.popleft())
+        finally:
+            # An aborted run (error or closed generator) must not keep fetching the queued pages
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _collect(self, stats, started, detail_futures):
+        details = []
+        for movie, future in detail_futures:
+            try:
+                details.append((movie, future.result()))
+            except Exception as e:
+                stats['detail_errors'] += 1
+                print(f"ERROR: Failed to fetch details for movie {movie.get('id')}. Error: {e}")
+        stats['elapsed'] = round(time.monotonic() - started, 3)
+        return stats, details
@@ -0,0 +1,207 @@
+"""Background jobs backed by a database table.
+
+Jobs are rows of the ``job`` table, so every gunicorn worker sees the same
+queue and nothing is lost when a worker dies. Each worker process runs a few
+daemon threads that claim queued jobs with an atomic ``UPDATE`` and run the
+handler registered for the job's kind. While a handler runs, a timer thread
+refreshes the job's heartbeat; a job whose heartbeat goes stale (its worker
+was killed or restarted) is queued again and its handler resumes from the
+progress it saved, until it has been started ``max_attempts`` times.
+Finished jobs are deleted ``retention`` seconds after they end.
+"""
+import os
+import threading
+import time
+import traceback
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import SQLAlchemyError
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    def __init__(self, app, db, job_model, workers=1, poll_interval=1.0, stale_after=300, max_attempts=3,
+                 retention=7 * 24 * 3600, prune_interval=3600):
+        self.app = app
+        self.db = db
+        self.Job = job_model
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.heartbeat_interval = stale_after / 3
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._pruned_at = None
+        self.handlers = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def handler(self, kind):
+        """Registers ``func(job, report_progress)`` as the runner of ``kind`` jobs."""
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def enqueue(self, kind, params=None):
+        job = self.Job(kind=kind, status=QUEUED, params=params or {}, progress={}, created_at=time.time())
+        self.db.session.add(job)
+        self.db.session.commit()
+        self.start()
+        self._wakeup.set()
+        return job
+
+    def start(self):
+        """Starts this process's worker threads once (gunicorn forks after import)."""
+        if self.workers <= 0 or self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    ran = self.run_next()
+            except Exception as e:
+                print(f"ERROR: Job worker loop failed. Error: {e}")
+                ran = None
+            if ran is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def requeue_stale(self):
+        """Puts running jobs whose worker stopped heart-beating back in the queue, or fails them after ``max_attempts``."""
+        now = time.time()
+        stale = (self.Job.status == RUNNING, self.Job.heartbeat_at < now - self.stale_after)
+        # Idle workers poll this every second; an UPDATE takes SQLite's write lock even when it matches nothing
+        if self.db.session.query(self.Job.id).filter(*stale).first() is None:
+            self.db.session.rollback()
+            return 0
+        # A job that keeps killing its worker would otherwise be retried forever
+        failed = self.db.session.execute(
+            update(self.Job)
+            .where(*stale, self.Job.attempts >= self.max_attempts)
+            .values(status=FAILED, finished_at=now, error=f"Worker stopped responding {self.max_attempts} times; giving up")
+        )
+        result = self.db.session.execute(update(self.Job).where(*stale).values(status=QUEUED))
+        self.db.session.commit()
+        if failed.rowcount:
+            print(f"ERROR: Failed {failed.rowcount} stale job(s) after {self.max_attempts} attempts.")
+        if result.rowcount:
+            print(f"DEBUG: Re-queued {result.rowcount} stale job(s).")
+        return result.rowcount
+
+    def prune(self):
+        """Deletes done and failed jobs that ended more than ``retention`` seconds ago."""
+        self._pruned_at = time.monotonic()
+        result = self.db.session.execute(
+            delete(self.Job)
+            .where(self.Job.status.in_([DONE, FAILED]), self.Job.finished_at < time.time() - self.retention)
+        )
+        self.db.session.commit()
+        if result.rowcount:
+            print(f"DEBUG: Pruned {result.rowcount} finished job(s).")
+        return result.rowcount
+
+    def claim(self):
+        """Atomically moves the oldest queued job to running and returns it, or None."""
+        self.requeue_stale()
+        if self._pruned_at is None or time.monotonic() - self._pruned_at >= self.prune_interval:
+            self.prune()
+        while True:
+            job_id = (self.db.session.query(self.Job.id)
+                      .filter(self.Job.status == QUEUED)
+                      .order_by(self.Job.id)
+                      .limit(1)
+                      .scalar())
+            if job_id is None:
+                self.db.session.rollback()
+                return None
+            now = time.time()
+            # Only one worker's UPDATE can match status='queued'; the others see rowcount 0 and try the next job
+            result = self.db.session.execute(
+                update(self.Job)
+                .where(self.Job.id == job_id, self.Job.status == QUEUED)
+                .values(status=RUNNING, started_at=now, heartbeat_at=now, attempts=self.Job.attempts + 1)
+            )
+            self.db.session.commit()
+            if result.rowcount == 1:
+                return self.db.session.get(self.Job, job_id)
+
+    def run_next(self):
+        """Claims and runs one job in the current app context; returns its id, or None if the queue is empty."""
+        job = self.claim()
+        if job is None:
+            return None
+        handler = self.handlers.get(job.kind)
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(self.db.engine, job.id, stop),
+                         name=f'job-heartbeat-{job.id}', daemon=True).start()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job.kind}'")
+            handler(job, lambda **changes: self._report(job, changes))
+            job.status = DONE
+        except Exception as e:
+            self.db.session.rollback()
+            print(f"ERROR: Job {job.id} ({job.kind}) failed. Error: {e}")
+            traceback.print_exc()
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            stop.set()
+        job.finished_at = job.heartbeat_at = time.time()
+        self.db.session.commit()
+        return job.id
+
+    def _heartbeat(self, engine, job_id, stop):
+        # Handlers that rarely report progress must not look dead; this uses its own connection, not the handler's session
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(update(self.Job)
+                                       .where(self.Job.id == job_id, self.Job.status == RUNNING)
+                                       .values(heartbeat_at=time.time()))
+            except SQLAlchemyError as e:
+                print(f"ERROR: Failed to refresh the heartbeat of job {job_id}. Error: {e}")
+
+    def run_pending(self):
+        """Runs queued jobs in the calling thread until none are left (used when workers=0)."""
+        ran = []
+        while True:
+            job_id = self.run_next()
+            if job_id is None:
+                return ran
+            ran.append(job_id)
+
+    def _report(self, job, changes):
+        # Assign a new dict so the JSON column is flagged as modified
+        job.progress = dict(job.progress or {}, **changes)
+        job.heartbeat_at = time.time()
+        self.db.session.commit()
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'params': job.params or {},
+        'progress': job.progress or {},
+        'attempts': job.attempts,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
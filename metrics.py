@@ -0,0 +1,181 @@
+"""Counters and histograms rendered in the Prometheus text format.
+
+gunicorn runs several worker processes, so each one keeps its own numbers
+and writes them to ``<directory>/metrics-<pid>.json`` every
+``flush_interval`` seconds (and when it serves a scrape). ``render`` sums
+the files of every worker, past and present, so counters stay monotonic
+across worker restarts. The directory should be emptied when the server
+starts. Without a directory only this process is reported.
+"""
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory or None
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One writer of this process's file at a time
+        self._kinds = {} # name -> ('counter' | 'histogram', help, buckets)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._counters = {} # (name, labels) -> value
+        self._histograms = {} # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self._flushed_at = time.monotonic()
+
+    def _check_fork(self):
+        # A forked worker starts from the parent's numbers, which the parent reports itself
+        if self._pid != os.getpid():
+            self._reset()
+
+    def counter(self, name, help):
+        self._kinds[name] = ('counter', help, None)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        self._kinds[name] = ('histogram', help, tuple(buckets))
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_fork()
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._maybe_flush()
+
+    def observe(self, name, value, labels=None):
+        buckets = self._kinds[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_fork()
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+        self._maybe_flush()
+
+    def _snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(counts)] for (name, labels), counts in self._histograms.items()],
+            }
+
+    def _maybe_flush(self):
+        if self.directory and time.monotonic() - self._flushed_at >= self.flush_interval:
+            # Requests finishing together all see the interval expire; one write covers them
+            if self._flush_lock.acquire(blocking=False):
+                try:
+                    self._write()
+                finally:
+                    self._flush_lock.release()
+
+    def flush(self):
+        """Writes this process's numbers to its file in ``directory``."""
+        if not self.directory:
+            return
+        with self._flush_lock:
+            self._write()
+
+    def _write(self):
+        self._flushed_at = time.monotonic()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"ERROR: Failed to write metrics to {self.directory}. Error: {e}")
+
+    def collect(self):
+        """``(counters, histograms)`` summed over every worker's file (or just this process)."""
+        if self.directory:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue # Removed or being replaced
+        else:
+            snapshots = [self._snapshot()]
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, _label_key(labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts in snapshot['histograms']:
+                key = (name, _label_key(labels))
+                total = histograms.get(key)
+                histograms[key] = counts if total is None else [a + b for a, b in zip(total, counts)]
+        return counters, histograms
+
+    def render(self):
+        """The Prometheus text exposition of every metric."""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help, buckets) in sorted(self._kinds.items()):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            for (metric, labels), counts in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (math.inf,), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else _format_value(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(counts[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def clear_directory(self):
+        """Removes every worker's file; call once when the server starts."""
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json*')):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._reset()
+
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    items = labels.items() if isinstance(labels, dict) else labels
+    return tuple(sorted((str(key), str(value)) for key, value in items))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,126 @@
+"""Preference-weighted recommendations scored over the whole catalog at once.
+
+A user's likes and dislikes become a genre affinity vector. One matrix-vector
+product against the catalog's ``GenreMatrix`` scores every movie; movies the
+user already rated are excluded and the rest are sampled with softmax
+weights, so strong matches come up often without starving the long tail.
+"""
+import numpy as np
+
+
+def affinity_vector(ratings, genre_matrix, dislike_weight=1.0):
+    """``ratings`` yields ``(genre_ids, liked)``; returns one weight per genre column."""
+    affinity = np.zeros(len(genre_matrix.columns), dtype=np.float32)
+    count = 0
+    for genre_ids, liked in ratings:
+        cols = [genre_matrix.column_of[gid] for gid in genre_ids if gid in genre_matrix.column_of]
+        if not cols:
+            continue
+        affinity[cols] += (1.0 if liked else -dislike_weight) / len(cols)
+        count += 1
+    return affinity / count if count else affinity
+
+
+def score_catalog(genre_matrix, affinity):
+    return genre_matrix.matrix @ affinity
+
+
+def sampling_weights(genre_matrix, scores, exclude_ids=(), genre_ids=None, temperature=0.15):
+    """Softmax weights over ``scores`` with excluded and filtered-out movies set to 0."""
+    weights = np.exp((scores - scores.max(initial=0.0)) / temperature) if len(scores) else scores
+    if genre_ids:
+        cols = [genre_matrix.column_of[gid] for gid in genre_ids if gid in genre_matrix.column_of]
+        weights = weights * (genre_matrix.membership[:, cols].any(axis=1) if cols else 0)
+    rows = [genre_matrix.row_of[movie_id] for movie_id in exclude_ids if movie_id in genre_matrix.row_of]
+    if rows:
+        weights[rows] = 0
+    return weights
+
+
+def sample(genre_matrix, weights, rng=None):
+    """Draws one TMDb id in proportion to ``weights``; None if nothing is eligible."""
+    total = float(weights.sum()) if len(weights) else 0.0
+    if total <= 0:
+        return None
+    rng = rng or np.random.default_rng()
+    row = int(np.searchsorted(np.cumsum(weights), rng.random() * total, side='right'))
+    return int(genre_matrix.ids[min(row, len(weights) - 1)])
+
+
+def recommend(genre_matrix, ratings, exclude_ids=(), genre_ids=None, rng=None, extra_scores=None):
+    """``extra_scores`` (one per matrix row, e.g. collaborative filtering) is added to the genre scores."""
+    scores = score_catalog(genre_matrix, affinity_vector(ratings, genre_matrix))
+    if extra_scores is not None:
+        scores = scores + extra_scores
+    weights = sampling_weights(genre_matrix, scores, exclude_ids, genre_ids)
+    return sample(genre_matrix, weights, rng)
+
+
+def rank(genre_matrix, ratings, exclude_ids=(), k=50, temperature=0.15, rng=None, extra_scores=None):
+    """Samples up to ``k`` movies without replacement, in proportion to their softmax weights.
+
+    Uses the Gumbel-top-k trick: ranking by ``score + noise`` with Gumbel
+    noise scaled by ``temperature`` is equivalent to drawing one movie after
+    another from ``sampling_weights``. Returns ``(ids, scores, noise)`` best
+    first; keeping the noise lets a caller re-rank later with new scores.
+    """
+    scores = score_catalog(genre_matrix, affinity_vector(ratings, genre_matrix))
+    if extra_scores is not None:
+        scores = scores + extra_scores
+    rng = rng or np.random.default_rng()
+    noise = (rng.gumbel(size=len(scores)) * temperature).astype(np.float32)
+    priority = scores + noise
+    rows = [genre_matrix.row_of[movie_id] for movie_id in exclude_ids if movie_id in genre_matrix.row_of]
+    if rows:
+        priority[rows] = -np.inf
+    k = min(k, int(np.isfinite(priority).sum()))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+    top = np.argpartition(-priority, k - 1)[:k]
+    top = top[np.argsort(-priority[top])]
+    return genre_matrix.ids[top], scores[top], noise[top]
+
+
+def rescore(genre_matrix, ratings, movie_ids, extra_scores=None):
+    """Scores just ``movie_ids`` (0 for movies no longer in the matrix)."""
+    affinity = affinity_vector(ratings, genre_matrix)
+    rows = np.array([genre_matrix.row_of.get(movie_id, -1) for movie_id in movie_ids], dtype=np.int64)
+    scores = np.zeros(len(rows), dtype=np.float32)
+    known = rows >= 0
+    if known.any():
+        scores[known] = genre_matrix.matrix[rows[known]] @ affinity
+        if extra_scores is not None:
+            scores[known] += extra_scores[rows[known]]
+    return scores
+
+
+def rank_group(genre_matrix, member_ratings, liked_ids, disliked_ids, k=20, genre_ids=None, misery_weight=0.5, extra_scores=None):
+    """Ranks the catalog for a group in one pass over a movies x members score matrix.
+
+    ``member_ratings``, ``liked_ids`` and ``disliked_ids`` hold one entry per
+    member. A member's score for a movie is their genre affinity (plus the
+    matching column of ``extra_scores``), or 1 for a movie they liked. The
+    group score mixes the mean with the least happy member's score
+    (``misery_weight``), and a movie any member disliked is vetoed. Returns
+    ``(ids, group_scores, member_scores)`` best first.
+    """
+    affinity = np.stack([affinity_vector(ratings, genre_matrix) for ratings in member_ratings], axis=1)
+    scores = genre_matrix.matrix @ affinity
+    if extra_scores is not None:
+        scores += extra_scores
+    for col, ids in enumerate(liked_ids):
+        rows = [genre_matrix.row_of[movie_id] for movie_id in ids if movie_id in genre_matrix.row_of]
+        scores[rows, col] = 1.0
+    group_scores = (1 - misery_weight) * scores.mean(axis=1) + misery_weight * scores.min(axis=1)
+    vetoed = [genre_matrix.row_of[movie_id] for ids in disliked_ids for movie_id in ids if movie_id in genre_matrix.row_of]
+    group_scores[vetoed] = -np.inf
+    if genre_ids:
+        cols = [genre_matrix.column_of[gid] for gid in genre_ids if gid in genre_matrix.column_of]
+        matching = genre_matrix.membership[:, cols].any(axis=1) if cols else np.zeros(len(group_scores), dtype=bool)
+        group_scores[~matching] = -np.inf
+    k = min(k, int(np.isfinite(group_scores).sum()))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty((0, len(member_ratings)), dtype=np.float32)
+    top = np.argpartition(-group_scores, k - 1)[:k]
+    top = top[np.argsort(-group_scores[top], kind='stable')]
+    return genre_matrix.ids[top], group_scores[top], scores[top]
@@ -0,0 +1,84 @@
+"""Full-text search over the local movie catalog.
+
+On SQLite the ``movie`` table is mirrored into an external-content FTS5 table
+kept in sync by triggers, and queries are ranked with bm25 (title matches
+weigh most, then cast, then overview). Other databases fall back to a plain
+``LIKE`` scan ordered by score.
+"""
+import re
+
+from sqlalchemy import DDL, event, inspect, literal_column, or_, select, table, text
+
+FTS_TABLE = 'movie_fts'
+
+_CREATE_STATEMENTS = [
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, overview, "cast",
+        content='movie', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''',
+    f'''CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON movie BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, overview, "cast") VALUES (new.id, new.title, new.overview, new."cast");
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, overview, "cast") VALUES ('delete', old.id, old.title, old.overview, old."cast");
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, overview, "cast") VALUES ('delete', old.id, old.title, old.overview, old."cast");
+        INSERT INTO {FTS_TABLE}(rowid, title, overview, "cast") VALUES (new.id, new.title, new.overview, new."cast");
+    END''',
+]
+
+
+def register(movie_table):
+    """Creates and drops the FTS table alongside ``movie`` on SQLite."""
+    for statement in _CREATE_STATEMENTS:
+        event.listen(movie_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(movie_table, 'before_drop', DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'))
+
+
+def ensure(engine):
+    """Adds the index to a database created before it existed and back-fills it."""
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as conn:
+        existed = inspect(conn).has_table(FTS_TABLE)
+        for statement in _CREATE_STATEMENTS:
+            conn.execute(text(statement))
+        if not existed:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def _match_expression(query):
+    tokens = re.findall(r'\w+', query.lower())
+    # Every token must match, the last one (still being typed) as a prefix
+    return ' '.join(f'"{token}"' for token in tokens[:-1]) + (f' "{tokens[-1]}"*' if tokens else '')
+
+
+def search(session, movie_model, query, limit=20, movie_ids=None):
+    """Returns ``movie_model`` rows matching ``query``, best match first.
+
+    ``movie_ids`` optionally restricts the result to a subquery of movie ids
+    (e.g. the movies in some genres) inside the same SQL statement.
+    """
+    match = _match_expression(query).strip()
+    if not match:
+        return []
+    if session.get_bind().dialect.name == 'sqlite':
+        ranked = (select(literal_column('rowid'))
+                  .select_from(table(FTS_TABLE))
+                  .where(text(f'{FTS_TABLE} MATCH :match').bindparams(match=match))
+                  .order_by(text(f'bm25({FTS_TABLE}, 10.0, 1.0, 3.0)'))
+                  .limit(limit))
+        if movie_ids is not None:
+            ranked = ranked.where(literal_column('rowid').in_(movie_ids))
+        ids = [row[0] for row in session.execute(ranked)]
+        movies = {movie.id: movie for movie in movie_model.query.filter(movie_model.id.in_(ids))} if ids else {}
+        return [movies[movie_id] for movie_id in ids if movie_id in movies]
+    pattern = f'%{query}%'
+    movies_query = movie_model.query.filter(
+        or_(movie_model.title.ilike(pattern), movie_model.cast.ilike(pattern), movie_model.overview.ilike(pattern))
+    )
+    if movie_ids is not None:
+        movies_query = movies_query.filter(movie_model.id.in_(movie_ids))
+    return movies_query.order_by(movie_model.score.desc()).limit(limit).all()
@@ -0,0 +1,270 @@
+"""Content-based "more like this" index over overview, genres and cast.
+
+Each movie becomes a TF-IDF weighted bag of tokens (overview words, genre
+ids, cast names) projected into ``dim`` dimensions with signed feature
+hashing, then L2-normalised so a dot product is a cosine similarity. Top-k
+neighbours are computed in chunks of matrix products and written as ``.npy``
+files that every worker memory-maps read-only, so the index lives once in
+the page cache instead of once per process.
+
+An index directory holds numbered versions and a ``CURRENT`` file naming
+the live one. Builds and incremental updates write a new version and then
+swap ``CURRENT``, so readers never see half-written arrays. Writers take a
+lock file so concurrent builds cannot remove each other's versions, and the
+version ``CURRENT`` pointed at before a swap is kept for workers that have
+not re-read ``CURRENT`` yet.
+"""
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows: builds are not serialized
+    fcntl = None
+
+import numpy as np
+
+BUCKETS = 1 << 20 # Hash space for document frequencies
+FIELD_WEIGHTS = {'w': 1.0, 'g': 2.0, 'c': 1.5}
+STOPWORDS = frozenset('''
+    a an and are as at be but by for from has have he her his in into is it its of on or she that the their them
+    they this to was were who will with after before when while where which what about over under out up down
+    one two new own film movie story life world
+'''.split())
+
+
+def tokens(overview, genre_ids, cast):
+    """Field-prefixed tokens of one movie: ``w:`` words, ``g:`` genre ids, ``c:`` cast names."""
+    words = [word for word in re.findall(r'[a-z]+', (overview or '').lower()) if len(word) > 2 and word not in STOPWORDS]
+    result = ['w:' + word for word in words]
+    result += ['g:' + str(gid) for gid in genre_ids]
+    result += ['c:' + name.strip().lower() for name in (cast or '').split(',') if name.strip()]
+    return result
+
+
+def _hash(token):
+    return zlib.crc32(token.encode('utf-8'))
+
+
+class SimilarityIndex:
+    """Read side of an index version: memory-mapped arrays plus tmdb_id lookups."""
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        directory = os.path.join(path, version)
+        self.ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r') # Sorted TMDb ids
+        self.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        self.neighbours = np.load(os.path.join(directory, 'neighbours.npy'), mmap_mode='r') # TMDb ids, best first
+        self.scores = np.load(os.path.join(directory, 'scores.npy'), mmap_mode='r')
+        self.document_frequency = np.load(os.path.join(directory, 'df.npy'), mmap_mode='r')
+        self.dim = self.vectors.shape[1]
+        self.k = self.neighbours.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, tmdb_id):
+        row = int(np.searchsorted(self.ids, tmdb_id))
+        return row if row < len(self.ids) and self.ids[row] == tmdb_id else None
+
+    def similar(self, tmdb_id, limit=None):
+        """``[(tmdb_id, score), ...]`` best first, or None if the movie is not indexed."""
+        row = self.row_of(tmdb_id)
+        if row is None:
+            return None
+        limit = self.k if limit is None else min(limit, self.k)
+        return [(int(movie_id), float(score)) for movie_id, score in zip(self.neighbours[row, :limit], self.scores[row, :limit])
+                if movie_id >= 0]
+
+
+def _vectorize(documents, document_frequency, documents_count, dim):
+    vectors = np.zeros((len(documents), dim), dtype=np.float32)
+    for row, document in enumerate(documents):
+        for token, count in Counter(document).items():
+            h = _hash(token)
+            bucket = h % BUCKETS
+            idf = math.log((1 + documents_count) / (1 + document_frequency[bucket])) + 1
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vectors[row, bucket % dim] += sign * (1 + math.log(count)) * idf * FIELD_WEIGHTS[token[0]]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def _count_documents(documents, document_frequency):
+    for document in documents:
+        for bucket in {_hash(token) % BUCKETS for token in document}:
+            document_frequency[bucket] += 1
+
+
+def top_k(queries, base, k, exclude_rows=None, chunk_size=512):
+    """Indices into ``base`` and cosine scores of each query's ``k`` nearest rows, best first.
+
+    ``exclude_rows[i]`` is a row of ``base`` that query ``i`` must skip (itself).
+    Works ``chunk_size`` queries at a time so the score block stays small.
+    """
+    k = min(k, len(base) - (1 if exclude_rows is not None else 0))
+    indices = np.full((len(queries), max(k, 0)), -1, dtype=np.int64)
+    scores = np.zeros((len(queries), max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+    for start in range(0, len(queries), chunk_size):
+        block = np.asarray(queries[start:start + chunk_size]) @ np.asarray(base).T
+        if exclude_rows is not None:
+            block[np.arange(len(block)), exclude_rows[start:start + chunk_size]] = -np.inf
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(block, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        indices[start:start + len(block)] = np.take_along_axis(best, order, axis=1)
+        scores[start:start + len(block)] = np.take_along_axis(best_scores, order, axis=1)
+    return indices, scores
+
+
+def _pad(neighbours, scores, k):
+    # Small catalogs have fewer than k neighbours; -1 marks an empty slot
+    missing = k - neighbours.shape[1]
+    if missing > 0:
+        neighbours = np.pad(neighbours, ((0, 0), (0, missing)), constant_values=-1)
+        scores = np.pad(scores, ((0, 0), (0, missing)), constant_values=-np.inf)
+    return neighbours, scores
+
+
+@contextmanager
+def _write_lock(path):
+    # One writer per index directory, across processes (CLI builds, job workers of every gunicorn worker)
+    with open(os.path.join(path, '.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _write_version(path, ids, vectors, neighbours, scores, document_frequency):
+    os.makedirs(path, exist_ok=True)
+    with _write_lock(path):
+        version = f'v{time.time_ns()}'
+        directory = os.path.join(path, version)
+        os.makedirs(directory)
+        np.save(os.path.join(directory, 'ids.npy'), ids)
+        np.save(os.path.join(directory, 'vectors.npy'), vectors)
+        np.save(os.path.join(directory, 'neighbours.npy'), neighbours)
+        np.save(os.path.join(directory, 'scores.npy'), scores)
+        np.save(os.path.join(directory, 'df.npy'), document_frequency)
+        pointer = os.path.join(path, 'CURRENT')
+        previous = _read_current(path)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(version)
+        os.replace(pointer + '.tmp', pointer)
+        # Keep the previous version for workers that have not re-read CURRENT; older ones go
+        # (workers still mapping them keep reading, unlinked files live on until unmapped)
+        for name in os.listdir(path):
+            if name.startswith('v') and name not in (version, previous):
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    return version
+
+
+def _read_current(path):
+    try:
+        with open(os.path.join(path, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def build(path, movies, dim=256, k=20):
+    """Builds a new index version from ``movies``: ``(tmdb_id, overview, genre_ids, cast)`` tuples."""
+    movies = sorted({movie[0]: movie for movie in movies}.values())
+    ids = np.array([movie[0] for movie in movies], dtype=np.int64)
+    documents = [tokens(*movie[1:]) for movie in movies]
+    document_frequency = np.zeros(BUCKETS, dtype=np.int32)
+    _count_documents(documents, document_frequency)
+    vectors = _vectorize(documents, document_frequency, len(documents), dim)
+    rows, scores = top_k(vectors, vectors, k, exclude_rows=np.arange(len(ids)))
+    neighbours, scores = _pad(np.where(rows >= 0, ids[np.maximum(rows, 0)], -1) if len(ids) else rows, scores, k)
+    return _write_version(path, ids, vectors, neighbours, scores, document_frequency)
+
+
+def update(index, movies, chunk_size=4096):
+    """Adds ``movies`` to ``index`` as a new version without rebuilding existing vectors.
+
+    New movies get their own top-k; existing movies only swap in new
+    movies that beat their current neighbours. IDF weights of existing
+    vectors are left as built, so run a full ``build`` now and then.
+    """
+    movies = [movie for movie in {movie[0]: movie for movie in movies}.values() if index.row_of(movie[0]) is None]
+    if not movies:
+        return index.version
+    documents = [tokens(*movie[1:]) for movie in movies]
+    document_frequency = np.array(index.document_frequency)
+    _count_documents(documents, document_frequency)
+    new_ids = np.array([movie[0] for movie in movies], dtype=np.int64)
+    new_vectors = _vectorize(documents, document_frequency, len(index) + len(movies), index.dim)
+    k = index.k
+
+    # Existing rows: merge their neighbour lists with the new candidates
+    neighbours = np.array(index.neighbours)
+    scores = np.array(index.scores)
+    for start in range(0, len(index), chunk_size):
+        block = np.asarray(index.vectors[start:start + chunk_size]) @ new_vectors.T
+        candidates = np.concatenate([neighbours[start:start + chunk_size], np.broadcast_to(new_ids, block.shape)], axis=1)
+        candidate_scores = np.concatenate([np.where(neighbours[start:start + chunk_size] >= 0, scores[start:start + chunk_size], -np.inf), block], axis=1)
+        best = np.argsort(-candidate_scores, axis=1, kind='stable')[:, :k]
+        neighbours[start:start + chunk_size] = np.take_along_axis(candidates, best, axis=1)
+        scores[start:start + chunk_size] = np.take_along_axis(candidate_scores, best, axis=1)
+
+    all_ids = np.concatenate([np.asarray(index.ids), new_ids])
+    all_vectors = np.concatenate([np.asarray(index.vectors), new_vectors])
+    rows, new_scores = top_k(new_vectors, all_vectors, k, exclude_rows=np.arange(len(index), len(all_ids)))
+    new_neighbours, new_scores = _pad(np.where(rows >= 0, all_ids[np.maximum(rows, 0)], -1), new_scores, k)
+
+    order = np.argsort(all_ids, kind='stable')
+    return _write_version(
+        index.path,
+        all_ids[order],
+        all_vectors[order],
+        np.concatenate([neighbours, new_neighbours])[order],
+        np.concatenate([scores, new_scores])[order],
+        document_frequency,
+    )
+
+
+class IndexHandle:
+    """Per-process access to the live version, re-checking ``CURRENT`` every ``check_interval`` seconds."""
+
+    def __init__(self, path, check_interval=30):
+        self.path = path
+        self.check_interval = check_interval
+        self._index = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current_version(self):
+        return _read_current(self.path)
+
+    def get(self):
+        """The live ``SimilarityIndex``, or None if no index has been built or its files are unreadable."""
+        if self._index is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._index
+        with self._lock:
+            version = self.current_version()
+            if version is None:
+                self._index = None
+            elif self._index is None or self._index.version != version:
+                try:
+                    self._index = SimilarityIndex(self.path, version)
+                except (OSError, ValueError) as e:
+                    # Keep serving the version already mapped, if any, and look again on the next call
+                    print(f"ERROR: Failed to open similarity index {version}. Error: {e}")
+                    return self._index
+            self._checked_at = time.monotonic()
+            return self._index
+
+    def invalidate(self):
+        self._checked_at = 0.0
@@ -0,0 +1,77 @@
+"""Offline catalog snapshots in Parquet.
+
+A snapshot holds one row per movie (every ``Movie`` column but the internal
+id) plus the TMDb genre map in the file's schema metadata. Both directions
+work in fixed-size record batches, so memory stays bounded whatever the
+catalog size. pyarrow is only needed by these commands and is imported
+lazily.
+"""
+import json
+
+SNAPSHOT_FORMAT = 'match_movie.catalog/1'
+
+# Column name -> pyarrow type name
+COLUMNS = [
+    ('tmdb_id', 'int64'),
+    ('title', 'string'),
+    ('score', 'float64'),
+    ('poster_url', 'string'),
+    ('trailer_url', 'string'),
+    ('overview', 'string'),
+    ('release_date', 'string'),
+    ('genres', 'string'),
+    ('genre_ids', 'string'),
+    ('cast', 'string'),
+]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Catalog snapshots need pyarrow; install it with 'pip install pyarrow'.")
+    return pyarrow, pyarrow.parquet
+
+
+def _schema(pa, genres_map):
+    metadata = {
+        'format': SNAPSHOT_FORMAT,
+        'genres': json.dumps({str(gid): name for gid, name in genres_map.items()}),
+    }
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in COLUMNS], metadata=metadata)
+
+
+def write_snapshot(path, rows, genres_map, batch_size=5000):
+    """Writes ``rows`` (dicts keyed by ``COLUMNS``) to ``path``; returns the row count."""
+    pa, pq = _pyarrow()
+    schema = _schema(pa, genres_map)
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+def read_snapshot(path, batch_size=5000):
+    """Returns ``(genres_map, batches)`` where ``batches`` lazily yields lists of row dicts."""
+    pa, pq = _pyarrow()
+    parquet = pq.ParquetFile(path)
+    metadata = parquet.schema_arrow.metadata or {}
+    if metadata.get(b'format', b'').decode() != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not a catalog snapshot.")
+    genres_map = {int(gid): name for gid, name in json.loads(metadata[b'genres']).items()}
+
+    def batches():
+        for batch in parquet.iter_batches(batch_size=batch_size, columns=[name for name, _ in COLUMNS]):
+            yield batch.to_pylist()
+
+    return genres_map, batches()
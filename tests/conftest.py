@@ -1,17 +1,24 @@
 import pytest
 import os
+import tempfile
 import requests_mock
 
 # Set environment variables before importing app
 os.environ['FLASK_SECRET_KEY'] = 'test_secret_key'
 os.environ['TMDB_API_KEY'] = 'test_tmdb_api_key'
+os.environ['TMDB_CACHE_PATH'] = '' # Memory-only TMDb cache, cleared between tests
+os.environ['JOB_WORKERS'] = '0' # Tests run queued jobs themselves with job_queue.run_pending()
+# A throwaway SQLite file (not :memory:) so the WAL pragmas and the read-only pool are exercised too
+test_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(test_dir, 'test.db')
+os.environ['SIMILARITY_INDEX_PATH'] = os.path.join(test_dir, 'similarity')
+os.environ['METRICS_DIR'] = os.path.join(test_dir, 'metrics')
 
-from app import app, db, User, UserMoviePreference
+from app import app, db, tmdb, movie_catalog, response_cache, group_cache, User, UserMoviePreference
 
 @pytest.fixture(scope='module')
 def client(mock_tmdb):
     app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['SECRET_KEY'] = 'test_secret_key'
     app.template_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..' , 'templates') # Set template folder for tests
     os.environ['TMDB_API_KEY'] = 'test_tmdb_api_key'
@@ -19,10 +26,6 @@ def client(mock_tmdb):
     with app.test_client() as client:
         with app.app_context():
             app.config['GENRES_MAP'] = {28: 'Action', 35: 'Comedy'}
-            app.config['MOVIE_DB'] = [
-                {'id': 1, 'title': 'Movie A', 'score': 8.0, 'poster_url': '/pathA.jpg', 'overview': 'Overview A', 'release_date': '2023-01-01', 'genres': 'Action', 'genre_ids': [28], 'trailer_url': 'trailerA', 'cast': 'Actor A, Actor B'},
-                {'id': 2, 'title': 'Movie B', 'score': 7.5, 'poster_url': '/pathB.jpg', 'overview': 'Overview B', 'release_date': '2023-02-01', 'genres': 'Comedy', 'genre_ids': [35], 'trailer_url': 'trailerB', 'cast': 'Actor C, Actor D'},
-            ]
             yield client
 
 @pytest.fixture(scope='function')
@@ -45,6 +48,10 @@ def db_session():
     yield
     db.session.remove()
     db.drop_all()
+    movie_catalog.clear()
+    # A new database restarts its version stamps, so entries keyed on the old ones must go too
+    response_cache.clear()
+    group_cache.clear()
 
 @pytest.fixture(scope='module')
 def mock_tmdb():
@@ -60,13 +67,9 @@ def mock_tmdb():
             ]
         })
 
-        # Mock movie videos (trailer)
-        m.get('https://api.themoviedb.org/3/movie/1/videos', json={'results': [{'site': 'YouTube', 'type': 'Trailer', 'key': 'trailerA'}]})
-        m.get('https://api.themoviedb.org/3/movie/2/videos', json={'results': [{'site': 'YouTube', 'type': 'Trailer', 'key': 'trailerB'}]})
-
-        # Mock movie credits (cast)
-        m.get('https://api.themoviedb.org/3/movie/1/credits', json={'cast': [{'name': 'Actor A'}, {'name': 'Actor B'}]})
-        m.get('https://api.themoviedb.org/3/movie/2/credits', json={'cast': [{'name': 'Actor C'}, {'name': 'Actor D'}]})
+        # Mock movie details (videos and credits are appended to the same response)
+        m.get('https://api.themoviedb.org/3/movie/1', json={'id': 1, 'title': 'Movie A', 'videos': {'results': [{'site': 'YouTube', 'type': 'Trailer', 'key': 'trailerA'}]}, 'credits': {'cast': [{'name': 'Actor A'}, {'name': 'Actor B'}]}})
+        m.get('https://api.themoviedb.org/3/movie/2', json={'id': 2, 'title': 'Movie B', 'videos': {'results': [{'site': 'YouTube', 'type': 'Trailer', 'key': 'trailerB'}]}, 'credits': {'cast': [{'name': 'Actor C'}, {'name': 'Actor D'}]}})
 
         # Mock search movie
         m.get('https://api.themoviedb.org/3/search/movie', json={
@@ -74,7 +77,11 @@ def mock_tmdb():
                 {'id': 3, 'title': 'Search Movie C', 'vote_average': 7.0, 'poster_path': '/pathC.jpg', 'overview': 'Overview C', 'release_date': '2023-03-01', 'genre_ids': [28, 35]},
             ]
         })
-        m.get('https://api.themoviedb.org/3/movie/3/videos', json={'results': [{'site': 'YouTube', 'type': 'Trailer', 'key': 'trailerC'}]})
-        m.get('https://api.themoviedb.org/3/movie/3/credits', json={'cast': [{'name': 'Actor E'}]})
+        m.get('https://api.themoviedb.org/3/movie/3', json={'id': 3, 'title': 'Search Movie C', 'videos': {'results': [{'site': 'YouTube', 'type': 'Trailer', 'key': 'trailerC'}]}, 'credits': {'cast': [{'name': 'Actor E'}]}})
 
         yield m
+
+@pytest.fixture(autouse=True)
+def clear_tmdb_cache():
+    tmdb.cache.clear()
+    yield
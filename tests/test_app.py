@@ -1,6 +1,28 @@
 import pytest
 import json
-from app import User, UserMoviePreference, Friendship
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import requests_mock
+from sqlalchemy import event, select, inspect as sql_inspect, text as sql_text
+from sqlalchemy.engine import Engine
+import collaborative
+import db_setup
+from catalog import CatalogMovie, MovieCatalog
+from app import (
+    app, User, UserMoviePreference, Friendship, db, Movie, Genre, MovieGenre, CastMember, MovieCast, Job,
+    RecommendationQueue, ItemNeighbour, AppSetting, SyncState, GENRES_VERSION_KEY, job_queue, movie_catalog,
+    response_cache, group_cache, similarity_index, get_movie_catalog, get_genres_map, bump_genres_version,
+    bump_catalog_version, fetch_top_rated_movies, ingest_top_rated_movies, next_top_rated_page, insert_new_movies,
+    sync_movie_links, sync_changed_movies, backfill_normalized_tables, init_db, export_catalog_snapshot,
+    import_catalog_snapshot, pop_recommendation, build_similarity_index, update_similarity_index,
+    _enqueue_similarity_update, build_item_neighbours, _collaborative_scores, _neighbours_checked_at,
+    stamp_movie_updates, ensure_columns, _save_refreshed, _apply_changes, _enrich_catalog,
+)
 
 def test_index_route(client):
     response = client.get('/')
@@ -50,7 +72,7 @@ def test_status_logged_out(client):
     assert data['isLoggedIn'] == False
     assert data['username'] == None
 
-def test_random_movie_no_auth(client, mock_tmdb):
+def test_random_movie_no_auth(client, db_session, mock_tmdb):
     response = client.get('/random-movie')
     data = json.loads(response.data)
     assert response.status_code == 200
@@ -65,7 +87,7 @@ def test_random_movie_with_liked_genres(auth_client, mock_tmdb):
     assert response.status_code == 200
     assert data['title'] == "Movie A" # Should prioritize Action movie
 
-def test_random_movie_with_genre_filter(client, mock_tmdb):
+def test_random_movie_with_genre_filter(client, db_session, mock_tmdb):
     response = client.get('/random-movie?genres=28') # Filter by Action genre
     data = json.loads(response.data)
     assert response.status_code == 200
@@ -246,4 +268,866 @@ def test_shared_movies_non_friend(client, db_session):
 
     response = client.get(f'/friends/shared_movies/{user_b.id}', follow_redirects=True)
     assert b'You are not friends with this user.' in response.data
-    assert b"Your Friends" in response.data # Redirects to friends page
\ No newline at end of file
+    assert b"Your Friends" in response.data # Redirects to friends page
+
+def test_ingest_top_rated_movies_reports_per_page_stats(client, db_session):
+    with requests_mock.Mocker() as m:
+        for page in (1, 2):
+            m.get(f'https://api.themoviedb.org/3/movie/top_rated?page={page}', json={'results': [
+                {'id': 100 + page, 'title': f'Page {page} Movie', 'vote_average': 7.0, 'vote_count': 80, 'genre_ids': [28]},
+                {'id': 1, 'title': 'Movie A', 'vote_average': 8.0, 'vote_count': 100, 'genre_ids': [28]},
+            ]})
+            m.get(f'https://api.themoviedb.org/3/movie/{100 + page}', json={'videos': {'results': []}, 'credits': {'cast': [{'name': 'Someone'}]}})
+        report = ingest_top_rated_movies(start_page=1, end_page=2, max_workers=4)
+
+    assert report['new_movies_count'] == 2
+    assert [p['page'] for p in report['pages']] == [1, 2]
+    assert all(p['fetched'] == 2 and p['added'] == 1 for p in report['pages'])
+    assert Movie.query.filter_by(tmdb_id=102).first().cast == 'Someone'
+
+def test_search_movie_fetches_details_in_one_request(client, mock_tmdb):
+    mock_tmdb.reset_mock()
+    response = client.get('/search-movie?query=Search')
+    data = json.loads(response.data)
+    assert data[0]['trailer_url'] == 'https://www.youtube.com/embed/trailerC'
+    assert data[0]['cast'] == 'Actor E'
+    detail_calls = [r for r in mock_tmdb.request_history if r.path.startswith('/3/movie/')]
+    assert len(detail_calls) == 1
+    assert detail_calls[0].qs['append_to_response'] == ['videos,credits']
+
+def test_search_movie_answers_locally_with_prefix_match(client, db_session, mock_tmdb):
+    app_config = client.application.config
+    app_config['SEARCH_MIN_LOCAL_RESULTS'] = 1
+    mock_tmdb.reset_mock()
+    try:
+        response = client.get('/search-movie?query=actor%20c')
+    finally:
+        app_config['SEARCH_MIN_LOCAL_RESULTS'] = 5
+    data = json.loads(response.data)
+    assert [movie['title'] for movie in data] == ['Movie B']
+    assert data[0]['genre_ids'] == [35]
+    assert not any(r.path == '/3/search/movie' for r in mock_tmdb.request_history)
+
+def test_search_movie_falls_back_to_tmdb_and_enriches_catalog(client, db_session):
+    with requests_mock.Mocker() as m:
+        m.get('https://api.themoviedb.org/3/search/movie', json={'results': [
+            {'id': 42, 'title': 'Remote Hit', 'vote_average': 7.2, 'vote_count': 500, 'genre_ids': [35]},
+        ]})
+        m.get('https://api.themoviedb.org/3/movie/42', json={'videos': {'results': []}, 'credits': {'cast': [{'name': 'Actor R'}]}})
+        response = client.get('/search-movie?query=remote')
+        data = json.loads(response.data)
+        assert [movie['title'] for movie in data] == ['Remote Hit']
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            db.session.rollback()
+            if Movie.query.filter_by(tmdb_id=42).first():
+                break
+            time.sleep(0.05)
+    assert Movie.query.filter_by(tmdb_id=42).first().cast == 'Actor R'
+    local = json.loads(client.get('/search-movie?query=remo').data)
+    assert local[0]['title'] == 'Remote Hit'
+
+def test_enriching_the_catalog_skips_movies_inserted_concurrently(client, db_session, monkeypatch):
+    hits = [({'id': tmdb_id, 'title': f'Remote {tmdb_id}', 'vote_average': 7.2, 'vote_count': 500, 'genre_ids': [35]},
+             {'trailer_url': None, 'cast': 'Actor R'}) for tmdb_id in (42, 43)]
+
+    genres_map = get_genres_map()
+
+    def genres_after_another_request():
+        # Another request saved hit 42 after this one checked which hits were known
+        with app.app_context():
+            insert_new_movies([Movie(tmdb_id=42, title='Remote 42')])
+            db.session.commit()
+        return genres_map
+
+    monkeypatch.setattr('app.get_genres_map', genres_after_another_request)
+    _enrich_catalog(hits)
+    db.session.rollback()
+    assert Movie.query.filter(Movie.tmdb_id.in_([42, 43])).count() == 2
+    added = Movie.query.filter_by(tmdb_id=43).one()
+    assert [link.genre_id for link in MovieGenre.query.filter_by(movie_id=added.id)] == [35]
+
+def test_search_movie_fetches_remote_details_concurrently_within_the_timeout(client, db_session, monkeypatch):
+    monkeypatch.setitem(app.config, 'SEARCH_REMOTE_TIMEOUT', 1.0)
+    monkeypatch.setitem(app.config, 'SEARCH_ENRICH_CATALOG', False)
+
+    def slow_details(movie_id, use_cache=True):
+        time.sleep(0.3 if movie_id != 44 else 2.0)
+        return {'movie': None, 'trailer_url': None, 'cast': f'Actor {movie_id}'}
+    monkeypatch.setattr('app.fetch_movie_details', slow_details)
+
+    with requests_mock.Mocker() as m:
+        m.get('https://api.themoviedb.org/3/search/movie', json={'results': [
+            {'id': movie_id, 'title': f'Remote {movie_id}', 'genre_ids': [35]} for movie_id in (41, 42, 43, 44)
+        ]})
+        started = time.monotonic()
+        data = client.get('/search-movie?query=remote').get_json()
+        elapsed = time.monotonic() - started
+    assert elapsed < 1.0
+    # Three 0.3 s lookups in parallel make it; the 2 s one is left out rather than failing the search
+    assert [movie['title'] for movie in data] == ['Remote 41', 'Remote 42', 'Remote 43', 'Remote 44']
+    assert [movie['cast'] for movie in data] == ['Actor 41', 'Actor 42', 'Actor 43', '']
+
+def test_search_movie_answers_locally_when_too_many_remote_searches_are_pending(client, db_session, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire() # One search already waiting on TMDb
+    monkeypatch.setattr('app.search_slots', slots)
+    with requests_mock.Mocker() as m:
+        data = client.get('/search-movie?query=movie%20a').get_json()
+    assert 'Movie A' in [movie['title'] for movie in data]
+    assert not m.called
+
+def test_random_movie_catalog_picks_up_new_rows(client, db_session):
+    assert client.get('/random-movie?genres=99').get_json()['id'] is None
+    db.session.add(Movie(tmdb_id=77, title='Movie Z', score=6.5, genres='Documentary', genre_ids='99'))
+    db.session.commit()
+    movie_catalog.last_refresh = 0 # Skip the refresh interval
+    data = client.get('/random-movie?genres=99').get_json()
+    assert data['title'] == 'Movie Z'
+    assert data['genre_ids'] == [99]
+    assert len(movie_catalog) == 3
+
+def test_movie_catalog_reloads_rows_changed_by_another_worker(client, db_session):
+    assert get_movie_catalog().movies[1].score == 8.0
+    matrix = movie_catalog.genre_matrix()
+    movie_catalog.last_refresh = 0
+    get_movie_catalog() # Nothing changed: no new version, same matrix
+    assert movie_catalog.genre_matrix() is matrix
+
+    # Another worker refreshes a known movie; only its update sequence reaches this one
+    movie = Movie.query.filter_by(tmdb_id=1).one()
+    movie.score, movie.genre_ids = 9.1, '28, 35'
+    stamp_movie_updates([movie])
+    bump_catalog_version()
+    db.session.commit()
+    movie_catalog.last_refresh = 0
+    catalog = get_movie_catalog()
+    assert catalog.movies[1].score == 9.1
+    assert catalog.ids_with_genres(genre_ids=[35]) == {1, 2}
+
+def test_movie_catalog_refresh_reads_only_inserted_and_updated_rows(client, db_session, monkeypatch):
+    get_movie_catalog()
+    read = []
+    add = movie_catalog.add
+    monkeypatch.setattr(movie_catalog, 'add', lambda records, row_ids=(): (read.extend(row_ids), add(records, row_ids)))
+    # Another worker inserts one movie and refreshes another
+    inserted = insert_new_movies([Movie(tmdb_id=77, title='Movie Z', score=6.5, genres='Action', genre_ids='28')])
+    movie = Movie.query.filter_by(tmdb_id=2).one()
+    movie.score = 5.0
+    stamp_movie_updates([movie])
+    db.session.commit()
+    movie_catalog.last_refresh = 0
+    get_movie_catalog()
+    assert sorted(read) == sorted([movie.id, inserted[0].id])
+    assert movie_catalog.movies[2].score == 5.0
+
+    # This worker's own refresh moves its cursors, so the next refresh reads nothing
+    movie = Movie.query.filter_by(tmdb_id=1).one()
+    _save_refreshed([(movie, _apply_changes(movie, {'score': 7.0}))])
+    assert movie_catalog.movies[1].score == 7.0
+    read.clear()
+    movie_catalog.last_refresh = 0
+    get_movie_catalog()
+    assert read == []
+
+def test_ensure_columns_adds_columns_missing_from_existing_tables(client, db_session):
+    with db.engine.begin() as connection:
+        connection.execute(sql_text('DROP INDEX ix_movie_updated_seq'))
+        connection.execute(sql_text('ALTER TABLE movie DROP COLUMN updated_seq'))
+    ensure_columns()
+    assert 'updated_seq' in {column['name'] for column in sql_inspect(db.engine).get_columns('movie')}
+    assert Movie.query.filter(Movie.updated_seq.is_(None)).count() == 2
+
+def test_movie_catalog_pick_uses_genre_indexes():
+    catalog = MovieCatalog()
+    catalog.add([
+        CatalogMovie(1, 'A', 8.0, None, None, '', '', 'Action, Comedy', (28, 35), ''),
+        CatalogMovie(2, 'B', 7.0, None, None, '', '', 'Comedy', (35,), ''),
+        CatalogMovie(3, 'C', 6.0, None, None, '', '', 'Drama', (18,), ''),
+    ])
+    assert catalog.ids_with_genres(genre_ids=[35]) == {1, 2}
+    assert catalog.ids_with_genres(genre_ids=[35], liked_genre_ids={28}) == {1}
+    assert catalog.pick([18], {28}).title == 'C' # No liked match, falls back to the filter
+    assert catalog.pick([99]) is None
+
+def test_movie_catalog_keeps_its_genre_matrix_when_nothing_changed():
+    catalog = MovieCatalog()
+    record = CatalogMovie(1, 'A', 8.0, None, None, '', '', 'Action', (28,), '')
+    catalog.add([record], row_ids=[1])
+    matrix = catalog.genre_matrix()
+    catalog.add([], row_ids=[])
+    catalog.add([record])
+    assert catalog.genre_matrix() is matrix
+    catalog.add([record._replace(score=9.0)])
+    assert catalog.genre_matrix() is not matrix
+
+def test_random_movie_recommend_mode_skips_rated_movies(auth_client):
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': True})
+    for _ in range(5):
+        data = auth_client.get('/random-movie?mode=recommend').get_json()
+        assert data['title'] == 'Movie B'
+
+def test_api_movies_keyset_pagination(client, db_session):
+    db.session.add_all([Movie(tmdb_id=200 + i, title=f'Extra {i}', score=5.0 + i / 10, genre_ids='18, 280') for i in range(3)])
+    db.session.commit()
+
+    first = client.get('/api/movies?per_page=2')
+    assert [m['title'] for m in first.get_json()] == ['Movie A', 'Movie B']
+    cursor = first.headers['X-Next-Cursor']
+    assert f'cursor={cursor}' in first.headers['Link']
+
+    second = client.get(f'/api/movies?per_page=2&cursor={cursor}')
+    assert [m['title'] for m in second.get_json()] == ['Extra 0', 'Extra 1']
+    third = client.get(f"/api/movies?per_page=2&cursor={second.headers['X-Next-Cursor']}")
+    assert [m['title'] for m in third.get_json()] == ['Extra 2']
+    assert 'X-Next-Cursor' not in third.headers
+
+def test_api_movies_fields_filters_and_cap(client, db_session):
+    crime = Movie(tmdb_id=300, title='Crime Movie', score=9.1, genre_ids='280')
+    db.session.add(crime)
+    sync_movie_links([crime])
+    db.session.commit()
+
+    data = client.get('/api/movies?fields=id,title&genres=28,280').get_json()
+    assert data == [{'id': 1, 'title': 'Movie A'}, {'id': 300, 'title': 'Crime Movie'}]
+    data = client.get('/api/movies?fields=title&min_score=7.8').get_json()
+    assert data == [{'title': 'Movie A'}, {'title': 'Crime Movie'}]
+    assert client.get('/api/movies?fields=title,password_hash').status_code == 400
+
+    app.config['API_MOVIES_MAX_PER_PAGE'] = 2
+    try:
+        assert len(client.get('/api/movies?per_page=1000').get_json()) == 2
+    finally:
+        app.config['API_MOVIES_MAX_PER_PAGE'] = 100
+
+def test_normalized_genre_and_cast_tables(client, db_session):
+    movie_a = Movie.query.filter_by(tmdb_id=1).first()
+    assert {link.genre_id for link in MovieGenre.query.filter_by(movie_id=movie_a.id)} == {28}
+    cast = (db.session.query(CastMember.name).join(MovieCast)
+            .filter(MovieCast.movie_id == movie_a.id).order_by(MovieCast.position).all())
+    assert [name for (name,) in cast] == ['Actor A', 'Actor B']
+    assert db.session.get(Genre, 35).name == 'Comedy'
+
+    # Rows written before the tables existed only have the string columns
+    legacy = Movie(tmdb_id=500, title='Legacy', genre_ids='35, 18', cast='Actor A, Actor Z')
+    bare = Movie(tmdb_id=501, title='No Genres Or Cast')
+    db.session.add(legacy)
+    db.session.add(bare)
+    db.session.commit()
+    assert backfill_normalized_tables() == 2
+    assert {link.genre_id for link in MovieGenre.query.filter_by(movie_id=legacy.id)} == {18, 35}
+    # Already handled: a later start neither selects the movie without links again nor bumps the catalog
+    version = db.session.get(AppSetting, 'catalog_version').value
+    assert backfill_normalized_tables() == 0
+    assert db.session.get(AppSetting, 'catalog_version').value == version
+    assert CastMember.query.filter_by(name='Actor A').count() == 1
+
+    data = client.get('/api/movies?genres=18&fields=title').get_json()
+    assert data == [{'title': 'Legacy'}]
+    data = client.get('/search-movie?query=actor&genres=35').get_json()
+    assert {movie['title'] for movie in data[:2]} == {'Movie B', 'Legacy'}
+
+def test_get_friends_is_a_single_query(client, db_session):
+    users = [User(username=f'f{i}') for i in range(6)]
+    for user in users:
+        user.set_password('x')
+    db.session.add_all(users)
+    db.session.commit()
+    me = users[0]
+    db.session.add_all([Friendship(user_id=me.id, friend_id=users[1].id), Friendship(user_id=me.id, friend_id=users[2].id),
+                        Friendship(user_id=users[3].id, friend_id=me.id)])
+    db.session.commit()
+    db.session.expire_all()
+    me.id # Reload the expired user before counting
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(Engine, 'before_cursor_execute', listener) # Primary and read-only engines alike
+    try:
+        friends = me.get_friends()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', listener)
+    assert [friend.username for friend in friends] == ['f1', 'f2', 'f3']
+    assert len(statements) == 1
+
+def test_friends_page_searches_and_paginates_non_friends(auth_client):
+    for name in ('alice', 'alfred', 'bob'):
+        user = User(username=name)
+        user.set_password('x')
+        db.session.add(user)
+    db.session.commit()
+    app.config['FRIENDS_PER_PAGE'] = 1
+    try:
+        page1 = auth_client.get('/friends?q=AL').data
+        page2 = auth_client.get('/friends?q=al&page=2').data
+    finally:
+        app.config['FRIENDS_PER_PAGE'] = 50
+    assert b'>alfred</option>' in page1 and b'>alice</option>' not in page1
+    assert b'>alice</option>' in page2
+    assert b'Page 1 of 2' in page1
+    assert b'>bob</option>' not in page1 + page2
+
+def _add_likes(user, liked):
+    db.session.add_all([UserMoviePreference(user_id=user.id, movie_title=title, tmdb_id=tmdb_id, preference=pref)
+                        for tmdb_id, title, pref in liked])
+    db.session.commit()
+
+def test_shared_movies_matches_on_tmdb_id_with_cards(auth_client):
+    me = User.query.filter_by(username='testuser').first()
+    friend = User(username='cinephile')
+    friend.set_password('x')
+    db.session.add(friend)
+    db.session.commit()
+    db.session.add(Friendship(user_id=me.id, friend_id=friend.id))
+    _add_likes(me, [(1, 'Movie A', True), (2, 'Movie B', True), (50, 'Remake', True)])
+    # Same title, different movie; and a movie the friend disliked
+    _add_likes(friend, [(1, 'Movie A', True), (51, 'Remake', True), (2, 'Movie B', False)])
+
+    page = auth_client.get(f'/friends/shared_movies/{friend.id}').data
+    assert b'Movie A' in page and b'/pathA.jpg' in page
+    assert b'Remake' not in page and b'Movie B' not in page
+
+def test_group_overlap_ranks_movies_by_friends_liking_them(auth_client):
+    me = User.query.filter_by(username='testuser').first()
+    friends = [User(username=f'pal{i}') for i in range(3)]
+    stranger = User(username='stranger')
+    for user in friends + [stranger]:
+        user.set_password('x')
+    db.session.add_all(friends + [stranger])
+    db.session.commit()
+    db.session.add_all([Friendship(user_id=me.id, friend_id=friends[0].id), Friendship(user_id=friends[1].id, friend_id=me.id),
+                        Friendship(user_id=me.id, friend_id=friends[2].id)])
+    _add_likes(friends[0], [(1, 'Movie A', True), (2, 'Movie B', True)])
+    _add_likes(friends[1], [(2, 'Movie B', True), (77, 'Obscure', True)])
+    _add_likes(friends[2], [(2, 'Movie B', True), (1, 'Movie A', False)])
+    _add_likes(stranger, [(77, 'Obscure', True)])
+
+    data = auth_client.get('/api/friends/group_overlap').get_json()
+    assert [(m['title'], m['friends_liked']) for m in data] == [('Movie B', 3), ('Movie A', 1), ('Obscure', 1)]
+    assert data[0]['poster_url'].endswith('/pathB.jpg') and data[2]['poster_url'] is None
+
+def test_movie_preference_upserts_on_tmdb_id(auth_client):
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': True})
+    auth_client.post('/movie-preference', json={'title': 'Movie A (1999)', 'id': '1', 'genres': 'Action', 'preference': False})
+    prefs = UserMoviePreference.query.filter_by(tmdb_id=1).all()
+    assert len(prefs) == 1
+    assert prefs[0].preference is False and prefs[0].movie_title == 'Movie A (1999)'
+    assert auth_client.post('/movie-preference', json={'title': 'X', 'id': 'abc', 'genres': '', 'preference': True}).status_code == 400
+
+def test_movie_preferences_batch(auth_client):
+    swipes = [
+        {'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': True},
+        {'title': 'Movie B', 'id': 2, 'genres': 'Comedy', 'preference': True},
+        {'title': 'Movie B', 'id': 2, 'genres': 'Comedy', 'preference': False},
+    ]
+    response = auth_client.post('/movie-preferences', json={'preferences': swipes})
+    assert response.status_code == 200 and response.get_json()['saved'] == 2
+    prefs = {p.tmdb_id: p.preference for p in UserMoviePreference.query.all()}
+    assert prefs == {1: True, 2: False}
+
+    response = auth_client.post('/movie-preferences', json={'preferences': [swipes[0], {'title': 'No id'}]})
+    assert response.status_code == 400
+    assert 'index 1' in response.get_json()['error']
+
+def test_sqlite_engine_uses_wal_and_readonly_pool_for_get_requests(client, db_session):
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1 # NORMAL
+    read_engine = app.extensions['readonly_engine']
+    assert read_engine is not None
+    with read_engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA query_only').scalar() == 1
+
+    with app.test_request_context('/api/movies', method='GET'):
+        assert db.session.get_bind(clause=db.select(User)) is read_engine
+        db.session.execute(db.delete(Friendship).where(Friendship.id == -1))
+        assert db.session.get_bind(clause=db.select(User)) is db.engine # Reads its own writes
+        db.session.rollback()
+        assert db.session.get_bind(clause=db.select(User)) is read_engine
+    with app.test_request_context('/movie-preference', method='POST'):
+        assert db.session.get_bind(clause=db.select(User)) is db.engine
+
+def test_fetch_new_movies_runs_as_background_job(auth_client):
+    client = auth_client
+    # Admins only: the job and its status outlive the request
+    assert client.post('/api/fetch_new_movies', json={'num_pages': 2}).status_code == 403
+    User.query.filter_by(username='testuser').update({'is_admin': True})
+    db.session.commit()
+
+    response = client.post('/api/fetch_new_movies', json={'num_pages': 2})
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+    assert client.get(response.json['status_url']).json['status'] == 'queued'
+
+    assert job_queue.run_pending() == [job_id]
+    job = client.get(f'/api/jobs/{job_id}').json
+    assert job['status'] == 'done'
+    assert job['progress']['pages_done'] == 2
+    assert job['progress']['next_page'] == 3
+    assert job['progress']['movies_added'] == 0 # Movie A and B were already loaded
+    assert client.get('/api/jobs/9999').status_code == 404
+
+    # TMDb serves 500 pages at most
+    response = client.post('/api/fetch_new_movies', json={'num_pages': 10 ** 6, 'start_page': 499})
+    assert db.session.get(Job, response.json['job_id']).params == {'start_page': 499, 'end_page': 500}
+    assert client.post('/api/fetch_new_movies', json={'num_pages': 1, 'start_page': 501}).status_code == 400
+    assert client.post('/api/fetch_new_movies', json={'num_pages': 'many'}).status_code == 400
+
+    client.get('/logout')
+    assert client.get(f'/api/jobs/{job_id}').status_code != 200
+
+def test_stale_job_is_requeued_and_resumes_from_saved_page(client, db_session):
+    stale = Job(kind='load_top_rated', status='running', params={'start_page': 1, 'end_page': 3},
+                progress={'next_page': 3, 'pages_done': 2, 'movies_added': 5, 'errors': []},
+                attempts=1, heartbeat_at=time.time() - 10 * app.config['JOB_STALE_SECONDS'])
+    broken = Job(kind='no_such_kind', status='queued', params={}, attempts=0)
+    db.session.add_all([stale, broken])
+    db.session.commit()
+
+    with requests_mock.Mocker(real_http=False) as m:
+        m.get('https://api.themoviedb.org/3/movie/top_rated', json={'results': []})
+        assert job_queue.run_pending() == [stale.id, broken.id]
+        assert [request.qs['page'] for request in m.request_history] == [['3']]
+
+    db.session.expire_all()
+    assert stale.status == 'done'
+    assert stale.attempts == 2
+    assert stale.progress['pages_done'] == 3
+    assert stale.progress['movies_added'] == 5
+    assert broken.status == 'failed'
+    assert 'no_such_kind' in broken.error
+
+def test_stale_job_fails_after_max_attempts(client, db_session):
+    stale = Job(kind='load_top_rated', status='running', params={'start_page': 1, 'end_page': 1}, progress={},
+                attempts=job_queue.max_attempts, heartbeat_at=time.time() - 10 * app.config['JOB_STALE_SECONDS'])
+    db.session.add(stale)
+    db.session.commit()
+    assert job_queue.run_pending() == []
+    db.session.expire_all()
+    assert stale.status == 'failed'
+    assert 'giving up' in stale.error
+
+def test_idle_claim_only_reads(client, db_session, monkeypatch):
+    monkeypatch.setattr(job_queue, '_pruned_at', time.monotonic())
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.split()[0].upper())
+    event.listen(Engine, 'before_cursor_execute', listener)
+    try:
+        assert job_queue.claim() is None
+    finally:
+        event.remove(Engine, 'before_cursor_execute', listener)
+    assert statements and set(statements) == {'SELECT'}
+
+def test_running_job_heartbeats_without_reporting_progress(client, db_session, monkeypatch):
+    monkeypatch.setattr(job_queue, 'heartbeat_interval', 0.05)
+    beats = []
+
+    @job_queue.handler('quiet_test_job')
+    def quiet(job, report_progress):
+        started = job.heartbeat_at
+        time.sleep(0.3)
+        with db.engine.connect() as connection:
+            beats.append(connection.execute(select(Job.heartbeat_at).where(Job.id == job.id)).scalar() - started)
+
+    try:
+        job = job_queue.enqueue('quiet_test_job')
+        assert job_queue.run_pending() == [job.id]
+    finally:
+        del job_queue.handlers['quiet_test_job']
+    assert beats[0] > 0.1
+
+def test_reloading_top_rated_refreshes_known_movies_and_tracks_page(client, db_session):
+    assert next_top_rated_page() == 2 # db_session loaded page 1
+    with requests_mock.Mocker() as m:
+        m.get('https://api.themoviedb.org/3/movie/top_rated', json={'results': [
+            {'id': 1, 'title': 'Movie A', 'vote_average': 8.4, 'vote_count': 120, 'poster_path': '/pathA2.jpg', 'overview': 'Overview A', 'release_date': '2023-01-01', 'genre_ids': [28]},
+            {'id': 2, 'title': 'Movie B', 'vote_average': 7.5, 'vote_count': 60, 'poster_path': '/pathB.jpg', 'overview': 'Overview B', 'release_date': '2023-02-01', 'genre_ids': [35]},
+        ]})
+        report = ingest_top_rated_movies(3, 3)
+    assert (report['inserted'], report['updated'], report['unchanged']) == (0, 1, 1)
+    movie = Movie.query.filter_by(tmdb_id=1).one()
+    assert movie.score == 8.4
+    assert movie.poster_url.endswith('/pathA2.jpg')
+    assert movie.cast == 'Actor A, Actor B' # Detail fields are left alone by list refreshes
+    assert next_top_rated_page() == 4
+
+def test_sync_changed_movies_updates_only_modified_known_movies(client, db_session):
+    details = {'id': 1, 'title': 'Movie A (Director\'s Cut)', 'vote_average': 8.0, 'poster_path': '/pathA.jpg',
+               'overview': 'Overview A', 'release_date': '2023-01-01', 'genres': [{'id': 28, 'name': 'Action'}],
+               'videos': {'results': [{'site': 'YouTube', 'type': 'Trailer', 'key': 'trailerA'}]},
+               'credits': {'cast': [{'name': 'Actor A'}, {'name': 'Actor Z'}]}}
+    with requests_mock.Mocker() as m:
+        # 99 is not in the catalog and must not be fetched
+        m.get('https://api.themoviedb.org/3/movie/changes', json={'results': [{'id': 1, 'adult': False}, {'id': 99, 'adult': False}], 'page': 1, 'total_pages': 1})
+        m.get('https://api.themoviedb.org/3/movie/1', json=details)
+        report = sync_changed_movies()
+        assert (report['inserted'], report['updated'], report['unchanged']) == (0, 1, 0)
+        assert db.session.get(SyncState, 'changes').last_synced_at is not None
+
+        report = sync_changed_movies() # Nothing differs the second time
+        assert (report['updated'], report['unchanged']) == (0, 1)
+        assert not any('/movie/99' in request.path for request in m.request_history)
+
+    movie = Movie.query.filter_by(tmdb_id=1).one()
+    assert movie.title == "Movie A (Director's Cut)"
+    assert movie.cast == 'Actor A, Actor Z'
+    linked = (db.session.query(CastMember.name).join(MovieCast, MovieCast.cast_member_id == CastMember.id)
+              .filter(MovieCast.movie_id == movie.id).order_by(MovieCast.position).all())
+    assert [name for name, in linked] == ['Actor A', 'Actor Z']
+
+def test_ingestion_bulk_inserts_with_a_fixed_number_of_queries(client, db_session):
+    page = [{'id': 100 + i, 'title': f'Bulk {i}', 'vote_average': 7.0, 'vote_count': 100, 'genre_ids': [28]} for i in range(20)]
+    page.append({'id': 1, 'title': 'Movie A', 'vote_average': 8.0, 'vote_count': 100, 'poster_path': '/pathA.jpg',
+                 'overview': 'Overview A', 'release_date': '2023-01-01', 'genre_ids': [28]})
+    with requests_mock.Mocker() as m:
+        m.get('https://api.themoviedb.org/3/movie/top_rated', json={'results': page})
+        m.get(re.compile(r'https://api\.themoviedb\.org/3/movie/\d+\?'), json={'credits': {'cast': [{'name': 'Actor A'}]}})
+        report = ingest_top_rated_movies(2, 2)
+        # Movie A is known, so only the 20 new movies had their details fetched
+        assert len([r for r in m.request_history if r.path != '/3/movie/top_rated']) == 20
+    assert report['inserted'] == 20
+    assert Movie.query.count() == 22
+    # One lookup, one bulk insert, the link rows and the commit; not one query per movie
+    assert report['db']['queries'] <= 12
+    assert report['db']['queries_per_1000_movies'] > 0
+
+    # Rows that already exist are skipped by ON CONFLICT DO NOTHING
+    inserted = insert_new_movies([Movie(tmdb_id=1, title='Movie A'), Movie(tmdb_id=500, title='Fresh')])
+    assert [movie.tmdb_id for movie in inserted] == [500]
+    assert inserted[0].id is not None
+
+def test_catalog_snapshot_round_trip(client, db_session, tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'catalog.parquet')
+    assert export_catalog_snapshot(path, batch_size=1) == 2
+
+    for model in (MovieGenre, MovieCast, Movie, Genre):
+        model.query.delete()
+    db.session.commit()
+    assert import_catalog_snapshot(path, batch_size=1) == 2
+    assert import_catalog_snapshot(path) == 0 # Existing movies are skipped
+
+    movie = Movie.query.filter_by(tmdb_id=1).one()
+    assert movie.title == 'Movie A'
+    assert movie.cast == 'Actor A, Actor B'
+    assert [row.genre_id for row in MovieGenre.query.filter_by(movie_id=movie.id)] == [28]
+    assert {genre.id: genre.name for genre in Genre.query} == {28: 'Action', 35: 'Comedy'}
+
+def test_init_db_starts_without_an_unreadable_catalog_snapshot(client, db_session, tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'catalog.parquet'
+    path.write_bytes(b'not a parquet file')
+    monkeypatch.setenv('CATALOG_SNAPSHOT', str(path))
+    for model in (MovieGenre, MovieCast, Movie):
+        model.query.delete()
+    db.session.commit()
+
+    init_db() # Must not abort the container's boot
+    assert 'ERROR: Failed to import catalog snapshot' in capsys.readouterr().out
+    assert Movie.query.count() == 0
+
+def test_genres_map_is_read_from_database_and_follows_version_stamp(client, db_session, monkeypatch):
+    monkeypatch.delitem(app.config, 'GENRES_MAP') # Use the database instead of the test override
+    monkeypatch.setitem(app.config, 'GENRES_CHECK_SECONDS', 0)
+    with requests_mock.Mocker() as m: # No TMDb call is allowed
+        assert get_genres_map() == {28: 'Action', 35: 'Comedy'}
+
+        # Another worker refreshes the genres: this one picks it up through the stamp
+        db.session.add(Genre(id=18, name='Drama'))
+        bump_genres_version()
+        db.session.commit()
+        assert get_genres_map()[18] == 'Drama'
+        assert client.get('/genres').json == [{'id': 18, 'name': 'Drama'}, {'id': 28, 'name': 'Action'}, {'id': 35, 'name': 'Comedy'}]
+        assert not m.called
+    assert Job.query.filter_by(kind='refresh_genres').count() == 0
+
+    # Stale genres are refreshed by a background job rather than in the request
+    db.session.merge(AppSetting(key=GENRES_VERSION_KEY, value='0'))
+    db.session.commit()
+    get_genres_map()
+    get_genres_map()
+    assert Job.query.filter_by(kind='refresh_genres', status='queued').count() == 1
+
+def test_recommendation_queue_pops_without_repeats_and_reranks_on_preference(auth_client):
+    user_id = User.query.filter_by(username='testuser').one().id
+    # Empty queue: answered live while a refill job is queued
+    response = auth_client.get('/random-movie?mode=recommend')
+    assert response.json['title'] in ('Movie A', 'Movie B')
+    assert job_queue.run_pending()
+    assert {row.tmdb_id for row in RecommendationQueue.query.filter_by(user_id=user_id, served=False)} == {1, 2}
+
+    # Rating a queued movie removes it from the queue instead of rebuilding it
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': False})
+    assert [row.tmdb_id for row in RecommendationQueue.query.filter_by(user_id=user_id, served=False)] == [2]
+    assert auth_client.get('/random-movie?mode=recommend').json['title'] == 'Movie B'
+    assert RecommendationQueue.query.filter_by(user_id=user_id, served=False).count() == 0
+
+    # Movie A is rated and Movie B was served, so the refill recycles the served history
+    job_queue.run_pending()
+    assert [row.tmdb_id for row in RecommendationQueue.query.filter_by(user_id=user_id, served=False)] == [2]
+
+def test_pop_recommendation_only_looks_for_a_refill_job_when_the_queue_runs_low(client, db_session):
+    users = [User(username=f'queue{i}', password_hash='x') for i in range(2)]
+    db.session.add_all(users)
+    db.session.commit()
+    low_water = app.config['RECOMMENDATION_QUEUE_LOW_WATER']
+    db.session.add_all([RecommendationQueue(user_id=users[0].id, tmdb_id=100 + i, score=0, noise=0, priority=i)
+                        for i in range(low_water + 1)])
+    db.session.add(Job(kind='refill_recommendations', status='queued', params={'user_id': users[1].id}, progress={}))
+    db.session.commit()
+
+    user_id = users[0].id
+    with db_setup.track_queries() as stats:
+        assert pop_recommendation(user_id) == 100 + low_water
+    assert stats['queries'] == 2 # The pop and a probe of at most LOW_WATER index entries
+    assert Job.query.filter_by(kind='refill_recommendations').count() == 1
+
+    pop_recommendation(users[0].id) # Now below the low-water mark
+    pop_recommendation(users[0].id)
+    refills = Job.query.filter_by(kind='refill_recommendations', status='queued').all()
+    assert sorted(job.params['user_id'] for job in refills) == sorted(user.id for user in users)
+
+def test_finished_jobs_are_pruned_after_the_retention_period(client, db_session, monkeypatch):
+    old = time.time() - job_queue.retention - 60
+    db.session.add_all([
+        Job(kind='old_done', status='done', params={}, progress={}, finished_at=old),
+        Job(kind='old_failed', status='failed', params={}, progress={}, finished_at=old),
+        Job(kind='recent_done', status='done', params={}, progress={}, finished_at=time.time()),
+    ])
+    db.session.commit()
+    monkeypatch.setattr(job_queue, '_pruned_at', None)
+    job_queue.run_pending()
+    assert [job.kind for job in Job.query.order_by(Job.id)] == ['recent_done']
+
+def test_preference_writes_queue_a_debounced_neighbour_rebuild(auth_client, monkeypatch):
+    monkeypatch.setitem(_neighbours_checked_at, 'value', None)
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': True})
+    assert Job.query.filter_by(kind='build_item_neighbours', status='queued').count() == 1
+
+    monkeypatch.setitem(_neighbours_checked_at, 'value', None)
+    auth_client.post('/movie-preference', json={'title': 'Movie B', 'id': 2, 'genres': 'Comedy', 'preference': False})
+    assert Job.query.filter_by(kind='build_item_neighbours').count() == 1 # Already queued
+    job_queue.run_pending()
+
+    # Rebuilt moments ago: the next write waits for COLLABORATIVE_REBUILD_SECONDS
+    monkeypatch.setitem(_neighbours_checked_at, 'value', None)
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': False})
+    assert Job.query.filter_by(kind='build_item_neighbours').count() == 1
+
+def test_similar_movies_endpoint_and_incremental_update(client, db_session):
+    shutil.rmtree(app.config['SIMILARITY_INDEX_PATH'], ignore_errors=True)
+    similarity_index.invalidate()
+    assert client.get('/api/movies/1/similar').status_code == 503
+
+    build_similarity_index()
+    response = client.get('/api/movies/1/similar')
+    assert response.status_code == 200
+    assert [movie['title'] for movie in response.json] == ['Movie B']
+    assert 'similarity' in response.json[0]
+    assert client.get('/api/movies/999/similar').status_code == 404
+
+    db.session.add(Movie(tmdb_id=3, title='Movie C', overview='Overview C', genre_ids='28', cast='Actor A'))
+    db.session.commit()
+    assert update_similarity_index() == 1
+    assert client.get('/api/movies/1/similar?limit=1').json[0]['title'] == 'Movie C' # Shares genre and cast
+    shutil.rmtree(app.config['SIMILARITY_INDEX_PATH'], ignore_errors=True)
+    similarity_index.invalidate()
+
+def test_similarity_update_is_not_queued_twice_and_missing_versions_answer_503(client, db_session):
+    path = app.config['SIMILARITY_INDEX_PATH']
+    build_similarity_index()
+    db.session.add(Job(kind='update_similarity', status='running', params={}, progress={}, attempts=1))
+    db.session.commit()
+    _enqueue_similarity_update()
+    assert Job.query.filter_by(kind='update_similarity').count() == 1
+
+    # CURRENT names a version whose files are gone
+    shutil.rmtree(path)
+    similarity_index.invalidate()
+    assert similarity_index.get() is None
+    os.makedirs(path)
+    with open(os.path.join(path, 'CURRENT'), 'w') as f:
+        f.write('v1')
+    response = client.get('/api/movies/1/similar')
+    assert response.status_code == 503
+    shutil.rmtree(path, ignore_errors=True)
+    similarity_index.invalidate()
+
+def test_item_neighbours_are_built_from_preferences_and_blended_into_recommendations(client, db_session):
+    db.session.add(Movie(tmdb_id=3, title='Movie C', score=7.0, genres='Comedy', genre_ids='35'))
+    users = [User(username=f'cf{i}', password_hash='x') for i in range(4)]
+    db.session.add_all(users)
+    db.session.commit()
+    # Everyone who liked Movie A also liked Movie C and disliked Movie B
+    for user in users:
+        for tmdb_id, liked in ((1, True), (3, True), (2, False)):
+            db.session.add(UserMoviePreference(user_id=user.id, movie_title=str(tmdb_id), tmdb_id=tmdb_id, preference=liked))
+    fan = User(username='cf_fan', password_hash='x')
+    db.session.add(fan)
+    db.session.commit()
+    db.session.add(UserMoviePreference(user_id=fan.id, movie_title='Movie A', tmdb_id=1, genres='Action', preference=True))
+    db.session.commit()
+
+    count = build_item_neighbours(batch_size=1) # One insert batch per row
+    assert count > 1
+    assert ItemNeighbour.query.count() == count
+    assert [row.neighbour_id for row in ItemNeighbour.query.filter_by(tmdb_id=1)] == [3]
+    movie_catalog.last_refresh = 0
+    matrix = get_movie_catalog().genre_matrix()
+    scores = dict(zip(matrix.ids.tolist(), _collaborative_scores(fan.id, matrix).tolist()))
+    # Movies B and C share a genre, so only the collaborative signal tells them apart
+    assert scores[3] > 0 and scores[2] == 0
+    assert _collaborative_scores(users[0].id, matrix) is not None
+    app.config['COLLABORATIVE_WEIGHT'] = 0
+    try:
+        assert _collaborative_scores(fan.id, matrix) is None
+    finally:
+        app.config['COLLABORATIVE_WEIGHT'] = 0.5
+
+
+def test_building_item_neighbours_does_not_lock_the_database_while_computing(client, db_session, monkeypatch):
+    db.session.add(ItemNeighbour(tmdb_id=1, neighbour_id=2, score=0.5, common=3))
+    users = [User(username=f'lock{i}', password_hash='x') for i in range(3)]
+    db.session.add_all(users)
+    db.session.commit()
+    for user in users:
+        _add_likes(user, [(1, 'Movie A', True), (2, 'Movie B', True)])
+    compute = collaborative.neighbours
+    writes = []
+
+    def neighbours_with_concurrent_write(*args, **kwargs):
+        # Another worker saving a preference mid-rebuild must not hit "database is locked"
+        conn = sqlite3.connect(db.engine.url.database, timeout=0)
+        conn.execute("INSERT INTO app_setting (key, value) VALUES ('concurrent', 'write')")
+        conn.commit()
+        writes.append(conn.execute('SELECT COUNT(*) FROM item_neighbour').fetchone()[0])
+        conn.close()
+        yield from compute(*args, **kwargs)
+
+    monkeypatch.setattr(collaborative, 'neighbours', neighbours_with_concurrent_write)
+    assert build_item_neighbours() == 2
+    assert writes == [1] # The old neighbours are still served while the new ones are computed
+    assert {(row.tmdb_id, row.neighbour_id) for row in ItemNeighbour.query} == {(1, 2), (2, 1)}
+
+def test_movie_night_vetoes_dislikes_and_caches_per_group(auth_client):
+    me = User.query.filter_by(username='testuser').first()
+    friends = [User(username=f'night{i}') for i in range(2)]
+    stranger = User(username='night_stranger')
+    for user in friends + [stranger]:
+        user.set_password('x')
+    db.session.add_all(friends + [stranger, Movie(tmdb_id=3, title='Movie C', score=7.0, genres='Comedy', genre_ids='35')])
+    db.session.commit()
+    db.session.add_all([Friendship(user_id=me.id, friend_id=friends[0].id), Friendship(user_id=friends[1].id, friend_id=me.id)])
+    _add_likes(friends[0], [(1, 'Movie A', True)])
+    _add_likes(friends[1], [(2, 'Movie B', False)])
+    movie_catalog.last_refresh = 0
+    group = f'{friends[0].id},{friends[1].id}'
+
+    data = auth_client.get(f'/api/friends/movie_night?friends={group}').get_json()
+    assert data['members'] == sorted([me.id, friends[0].id, friends[1].id])
+    assert [(m['title'], m['liked_by']) for m in data['movies']] == [('Movie A', 1), ('Movie C', 0)]
+    assert auth_client.get(f'/api/friends/movie_night?friends={group}&genres=35').get_json()['movies'][0]['title'] == 'Movie C'
+
+    hits = group_cache.hits
+    auth_client.get(f'/api/friends/movie_night?friends={group}')
+    assert group_cache.hits == hits + 1
+    # A member's new dislike changes the group's cache key
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': False})
+    data = auth_client.get(f'/api/friends/movie_night?friends={group}').get_json()
+    assert [m['title'] for m in data['movies']] == ['Movie C']
+
+    assert auth_client.get(f'/api/friends/movie_night?friends={stranger.id}').status_code == 400
+    assert auth_client.get('/api/friends/movie_night').status_code == 400
+
+def test_read_endpoints_are_cached_with_etags_until_the_catalog_changes(client, db_session):
+    first = client.get('/api/movies?per_page=2')
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'public, no-cache'
+    assert client.get('/api/movies?per_page=2', headers={'If-None-Match': etag}).status_code == 304
+    hits = response_cache.hits
+    assert client.get('/api/movies?per_page=2').get_json() == first.get_json()
+    assert response_cache.hits == hits + 1
+    assert client.get('/api/movies?per_page=2').headers['X-Next-Cursor'] == first.headers['X-Next-Cursor']
+
+    # Ingestion bumps the catalog version, so the next request rebuilds the page
+    with requests_mock.Mocker(real_http=True) as m:
+        m.get('https://api.themoviedb.org/3/movie/top_rated', json={'results': [
+            {'id': 9, 'title': 'Movie Z', 'vote_average': 9.0, 'vote_count': 500, 'poster_path': '/z.jpg', 'genre_ids': [28]}]})
+        m.get('https://api.themoviedb.org/3/movie/9', json={'id': 9, 'videos': {'results': []}, 'credits': {'cast': []}})
+        fetch_top_rated_movies()
+    response = client.get('/api/movies', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Movie Z' in [movie['title'] for movie in response.get_json()]
+
+def test_large_json_responses_are_compressed(client, db_session):
+    db.session.add_all([Movie(tmdb_id=1000 + i, title=f'Long Movie {i}', overview='x' * 200) for i in range(20)])
+    db.session.commit()
+    response = client.get('/api/movies?per_page=20', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].endswith('-gzip"')
+    assert len(json.loads(gzip.decompress(response.data))) == 20
+    # The plain body's tag also validates the compressed one, since it is the same content
+    plain = client.get('/api/movies?per_page=20')
+    assert 'Content-Encoding' not in plain.headers
+    assert client.get('/api/movies?per_page=20', headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']}).status_code == 304
+    assert client.get('/genres', headers={'Accept-Encoding': 'gzip'}).headers.get('Content-Encoding') is None # Too small to bother
+
+def test_liked_movies_cache_follows_preference_writes(auth_client):
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': True})
+    first = auth_client.get('/liked-movies')
+    assert first.get_json() == ['Movie A']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    assert auth_client.get('/liked-movies', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    auth_client.post('/movie-preference', json={'title': 'Movie B', 'id': 2, 'genres': 'Comedy', 'preference': True})
+    assert sorted(auth_client.get('/liked-movies', headers={'If-None-Match': first.headers['ETag']}).get_json()) == ['Movie A', 'Movie B']
+
+def test_ndjson_exports_stream_movies_and_preferences(auth_client):
+    auth_client.post('/movie-preference', json={'title': 'Movie A', 'id': 1, 'genres': 'Action', 'preference': True})
+    app.config['EXPORT_BATCH_SIZE'] = 1 # One chunk per row
+    try:
+        response = auth_client.get('/api/export/movies?fields=id,title,genre_ids')
+        assert response.is_streamed
+        assert response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line) for line in response.data.decode().splitlines()] == [
+            {'id': 1, 'title': 'Movie A', 'genre_ids': [28]}, {'id': 2, 'title': 'Movie B', 'genre_ids': [35]}]
+    finally:
+        app.config['EXPORT_BATCH_SIZE'] = 1000
+    assert auth_client.get('/api/export/movies?fields=nope').status_code == 400
+    lines = auth_client.get('/api/export/preferences').data.decode().splitlines()
+    assert [json.loads(line) for line in lines] == [{'id': 1, 'title': 'Movie A', 'genres': 'Action', 'preference': True}]
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['export-ndjson', 'preferences'])
+    assert result.exit_code == 0
+    assert json.loads(result.output.splitlines()[0])['user_id'] == User.query.filter_by(username='testuser').one().id
+    result = runner.invoke(args=['export-ndjson', 'movies', '--batch-size', '1'])
+    assert [json.loads(line)['title'] for line in result.output.splitlines()] == ['Movie A', 'Movie B']
+    assert runner.invoke(args=['export-ndjson', 'preferences', '--user', 'nobody']).exit_code != 0
+
+def test_metrics_endpoint_reports_requests_queries_and_tmdb_calls(client, db_session, caplog):
+    client.get('/api/movies')
+    app.config['SLOW_REQUEST_SECONDS'] = 0 # Every request counts as slow
+    try:
+        with caplog.at_level('WARNING', logger=app.logger.name):
+            client.get('/genres?slow=1')
+    finally:
+        app.config['SLOW_REQUEST_SECONDS'] = 1.0
+    slow = [record for record in caplog.records if getattr(record, 'event', None) == 'slow_request']
+    assert slow[-1].endpoint == 'get_genres' and slow[-1].query == 'slow=1'
+    assert 'GET /genres?slow=1' in slow[-1].getMessage()
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    text = response.data.decode()
+    assert 'http_requests_total{endpoint="api_movies",method="GET",status="200"}' in text
+    assert 'http_request_db_queries_count{endpoint="api_movies"}' in text
+    assert 'tmdb_requests_total{endpoint="genre/movie/list",status="200"}' in text
+    assert 'tmdb_request_duration_seconds_bucket{endpoint="movie/top_rated",le="+Inf"}' in text
+
+    app.config['METRICS_TOKEN'] = 'secret'
+    try:
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+    finally:
+        app.config['METRICS_TOKEN'] = None
@@ -0,0 +1,43 @@
+import numpy as np
+import collaborative
+from catalog import CatalogMovie, MovieCatalog
+
+def _dense_neighbours(ratings, k, min_common, shrinkage):
+    users = sorted({u for u, _, _ in ratings})
+    movies = sorted({m for _, m, _ in ratings})
+    dense = np.zeros((len(users), len(movies)))
+    for u, m, liked in ratings:
+        dense[users.index(u), movies.index(m)] = 1 if liked else -1
+    rated = dense != 0
+    common = rated.T.astype(int) @ rated
+    norms = np.linalg.norm(dense, axis=0)
+    scores = (dense.T @ dense) / np.outer(norms, norms) * common / (common + shrinkage)
+    np.fill_diagonal(scores, -np.inf)
+    scores[(common < min_common) | (scores <= 0)] = -np.inf
+    return {movie: {movies[col]: float(scores[row, col]) for col in range(len(movies)) if np.isfinite(scores[row, col])}
+            for row, movie in enumerate(movies)}
+
+def test_chunked_neighbours_match_dense_computation():
+    rng = np.random.default_rng(0)
+    ratings = [(int(u), int(m), bool(rng.random() < 0.7)) for u in range(60) for m in rng.choice(40, size=12, replace=False) + 100]
+    matrix = collaborative.RatingMatrix.from_rows(ratings, chunk_size=100)
+    expected = _dense_neighbours(ratings, k=5, min_common=2, shrinkage=10.0)
+    blocks = list(collaborative.neighbours(matrix, k=5, max_pairs=500, max_cells=200)) # Forces many small blocks
+    assert len(blocks) > 5
+    seen = set()
+    for tmdb_ids, neighbour_ids, scores, _ in blocks:
+        for movie, ids, row_scores in zip(tmdb_ids.tolist(), neighbour_ids, scores):
+            seen.add(movie)
+            found = [(int(n), float(s)) for n, s in zip(ids, row_scores) if n >= 0]
+            # Same top-k scores as the dense matrix (ties may pick different movies)
+            assert np.allclose([s for _, s in found], sorted(expected[movie].values(), reverse=True)[:5], atol=1e-5)
+            assert all(np.isclose(expected[movie][n], s, atol=1e-5) for n, s in found)
+    assert seen == expected.keys()
+
+def test_predict_blends_neighbours_of_liked_and_disliked_movies():
+    catalog = MovieCatalog()
+    catalog.add([CatalogMovie(mid, f'M{mid}', 7.0, None, None, '', '', '', (28,), '') for mid in (1, 2, 3)])
+    matrix = catalog.genre_matrix()
+    scores = dict(zip(matrix.ids.tolist(), collaborative.predict(matrix, [(1, 0.8, True), (2, 0.6, False), (99, 0.9, True)]).tolist()))
+    assert scores[1] > 0 > scores[2]
+    assert scores[3] == 0
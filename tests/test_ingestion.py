@@ -0,0 +1,65 @@
+import time
+import threading
+from ingestion import IngestionPipeline, RateLimiter
+
+def test_rate_limiter_enforces_ceiling():
+    limiter = RateLimiter(requests_per_second=50, burst=1)
+    start = time.monotonic()
+    for _ in range(11):
+        limiter.acquire()
+    # 1 token up front, then 10 more at 50/s
+    assert time.monotonic() - start >= 0.18
+
+def test_pipeline_yields_pages_in_order_with_stats():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def fetch_page(page):
+        return [{'id': page * 10 + i} for i in range(3)]
+
+    def fetch_details(movie):
+        with lock:
+            active.append(movie['id'])
+            peak.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.remove(movie['id'])
+        return movie['id'] * 2
+
+    pipeline = IngestionPipeline(fetch_page, fetch_details, max_workers=4)
+    results = list(pipeline.run(range(1, 5), lambda movies, stats: movies[:2]))
+
+    assert [stats['page'] for stats, _ in results] == [1, 2, 3, 4]
+    assert all(stats['fetched'] == 3 and stats['new'] == 2 for stats, _ in results)
+    assert results[0][1] == [({'id': 10}, 20), ({'id': 11}, 22)]
+    assert 1 < max(peak) <= 4
+
+def test_pipeline_records_page_and_detail_errors():
+    def fetch_page(page):
+        if page == 2:
+            raise ValueError('bad page')
+        return [{'id': page}]
+
+    def fetch_details(movie):
+        raise RuntimeError('boom')
+
+    pipeline = IngestionPipeline(fetch_page, fetch_details, max_workers=2)
+    results = list(pipeline.run([1, 2], lambda movies, stats: movies))
+
+    assert results[0][0]['detail_errors'] == 1 and results[0][1] == []
+    assert results[1][0]['error'] == 'bad page'
+
+def test_closing_the_pipeline_stops_fetching_queued_pages():
+    fetched = []
+
+    def fetch_page(page):
+        time.sleep(0.01)
+        fetched.append(page)
+        return []
+
+    pipeline = IngestionPipeline(fetch_page, lambda movie: None, max_workers=4, lookahead=1)
+    pages = pipeline.run(range(1, 101), lambda movies, stats: movies)
+    next(pages)
+    pages.close() # The consumer gives up after the first page
+    assert len(fetched) <= 4 + 2
@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+from metrics import Metrics
+
+def _metrics(directory):
+    metrics = Metrics(directory, flush_interval=3600)
+    metrics.counter('requests_total', 'Requests.')
+    metrics.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    return metrics
+
+def test_render_uses_prometheus_text_format():
+    metrics = _metrics(None)
+    metrics.inc('requests_total', {'endpoint': 'index', 'status': 200})
+    metrics.inc('requests_total', {'endpoint': 'index', 'status': 200})
+    metrics.observe('latency_seconds', 0.05, {'endpoint': 'index'})
+    metrics.observe('latency_seconds', 3.0, {'endpoint': 'index'})
+    text = metrics.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{endpoint="index",status="200"} 2' in text
+    assert 'latency_seconds_bucket{endpoint="index",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{endpoint="index",le="1.0"} 1' in text
+    assert 'latency_seconds_bucket{endpoint="index",le="+Inf"} 2' in text
+    assert 'latency_seconds_sum{endpoint="index"} 3.05' in text
+    assert 'latency_seconds_count{endpoint="index"} 2' in text
+
+def test_render_sums_every_worker_file(tmp_path):
+    metrics = _metrics(str(tmp_path))
+    metrics.inc('requests_total', {'endpoint': 'index'}, 3)
+    metrics.observe('latency_seconds', 0.5)
+    # Another worker (or one that has since exited) left its numbers behind
+    with open(os.path.join(str(tmp_path), 'metrics-999999.json'), 'w') as f:
+        json.dump({'counters': [['requests_total', [['endpoint', 'index']], 4]],
+                   'histograms': [['latency_seconds', [], [1, 0, 0, 0.05]]]}, f)
+    text = metrics.render()
+    assert 'requests_total{endpoint="index"} 7' in text
+    assert 'latency_seconds_count 2' in text
+    assert os.path.exists(os.path.join(str(tmp_path), f'metrics-{os.getpid()}.json'))
+    metrics.clear_directory()
+    assert os.listdir(str(tmp_path)) == []
+
+def test_concurrent_flushes_do_not_share_a_temporary_file(tmp_path, capsys):
+    metrics = _metrics(str(tmp_path))
+    metrics.inc('requests_total', {'endpoint': 'index'})
+
+    def flush_repeatedly():
+        for _ in range(50):
+            metrics.flush()
+
+    threads = [threading.Thread(target=flush_repeatedly) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 'ERROR' not in capsys.readouterr().out
+    assert os.listdir(str(tmp_path)) == [f'metrics-{os.getpid()}.json']
@@ -0,0 +1,73 @@
+import time
+import numpy as np
+from catalog import CatalogMovie, MovieCatalog
+import recommender
+
+def _catalog(genres_by_id):
+    catalog = MovieCatalog()
+    catalog.add([CatalogMovie(mid, f'M{mid}', 7.0, None, None, '', '', '', tuple(gids), '') for mid, gids in genres_by_id.items()])
+    return catalog
+
+def test_affinity_rewards_likes_and_penalises_dislikes():
+    matrix = _catalog({1: [28], 2: [35], 3: [28, 35]}).genre_matrix()
+    affinity = recommender.affinity_vector([((28,), True), ((35,), False)], matrix)
+    scores = dict(zip(matrix.ids.tolist(), recommender.score_catalog(matrix, affinity).tolist()))
+    assert scores[1] > scores[3] > scores[2]
+
+def test_recommend_excludes_rated_and_respects_genre_filter():
+    matrix = _catalog({1: [28], 2: [28], 3: [35], 4: [18]}).genre_matrix()
+    rng = np.random.default_rng(0)
+    ratings = [((28,), True)]
+    picks = {recommender.recommend(matrix, ratings, exclude_ids={1}, rng=rng) for _ in range(200)}
+    assert 1 not in picks and 2 in picks
+    picks = {recommender.recommend(matrix, ratings, exclude_ids={1}, genre_ids=[35, 18], rng=rng) for _ in range(50)}
+    assert picks == {3, 4}
+    assert recommender.recommend(matrix, ratings, exclude_ids={3}, genre_ids=[35]) is None
+
+def test_recommend_scales_to_large_catalogs():
+    rng = np.random.default_rng(1)
+    catalog = _catalog({mid: rng.choice(19, size=2, replace=False).tolist() for mid in range(100000)})
+    matrix = catalog.genre_matrix()
+    ratings = [((int(g),), bool(g % 2)) for g in range(19)]
+    recommender.recommend(matrix, ratings, exclude_ids=set(range(500)))
+    start = time.perf_counter()
+    for _ in range(20):
+        recommender.recommend(matrix, ratings, exclude_ids=set(range(500)), genre_ids=[3, 4])
+    assert (time.perf_counter() - start) / 20 < 0.05
+
+def test_rank_samples_without_replacement_and_rescore_follows_new_ratings():
+    matrix = _catalog({1: [28], 2: [28], 3: [35], 4: [18]}).genre_matrix()
+    ids, scores, noise = recommender.rank(matrix, [((28,), True)], exclude_ids={2}, k=10, rng=np.random.default_rng(0))
+    assert sorted(ids.tolist()) == [1, 3, 4]
+    assert list(scores + noise) == sorted(scores + noise, reverse=True)
+    # Liked genres come first far more often than not
+    firsts = [int(recommender.rank(matrix, [((28,), True)], k=1, rng=np.random.default_rng(seed))[0][0]) for seed in range(200)]
+    assert sum(first in (1, 2) for first in firsts) > 150
+
+    rescored = recommender.rescore(matrix, [((35,), True)], [1, 3, 99])
+    assert rescored[1] > rescored[0] and rescored[2] == 0
+
+def test_rank_group_vetoes_dislikes_and_favours_the_least_happy_member():
+    matrix = _catalog({1: [28], 2: [35], 3: [28, 35], 4: [18]}).genre_matrix()
+    action_fan = [((28,), True)]
+    comedy_fan = [((35,), True)]
+    ids, scores, member_scores = recommender.rank_group(matrix, [action_fan, comedy_fan], [set(), set()], [set(), {4}], k=10)
+    assert ids.tolist()[0] == 3 # The movie both can enjoy beats each member's favourite
+    assert 4 not in ids.tolist()
+    assert member_scores.shape == (3, 2)
+    ids, _, _ = recommender.rank_group(matrix, [action_fan, comedy_fan], [{2}, {2}], [set(), set()], k=1)
+    assert ids.tolist() == [2] # Liked by everyone
+
+def test_rank_group_scales_to_ten_members_and_large_catalogs():
+    rng = np.random.default_rng(2)
+    catalog = _catalog({mid: rng.choice(19, size=2, replace=False).tolist() for mid in range(100000)})
+    matrix = catalog.genre_matrix()
+    members = [[((int(g),), bool(rng.random() < 0.7)) for g in rng.choice(19, size=200)] for _ in range(10)]
+    liked = [set(rng.choice(100000, size=200).tolist()) for _ in range(10)]
+    disliked = [set(rng.choice(100000, size=100).tolist()) for _ in range(10)]
+    recommender.rank_group(matrix, members, liked, disliked, k=100)
+    start = time.perf_counter()
+    for _ in range(5):
+        ids, _, _ = recommender.rank_group(matrix, members, liked, disliked, k=100, extra_scores=np.zeros((100000, 10), dtype=np.float32))
+    assert (time.perf_counter() - start) / 5 < 0.25
+    assert not set(ids.tolist()) & set().union(*disliked)
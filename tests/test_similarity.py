@@ -0,0 +1,47 @@
+import os
+import shutil
+import numpy as np
+import similarity
+
+MOVIES = [
+    (1, 'A space crew fights an alien on a distant planet', [878, 28], 'Sigourney Weaver, Tom Skerritt'),
+    (2, 'An alien hunts soldiers on a planet colony in space', [878, 28], 'Sigourney Weaver, Michael Biehn'),
+    (3, 'Two friends fall in love in Paris', [10749, 35], 'Audrey Tautou'),
+    (4, 'A romantic comedy about love letters in Paris', [10749, 35], 'Audrey Tautou, Mathieu Kassovitz'),
+    (5, 'A detective investigates a murder in the rain', [80, 53], 'Morgan Freeman'),
+]
+
+def test_build_ranks_overlapping_movies_first(tmp_path):
+    similarity.build(str(tmp_path), MOVIES, dim=128, k=3)
+    index = similarity.IndexHandle(str(tmp_path)).get()
+    assert isinstance(index.neighbours, np.memmap) # Shared through the page cache, not copied
+    assert [movie_id for movie_id, _ in index.similar(1)][0] == 2
+    assert [movie_id for movie_id, _ in index.similar(4)][0] == 3
+    assert all(movie_id != 5 for movie_id, _ in index.similar(5))
+    assert index.similar(999) is None
+
+def test_update_adds_movies_and_refreshes_existing_neighbours(tmp_path):
+    handle = similarity.IndexHandle(str(tmp_path), check_interval=0)
+    similarity.build(str(tmp_path), MOVIES[:4], dim=128, k=2)
+    old_version = handle.get().version
+    sequel = (6, 'A detective hunts a killer through the rain', [80, 53], 'Morgan Freeman, Brad Pitt')
+    similarity.update(handle.get(), [MOVIES[4], sequel, MOVIES[0]]) # Movie 1 is already indexed
+    index = handle.get()
+    assert index.version != old_version
+    assert index.ids.tolist() == [1, 2, 3, 4, 5, 6]
+    assert index.similar(5)[0][0] == 6
+    assert index.similar(6)[0][0] == 5
+    assert index.similar(1)[0][0] == 2
+    assert len(index.similar(3)) == 2
+
+def test_writes_keep_the_previous_version_and_remove_older_ones(tmp_path):
+    versions = [similarity.build(str(tmp_path), MOVIES, dim=64, k=2) for _ in range(3)]
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith('v')) == versions[1:]
+
+def test_handle_keeps_serving_when_the_live_version_is_missing(tmp_path):
+    handle = similarity.IndexHandle(str(tmp_path), check_interval=0)
+    old_version = similarity.build(str(tmp_path), MOVIES, dim=64, k=2)
+    assert handle.get().version == old_version
+    shutil.rmtree(tmp_path / similarity.build(str(tmp_path), MOVIES[:3], dim=64, k=2))
+    assert handle.get().version == old_version
+    assert similarity.IndexHandle(str(tmp_path)).get() is None # Nothing mapped yet: callers answer 503
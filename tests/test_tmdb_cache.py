@@ -0,0 +1,38 @@
+import requests_mock
+from tmdb_cache import ResponseCache, MISSING
+from tmdb_client import TMDbClient
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set('search/movie', 'a', {'n': 1})
+    cache.set('search/movie', 'b', {'n': 2})
+    cache.get('search/movie', 'a')
+    cache.set('search/movie', 'c', {'n': 3})
+    assert cache.get('search/movie', 'b') is MISSING
+    assert cache.get('search/movie', 'a') == {'n': 1}
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_and_uncached_endpoints_are_skipped():
+    cache = ResponseCache(ttls={'search/movie': -1, 'genre/movie/list': 60})
+    cache.set('search/movie', 'q', {'results': []})
+    cache.set('movie/top_rated', 'p1', {'results': []})
+    assert cache.get('search/movie', 'q') is MISSING
+    assert cache.get('movie/top_rated', 'p1') is MISSING
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'tmdb_cache.db')
+    ResponseCache(path).set('genre/movie/list', 'k', {'genres': [{'id': 28, 'name': 'Action'}]})
+    other_worker = ResponseCache(path)
+    assert other_worker.get('genre/movie/list', 'k') == {'genres': [{'id': 28, 'name': 'Action'}]}
+    assert other_worker.stats()['disk_hits'] == 1
+
+def test_client_serves_repeat_lookups_from_cache():
+    client = TMDbClient('key', cache=ResponseCache())
+    with requests_mock.Mocker() as m:
+        m.get('https://api.themoviedb.org/3/search/movie', json={'results': [{'id': 3}]})
+        for _ in range(3):
+            assert client.get('/search/movie', params={'query': 'Alien'}) == {'results': [{'id': 3}]}
+        assert m.call_count == 1
+        client.get('/search/movie', params={'query': 'Alien'}, use_cache=False)
+        assert m.call_count == 2
+    assert client.stats()['cache']['memory_hits'] == 2
@@ -0,0 +1,52 @@
+import pytest
+import requests
+import requests_mock
+from tmdb_client import TMDbClient, CircuitBreaker, CircuitOpenError
+
+BASE = 'https://api.themoviedb.org/3'
+
+@pytest.fixture
+def tmdb_client():
+    client = TMDbClient('key', max_retries=2, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    client.sleeps = []
+    client._sleep = client.sleeps.append
+    return client
+
+def test_get_sends_api_key_and_returns_json(tmdb_client):
+    with requests_mock.Mocker() as m:
+        m.get(f'{BASE}/movie/7', json={'id': 7})
+        assert tmdb_client.get('/movie/7', params={'language': 'en-US'}) == {'id': 7}
+        assert m.last_request.qs['api_key'] == ['key']
+    stats = tmdb_client.stats()['endpoints']['movie/{id}']
+    assert stats['calls'] == 1 and stats['status'] == {'200': 1}
+
+def test_retries_429_honouring_retry_after(tmdb_client):
+    with requests_mock.Mocker() as m:
+        m.get(f'{BASE}/search/movie', [
+            {'status_code': 429, 'headers': {'Retry-After': '2'}},
+            {'json': {'results': []}},
+        ])
+        assert tmdb_client.get('/search/movie') == {'results': []}
+    assert tmdb_client.sleeps == [2.0]
+    assert tmdb_client.stats()['endpoints']['search/movie']['retries'] == 1
+
+def test_breaker_opens_after_repeated_failures(tmdb_client):
+    with requests_mock.Mocker() as m:
+        m.get(f'{BASE}/movie/top_rated', status_code=503)
+        for _ in range(2):
+            with pytest.raises(requests.exceptions.HTTPError):
+                tmdb_client.get('/movie/top_rated')
+        calls = m.call_count
+        with pytest.raises(CircuitOpenError):
+            tmdb_client.get('/movie/top_rated')
+        assert m.call_count == calls
+    assert tmdb_client.stats()['circuit'] == 'open'
+
+def test_client_errors_do_not_trip_breaker(tmdb_client):
+    with requests_mock.Mocker() as m:
+        m.get(f'{BASE}/movie/1', status_code=404)
+        for _ in range(3):
+            with pytest.raises(requests.exceptions.HTTPError):
+                tmdb_client.get('/movie/1')
+        assert m.call_count == 3
+    assert tmdb_client.stats()['circuit'] == 'closed'
@@ -0,0 +1,143 @@
+"""Two-tier cache for decoded TMDb responses.
+
+A bounded in-process LRU sits in front of a SQLite table that every gunicorn
+worker on the host shares, so one worker's miss becomes the others' hit.
+Entries expire per endpoint (see ``DEFAULT_TTLS``); endpoints without a TTL
+are never cached.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+DEFAULT_TTLS = {
+    'genre/movie/list': 3 * DAY,
+    'movie/{id}': 14 * DAY, # Details with appended videos and credits
+    'movie/{id}/videos': 14 * DAY,
+    'movie/{id}/credits': 14 * DAY,
+    'search/movie': 10 * MINUTE,
+}
+
+MISSING = object()
+
+
+class ResponseCache:
+    def __init__(self, path=None, ttls=None, max_entries=2048, max_disk_entries=200000):
+        self.path = path or None
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'disk_evictions': 0}
+        if self.path:
+            with self._connect() as conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS tmdb_response_cache ('
+                    'key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, body TEXT NOT NULL, expires_at REAL NOT NULL)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS ix_tmdb_response_cache_expires ON tmdb_response_cache (expires_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+        return conn
+
+    def ttl_for(self, endpoint):
+        return self.ttls.get(endpoint, 0)
+
+    def get(self, endpoint, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+                self._counters['expired'] += 1
+        if self.path:
+            try:
+                row = self._connect().execute(
+                    'SELECT body, expires_at FROM tmdb_response_cache WHERE key = ?', (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"ERROR: TMDb response cache read failed. Error: {e}")
+                row = None
+            if row and row[1] > now:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+                return value
+        with self._lock:
+            self._counters['misses'] += 1
+        return MISSING
+
+    def set(self, endpoint, key, value):
+        ttl = self.ttl_for(endpoint)
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        if self.path:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    'INSERT OR REPLACE INTO tmdb_response_cache (key, endpoint, body, expires_at) VALUES (?, ?, ?, ?)',
+                    (key, endpoint, json.dumps(value), expires_at),
+                )
+                with self._lock:
+                    self._writes += 1
+                    purge = self._writes % 500 == 0
+                if purge:
+                    self._purge_disk(conn)
+            except sqlite3.Error as e:
+                print(f"ERROR: TMDb response cache write failed. Error: {e}")
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def _purge_disk(self, conn):
+        conn.execute('DELETE FROM tmdb_response_cache WHERE expires_at <= ?', (time.time(),))
+        overflow = conn.execute('SELECT COUNT(*) FROM tmdb_response_cache').fetchone()[0] - self.max_disk_entries
+        if overflow > 0:
+            # Drop the entries closest to expiry first
+            conn.execute(
+                'DELETE FROM tmdb_response_cache WHERE key IN '
+                '(SELECT key FROM tmdb_response_cache ORDER BY expires_at LIMIT ?)', (overflow,)
+            )
+            with self._lock:
+                self._counters['disk_evictions'] += overflow
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            self._connect().execute('DELETE FROM tmdb_response_cache')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,190 @@
+"""Shared HTTP client for the TMDb API.
+
+One pooled ``requests.Session`` per process, connect/read timeouts, retries
+with jittered exponential backoff that honour ``Retry-After``, a circuit
+breaker that fails fast while TMDb is down, and per-endpoint call stats.
+Successful responses can be served from an optional ``tmdb_cache.ResponseCache``.
+"""
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tmdb_cache import MISSING
+
+TMDB_API_BASE_URL = "https://api.themoviedb.org/3"
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without touching the network while the breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: let one trial call through and hold the others back
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class TMDbClient:
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key, base_url=TMDB_API_BASE_URL, timeout=(3.05, 10), max_retries=3,
+                 backoff_factor=0.5, max_backoff=30, pool_maxsize=16, breaker=None, cache=None, on_request=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.pool_maxsize = pool_maxsize
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache
+        self.on_request = on_request # Called as on_request(endpoint, seconds, status) after every attempt
+        self._sleep = time.sleep
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @property
+    def session(self):
+        # gunicorn forks workers; never share sockets with the parent process
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def get(self, path, params=None, endpoint=None, use_cache=True):
+        """GETs ``path`` and returns the decoded JSON body.
+
+        Raises ``requests.exceptions.RequestException`` subclasses on failure
+        (``HTTPError`` for error statuses, ``CircuitOpenError`` while the
+        breaker is open) and ``ValueError`` for an undecodable body.
+        """
+        endpoint = endpoint or re.sub(r'/\d+', '/{id}', path).strip('/')
+        cache_key = None
+        if use_cache and self.cache is not None and self.cache.ttl_for(endpoint) > 0:
+            cache_key = path + '?' + '&'.join(f'{k}={v}' for k, v in sorted((params or {}).items()))
+            cached = self.cache.get(endpoint, cache_key)
+            if cached is not MISSING:
+                return cached
+        if not self.breaker.allow():
+            self._record(endpoint, 0.0, 'circuit_open', error=True)
+            raise CircuitOpenError(f"TMDb circuit breaker is open; skipping {endpoint}")
+
+        query = dict(params or {})
+        query['api_key'] = self.api_key
+        url = self.base_url + path
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, params=query, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(endpoint, time.monotonic() - started, type(e).__name__, error=True)
+                if attempt < self.max_retries:
+                    attempt += 1
+                    self._sleep(self._backoff(attempt))
+                    continue
+                self.breaker.record_failure()
+                raise
+            elapsed = time.monotonic() - started
+            status = response.status_code
+            if status in self.RETRY_STATUSES and attempt < self.max_retries:
+                self._record(endpoint, elapsed, status, error=True, retried=True)
+                attempt += 1
+                self._sleep(self._backoff(attempt, response.headers.get('Retry-After')))
+                continue
+            self._record(endpoint, elapsed, status, error=status >= 400)
+            if status >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            response.raise_for_status()
+            data = response.json()
+            if cache_key is not None:
+                self.cache.set(endpoint, cache_key, data)
+            return data
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self.max_backoff)
+        # Full jitter keeps workers that failed together from retrying together
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    def _record(self, endpoint, elapsed, status, error=False, retried=False):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'status': {},
+            })
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['retries'] += int(retried)
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            stats['status'][str(status)] = stats['status'].get(str(status), 0) + 1
+        if self.on_request is not None:
+            self.on_request(endpoint, elapsed, status)
+
+    def stats(self):
+        with self._lock:
+            snapshot = {}
+            for endpoint, stats in self._stats.items():
+                snapshot[endpoint] = dict(stats, status=dict(stats['status']))
+                snapshot[endpoint]['avg_seconds'] = stats['total_seconds'] / stats['calls'] if stats['calls'] else 0.0
+        stats = {'circuit': self.breaker.state, 'endpoints': snapshot}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats